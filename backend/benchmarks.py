@@ -0,0 +1,559 @@
+"""Performance benchmarks for the liquor data backend.
+
+Run from the backend directory:
+
+    python benchmarks.py parse --rows 1000 10000 100000
+    python benchmarks.py parallel --rows 100000 --workers 2 4 8
+    python benchmarks.py d1 --rows 100 1000 10000 --days 365
+    python benchmarks.py stream-memory --rows 1000 4000 16000
+    python benchmarks.py stream-memory --format csv --rows 10000 40000
+    python benchmarks.py projection --rows 10000
+    python benchmarks.py export --rows 1000 10000 50000
+    python benchmarks.py documents --rows 100000
+    python benchmarks.py parse-cache --rows 1000 10000 50000
+    python benchmarks.py append --rows 1000 10000 50000 --days 90
+
+No MongoDB server is needed; the benchmarks only exercise the parsing,
+computation and BSON encoding code paths used by server.py.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'liquor_benchmarks')
+
+import server  # noqa: E402
+
+
+def make_stock_sheet(
+    rows: int, days: int = 90, seed: int = 0, text_cells: bool = True, restock_day: Optional[int] = None
+) -> pd.DataFrame:
+    """Build a synthetic stock sheet: Index, Brand Name, rates and one stock column per day"""
+    rng = np.random.default_rng(seed)
+    start = date(2025, 1, 1)
+    date_labels = [(start + timedelta(days=offset)).strftime('%d-%b') for offset in range(days)]
+
+    opening = rng.integers(50, 500, size=rows)
+    daily_sales = rng.integers(0, 6, size=(rows, days))
+    daily_sales[:, 0] = 0
+    stock = opening[:, None] - np.cumsum(daily_sales, axis=1)
+    # Restock a few brands part way through the period
+    restocked = rng.random(rows) < 0.05
+    stock[restocked, days // 3 if restock_day is None else restock_day:] += 200
+    stock = np.maximum(stock, 0).astype(float)
+    stock[rng.random((rows, days)) < 0.01] = np.nan
+
+    selling = rng.integers(100, 3000, size=rows).astype(float)
+    data: Dict[str, Any] = {
+        'Index': np.arange(1, rows + 1),
+        'Brand Name': [f'Brand {number:06d}' for number in range(rows)],
+        'Wholesale Rate': np.round(selling * 0.9, 2),
+        'Selling Rate': selling,
+    }
+    for position, label in enumerate(date_labels):
+        data[label] = stock[:, position]
+    df = pd.DataFrame(data)
+
+    if text_cells and rows:
+        # A sprinkling of text cells such as "1,250" forces the per-cell fallback on a column
+        column = date_labels[-1]
+        df[column] = df[column].astype(object)
+        df.loc[df.index[::97], column] = '1,250'
+    return df
+
+
+def row_loop_brand_records(
+    df: pd.DataFrame,
+    brand_col: str,
+    index_col: Optional[str],
+    wholesale_rate_col: Optional[str],
+    selling_rate_col: Optional[str],
+    date_columns: List[str],
+    global_D1_date: str,
+) -> List[Dict[str, Any]]:
+    """Row-at-a-time brand computation, as parse_tabular_format did it before vectorization"""
+    import re
+    liquor_data = []
+    sorted_dates = sorted(date_columns)
+    for idx, row in df.iterrows():
+        try:
+            brand_name = str(row[brand_col]).strip()
+            if not brand_name or brand_name.lower() in ['nan', 'none', '']:
+                continue
+            index_num = idx + 1
+            if index_col and pd.notna(row[index_col]):
+                try:
+                    numeric_match = re.search(r'\d+', str(row[index_col]).strip())
+                    index_num = int(numeric_match.group()) if numeric_match else int(float(row[index_col]))
+                except:
+                    index_num = idx + 1
+            wholesale_rate = 0.0
+            selling_rate = 0.0
+            if wholesale_rate_col and pd.notna(row[wholesale_rate_col]):
+                try:
+                    wholesale_rate = float(row[wholesale_rate_col])
+                except:
+                    pass
+            if selling_rate_col and pd.notna(row[selling_rate_col]):
+                try:
+                    selling_rate = float(row[selling_rate_col])
+                except:
+                    pass
+            if wholesale_rate == 0 and selling_rate > 0:
+                wholesale_rate = selling_rate * 0.9
+            elif selling_rate == 0 and wholesale_rate > 0:
+                selling_rate = wholesale_rate / 0.9
+
+            daily_stock_data = {}
+            valid_stock_values = []
+            for date_col in date_columns:
+                raw_value = row[date_col]
+                if pd.notna(raw_value) and str(raw_value).strip() != '':
+                    try:
+                        stock_qty = float(raw_value)
+                    except (ValueError, TypeError):
+                        try:
+                            stock_qty = float(str(raw_value).replace(',', ''))
+                        except:
+                            stock_qty = 0
+                    daily_stock_data[date_col] = stock_qty
+                    if stock_qty >= 0:
+                        valid_stock_values.append((date_col, stock_qty))
+                else:
+                    daily_stock_data[date_col] = 0
+            if not valid_stock_values:
+                continue
+
+            sorted_stock_values = sorted(valid_stock_values, key=lambda x: x[0])
+            D1_date = global_D1_date
+            D1_stock = daily_stock_data.get(global_D1_date, 0)
+            if D1_stock == 0:
+                for date_col, stock_val in sorted_stock_values:
+                    if date_col <= global_D1_date:
+                        D1_stock = stock_val
+                    else:
+                        break
+            DL_date = sorted_dates[-1]
+            DL_stock = daily_stock_data.get(DL_date, 0)
+            if DL_stock == 0:
+                DL_date, DL_stock = sorted_stock_values[-1]
+
+            total_sales_qty = max(0, D1_stock - DL_stock)
+            days_between = max(1, date_columns.index(DL_date) - date_columns.index(D1_date) + 1)
+            avg_daily_sales_qty = total_sales_qty / days_between if days_between > 0 else 0
+            monthly_sales_qty = avg_daily_sales_qty * 24
+            monthly_sales_value = monthly_sales_qty * selling_rate
+            current_stock_value = DL_stock * selling_rate
+            stock_ratio = current_stock_value / max(1, monthly_sales_value) if monthly_sales_value > 0 else 0
+            stock_available_days = (DL_stock / max(0.1, avg_daily_sales_qty)) if avg_daily_sales_qty > 0 else 999
+
+            liquor_data.append({
+                'brand_name': brand_name,
+                'product_id': f"ID_{index_num}",
+                'index_number': int(index_num),
+                'wholesale_rate': float(wholesale_rate),
+                'selling_rate': float(selling_rate),
+                'rate': float(selling_rate),
+                'D1_date': str(D1_date),
+                'D1_stock': float(D1_stock),
+                'DL_date': str(DL_date),
+                'DL_stock': float(DL_stock),
+                'current_stock_qty': int(max(0, DL_stock)),
+                'total_sales_qty': float(total_sales_qty),
+                'avg_daily_sales_qty': float(avg_daily_sales_qty),
+                'monthly_sales_qty': float(monthly_sales_qty),
+                'monthly_sale_value': float(monthly_sales_value),
+                'monthly_sale_qty': int(max(0, monthly_sales_qty)),
+                'stock_value_today': float(current_stock_value),
+                'stock_ratio': float(stock_ratio),
+                'stock_available_days': float(min(999, max(0, stock_available_days))),
+                'avg_daily_sale': float(monthly_sales_value / 30),
+                'stock_value_before': float(D1_stock * selling_rate),
+                'daily_sales': daily_stock_data,
+                'days_analyzed': int(max(1, days_between)),
+            })
+        except Exception:
+            continue
+    return liquor_data
+
+
+def row_loop_global_d1(df: pd.DataFrame, brand_col: str, date_columns: List[str]) -> str:
+    """Dict-of-dicts D1 scan over brand pairs, as parse_tabular_format did it before vectorization"""
+    all_brand_stock_data = {}
+    for idx, row in df.iterrows():
+        brand_name = str(row[brand_col]).strip()
+        if not brand_name or brand_name.lower() in ['nan', 'none', '']:
+            continue
+        brand_stock_data = {}
+        for date_col in date_columns:
+            if pd.notna(row[date_col]):
+                try:
+                    brand_stock_data[date_col] = float(row[date_col])
+                except:
+                    brand_stock_data[date_col] = 0
+        if brand_stock_data:
+            all_brand_stock_data[brand_name] = brand_stock_data
+
+    sorted_dates = sorted(date_columns)
+    for i in range(1, len(sorted_dates)):
+        prev_date = sorted_dates[i - 1]
+        curr_date = sorted_dates[i]
+        for stock_data in all_brand_stock_data.values():
+            if prev_date in stock_data and curr_date in stock_data and stock_data[curr_date] > stock_data[prev_date]:
+                return curr_date
+    return sorted_dates[0]
+
+
+def write_xlsx(df: pd.DataFrame, path: str) -> None:
+    """Write a sheet with openpyxl's write-only mode, which is much faster than DataFrame.to_excel"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(df.columns))
+    for row in df.itertuples(index=False):
+        sheet.append([None if isinstance(value, float) and np.isnan(value) else value for value in row])
+    workbook.save(path)
+
+
+def dataframe_demand_workbook(rows: List[Dict[str, Any]]) -> bytes:
+    """Styled demand workbook built through a DataFrame and pd.ExcelWriter, as the export did before streaming"""
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    df = pd.DataFrame(rows)
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Demand Forecast', index=False)
+        worksheet = writer.sheets['Demand Forecast']
+        for column_letter, width in {'A': 10, 'B': 30, 'C': 16, 'D': 18, 'E': 18, 'F': 20, 'G': 22}.items():
+            worksheet.column_dimensions[column_letter].width = width
+        for col in range(1, 8):
+            cell = worksheet.cell(row=1, column=col)
+            cell.font = Font(bold=True, color="FFFFFF")
+            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+            cell.alignment = Alignment(horizontal="center")
+        border = Border(top=Side(border_style="thick", color="366092"), bottom=Side(border_style="thick", color="366092"),
+                        left=Side(border_style="thin", color="366092"), right=Side(border_style="thin", color="366092"))
+        for col in range(1, 8):
+            cell = worksheet.cell(row=len(rows) + 1, column=col)
+            cell.font = Font(bold=True)
+            cell.fill = PatternFill(start_color="E8F4FD", end_color="E8F4FD", fill_type="solid")
+            cell.border = border
+            cell.alignment = Alignment(horizontal="center")
+    return output.getvalue()
+
+
+def make_demand_plan(rows: int, seed: int = 0) -> List[Any]:
+    """Synthetic (recommendation, brand record) pairs as build_demand_plan returns them"""
+    rng = np.random.default_rng(seed)
+    plan = []
+    for number in range(rows):
+        recommended_qty = int(rng.integers(1, 500))
+        plan.append((
+            server.DemandRecommendation(
+                brand_name=f'Brand {number:06d}', selling_rate=float(rng.integers(100, 3000)),
+                wholesale_rate=float(rng.integers(90, 2700)), current_stock_qty=int(rng.integers(0, 200)),
+                recommended_qty=recommended_qty, urgency_level='HIGH',
+            ),
+            {'index_number': number + 1, 'monthly_sale_qty': recommended_qty + 10},
+        ))
+    return plan
+
+
+def model_liquor_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The document a parsed record became when each one was validated through a LiquorData model"""
+    document = server.LiquorData(**item_data).model_dump()
+    document['content_hash'] = server.record_content_hash(document)
+    return document
+
+
+def _peak_memory(function: Callable[[], Any]) -> float:
+    """Peak traced allocation in MB while running `function`"""
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def _time(function: Callable[[], Any], repeat: int = 1) -> float:
+    """Best wall-clock time of `repeat` runs, with stdout silenced"""
+    best = float('inf')
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_parse(args: argparse.Namespace) -> None:
+    """Vectorized brand computation vs the row-at-a-time loop"""
+    print(f"{'rows':>8} {'vectorized':>12} {'row loop':>12} {'speedup':>9}")
+    for rows in args.rows:
+        df = make_stock_sheet(rows, args.days)
+        date_columns = server.chronological_dates(df.columns[4:])
+        columns = (df, 'Brand Name', 'Index', 'Wholesale Rate', 'Selling Rate', date_columns, date_columns[args.days // 3])
+        vectorized = _time(lambda: server.build_brand_records(*columns), args.repeat)
+        if rows > args.max_loop_rows:
+            print(f"{rows:>8} {vectorized:>11.3f}s {'-':>12} {'-':>9}")
+            continue
+        row_loop = _time(lambda: row_loop_brand_records(*columns))
+        print(f"{rows:>8} {vectorized:>11.3f}s {row_loop:>11.3f}s {row_loop / vectorized:>8.1f}x")
+
+
+def bench_parallel(args: argparse.Namespace) -> None:
+    """Brand computation in the parsing process vs row blocks in BRAND_WORKERS processes"""
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'rows':>8} {'workers':>8} {'serial':>10} {'parallel':>10} {'speedup':>9}")
+    for rows in args.rows:
+        df = make_stock_sheet(rows, args.days)
+        date_columns = server.chronological_dates(df.columns[4:])
+        columns = (df, 'Brand Name', 'Index', 'Wholesale Rate', 'Selling Rate', date_columns, date_columns[args.days // 3])
+        serial = _time(lambda: server.build_brand_records(*columns), args.repeat)
+        for workers in args.workers:
+            server.shutdown_executors()
+            server.BRAND_WORKERS = workers
+            # Start the worker processes before timing
+            server.build_brand_records_parallel(df.head(workers), *columns[1:])
+            parallel = _time(lambda: server.build_brand_records_parallel(*columns), args.repeat)
+            print(f"{rows:>8} {workers:>8} {serial:>9.2f}s {parallel:>9.2f}s {serial / parallel:>8.2f}x")
+    server.shutdown_executors()
+
+
+def bench_d1(args: argparse.Namespace) -> None:
+    """Vectorized global D1 detection vs the dict-of-dicts scan on wide sheets"""
+    print(f"{'rows':>8} {'dates':>6} {'vectorized':>12} {'scan':>12} {'speedup':>9}")
+    for rows in args.rows:
+        df = make_stock_sheet(rows, args.days, text_cells=False, restock_day=args.days - 5)
+        date_columns = sorted(df.columns[4:])
+        vectorized = _time(lambda: server.find_global_d1(df, 'Brand Name', date_columns), args.repeat)
+        scan = _time(lambda: row_loop_global_d1(df, 'Brand Name', date_columns))
+        assert server.find_global_d1(df, 'Brand Name', date_columns) == row_loop_global_d1(df, 'Brand Name', date_columns)
+        print(f"{rows:>8} {args.days:>6} {vectorized:>11.3f}s {scan:>11.3f}s {scan / vectorized:>8.1f}x")
+
+
+def bench_stream_memory(args: argparse.Namespace) -> None:
+    """Peak memory of the in-memory parse vs the streaming reader for xlsx or CSV uploads"""
+    def in_memory(path: str) -> None:
+        with open(path, 'rb') as source:
+            server.parse_excel_data(source.read())
+
+    def streaming(path: str) -> None:
+        with open(path, 'rb') as source:
+            for _ in server.parse_upload_stream(source):
+                pass  # batches are written and dropped by the upload endpoint
+
+    server.STREAM_CHUNK_ROWS = args.chunk_rows
+    print(f"{'rows':>8} {'file':>9} {'in-memory':>11} {'streaming':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = os.path.join(directory, f'stock_{rows}.{args.format}')
+            sheet = make_stock_sheet(rows, args.days, text_cells=False)
+            if args.format == 'csv':
+                sheet.to_csv(path, index=False)
+            else:
+                write_xlsx(sheet, path)
+            size = os.path.getsize(path) / 2 ** 20
+            print(f"{rows:>8} {size:>7.1f}MB {_peak_memory(lambda: in_memory(path)):>9.1f}MB "
+                  f"{_peak_memory(lambda: streaming(path)):>9.1f}MB")
+
+
+def bench_projection(args: argparse.Namespace) -> None:
+    """BSON bytes and decode time per read endpoint, whole documents vs projected records
+
+    Bytes are the encoded documents a cursor returns, without the reply framing.
+    """
+    import bson
+
+    sheet = make_stock_sheet(args.rows, args.days)
+    documents = [{**document, 'dataset_versions': ['benchmark']} for document in server.build_liquor_batch(server.parse_tabular_format(sheet))]
+    full = [{'_id': bson.ObjectId(), **document} for document in documents]
+    full_bytes = b''.join(bson.encode(document) for document in full)
+    full_decode = _time(lambda: bson.decode_all(full_bytes), args.repeat)
+
+    endpoints = {
+        # Analytics, charts, recommendations and calculation details share one columnar load
+        'columnar dataset': server.DatasetRecord,
+        '/api/brands': None,
+    }
+    print(f"{args.rows} brands, {args.days} days")
+    print(f"{'endpoint':<30} {'before':>10} {'after':>10} {'ratio':>7} {'decode before':>14} {'decode after':>13}")
+    for endpoint, record_type in endpoints.items():
+        projection = server.record_projection(record_type)
+        if record_type is None:
+            projected = [{key: value for key, value in document.items() if key not in projection} for document in full]
+        else:
+            projected = [{key: document[key] for key in projection if key in document} for document in full]
+        projected_bytes = b''.join(bson.encode(document) for document in projected)
+        projected_decode = _time(lambda: bson.decode_all(projected_bytes), args.repeat)
+        print(f"{endpoint:<30} {len(full_bytes) / 2 ** 20:>8.2f}MB {len(projected_bytes) / 2 ** 20:>8.2f}MB "
+              f"{len(full_bytes) / len(projected_bytes):>6.1f}x {full_decode * 1000:>12.1f}ms {projected_decode * 1000:>11.1f}ms")
+
+
+def bench_export(args: argparse.Namespace) -> None:
+    """Demand export time and peak memory: DataFrame + ExcelWriter vs the streamed write-only workbook"""
+    def streamed(plan: List[Any]) -> None:
+        for _ in server.demand_workbook_chunks(server.demand_export_rows(plan)):
+            pass
+
+    print(f"{'rows':>8} {'dataframe':>11} {'streamed':>10} {'speedup':>8} {'dataframe mem':>14} {'streamed mem':>13}")
+    for rows in args.rows:
+        plan = make_demand_plan(rows)
+        dataframe_time = _time(lambda: dataframe_demand_workbook(list(server.demand_export_rows(plan))), args.repeat)
+        streamed_time = _time(lambda: streamed(plan), args.repeat)
+        dataframe_memory = _peak_memory(lambda: dataframe_demand_workbook(list(server.demand_export_rows(plan))))
+        streamed_memory = _peak_memory(lambda: streamed(plan))
+        print(f"{rows:>8} {dataframe_time:>10.2f}s {streamed_time:>9.2f}s {dataframe_time / streamed_time:>7.1f}x "
+              f"{dataframe_memory:>12.1f}MB {streamed_memory:>11.1f}MB")
+
+
+def bench_documents(args: argparse.Namespace) -> None:
+    """Per-record cost of building upload documents: a LiquorData model each vs batch validation"""
+    def batches(records: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        return [records[start:start + args.batch_rows] for start in range(0, len(records), args.batch_rows)]
+
+    print(f"{'rows':>8} {'model':>10} {'batch':>10} {'hash':>10} {'speedup':>8}")
+    for rows in args.rows:
+        records = server.parse_tabular_format(make_stock_sheet(rows, args.days, text_cells=False))
+        strip = lambda document: {key: value for key, value in document.items() if key not in ('id', 'upload_timestamp')}
+        assert [strip(model_liquor_document(item)) for item in records[:100]] == [strip(document) for document in server.build_liquor_batch(records[:100])]
+        model = _time(lambda: [model_liquor_document(item) for item in records], args.repeat)
+        batch = _time(lambda: [server.build_liquor_batch(chunk) for chunk in batches(records)], args.repeat)
+        # Both paths stamp the same content hash, which is kept stable for incremental uploads
+        documents = server.build_liquor_batch(records)
+        content_hash = _time(lambda: [server.record_content_hash(document) for document in documents], args.repeat)
+        per_record = 1e6 / rows
+        print(f"{rows:>8} {model * per_record:>8.1f}us {batch * per_record:>8.1f}us {content_hash * per_record:>8.1f}us "
+              f"{model / batch:>7.2f}x")
+
+
+def bench_parse_cache(args: argparse.Namespace) -> None:
+    """Parsing a CSV upload without the parse cache, again unchanged, and again with one date column appended"""
+    def csv_upload(df: pd.DataFrame) -> bytes:
+        # Stock in the thousands written with separators, as many exports do, is read back as text
+        df = df.copy()
+        for column in df.columns[4:]:
+            df[column] = df[column].map(lambda value: '' if pd.isna(value) else f'{value * 10:,.0f}')
+        return df.to_csv(index=False).encode()
+
+    def appended_upload(previous: bytes, content: bytes) -> float:
+        with tempfile.TemporaryDirectory() as directory:
+            server.parse_cache = server.ParseCache(directory)
+            server.parse_upload_content(previous)
+            started = time.perf_counter()
+            server.parse_upload_content(content)
+            return time.perf_counter() - started
+
+    print(f"{'rows':>8} {'no cache':>10} {'identical':>10} {'appended':>10} {'speedup':>16}")
+    for rows in args.rows:
+        sheet = make_stock_sheet(rows, args.days + 1, text_cells=False)
+        content, previous = csv_upload(sheet), csv_upload(sheet.iloc[:, :-1])
+        server.parse_cache = server.ParseCache(max_bytes=0)
+        uncached = _time(lambda: server.parse_upload_content(content), args.repeat)
+        appended = min(appended_upload(previous, content) for _ in range(args.repeat))
+        with tempfile.TemporaryDirectory() as directory:
+            server.parse_cache = server.ParseCache(directory)
+            server.parse_upload_content(content)
+            identical = _time(lambda: server.parse_upload_content(content), args.repeat)
+        print(f"{rows:>8} {uncached:>9.3f}s {identical:>9.3f}s {appended:>9.3f}s "
+              f"{uncached / identical:>7.1f}x {uncached / appended:>7.1f}x")
+
+
+def bench_append(args: argparse.Namespace) -> None:
+    """Appending a day's stock to stored records vs re-parsing an xlsx sheet with the day's column"""
+    print(f"{'rows':>8} {'days':>5} {'append':>10} {'re-parse':>10} {'speedup':>8}")
+    for rows in args.rows:
+        sheet = make_stock_sheet(rows, args.days + 1, text_cells=False)
+        date_label = sheet.columns[-1]
+        buffer = io.BytesIO()
+        sheet.to_excel(buffer, index=False)
+        content = buffer.getvalue()
+        records = server.parse_tabular_format(sheet.drop(columns=date_label))
+        snapshot = server.StockSnapshot(date=date_label, stock={
+            name: int(stock) for name, stock in zip(sheet['Brand Name'], sheet[date_label]) if not np.isnan(stock)
+        })
+        server.parse_cache = server.ParseCache(max_bytes=0)
+        append = _time(lambda: server.build_appended_documents(records, snapshot), args.repeat)
+        reparse = _time(lambda: server.parse_upload_content(content), args.repeat)
+        print(f"{rows:>8} {args.days:>5} {append:>9.3f}s {reparse:>9.3f}s {reparse / append:>7.1f}x")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    parse = benchmarks.add_parser('parse', help=bench_parse.__doc__)
+    parse.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parse.add_argument('--days', type=int, default=90)
+    parse.add_argument('--repeat', type=int, default=3)
+    parse.add_argument('--max-loop-rows', type=int, default=100000, help='skip the slow row loop above this size')
+    parse.set_defaults(run=bench_parse)
+
+    parallel = benchmarks.add_parser('parallel', help=bench_parallel.__doc__)
+    parallel.add_argument('--rows', type=int, nargs='+', default=[100000])
+    parallel.add_argument('--days', type=int, default=90)
+    parallel.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parallel.add_argument('--repeat', type=int, default=3)
+    parallel.set_defaults(run=bench_parallel)
+
+    d1 = benchmarks.add_parser('d1', help=bench_d1.__doc__)
+    d1.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    d1.add_argument('--days', type=int, default=365)
+    d1.add_argument('--repeat', type=int, default=3)
+    d1.set_defaults(run=bench_d1)
+
+    stream_memory = benchmarks.add_parser('stream-memory', help=bench_stream_memory.__doc__)
+    stream_memory.add_argument('--rows', type=int, nargs='+', default=[1000, 4000, 16000])
+    stream_memory.add_argument('--days', type=int, default=90)
+    stream_memory.add_argument('--chunk-rows', type=int, default=2000)
+    stream_memory.add_argument('--format', choices=['xlsx', 'csv'], default='xlsx')
+    stream_memory.set_defaults(run=bench_stream_memory)
+
+    projection = benchmarks.add_parser('projection', help=bench_projection.__doc__.splitlines()[0])
+    projection.add_argument('--rows', type=int, default=10000)
+    projection.add_argument('--days', type=int, default=90)
+    projection.add_argument('--repeat', type=int, default=3)
+    projection.set_defaults(run=bench_projection)
+
+    export = benchmarks.add_parser('export', help=bench_export.__doc__)
+    export.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    export.add_argument('--repeat', type=int, default=1)
+    export.set_defaults(run=bench_export)
+
+    documents = benchmarks.add_parser('documents', help=bench_documents.__doc__)
+    documents.add_argument('--rows', type=int, nargs='+', default=[100000])
+    documents.add_argument('--days', type=int, default=90)
+    documents.add_argument('--batch-rows', type=int, default=server.STREAM_CHUNK_ROWS)
+    documents.add_argument('--repeat', type=int, default=3)
+    documents.set_defaults(run=bench_documents)
+
+    parse_cache = benchmarks.add_parser('parse-cache', help=bench_parse_cache.__doc__)
+    parse_cache.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    parse_cache.add_argument('--days', type=int, default=30)
+    parse_cache.add_argument('--repeat', type=int, default=3)
+    parse_cache.set_defaults(run=bench_parse_cache)
+
+    append = benchmarks.add_parser('append', help=bench_append.__doc__)
+    append.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    append.add_argument('--days', type=int, default=90)
+    append.add_argument('--repeat', type=int, default=3)
+    append.set_defaults(run=bench_append)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
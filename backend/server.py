@@ -1,18 +1,39 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, DeleteOne, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable, Iterator, AsyncIterator, NamedTuple
+# pydantic can only validate typing_extensions TypedDicts before Python 3.12
+from typing_extensions import TypedDict
 import uuid
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
 import io
+import csv
 import json
+import pickle
+import hashlib
+import re
+import asyncio
+import math
+import sys
+import tempfile
+import shutil
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing, contextmanager, suppress
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -54,6 +75,7 @@ class LiquorData(BaseModel):
     days_analyzed: int = Field(default=0)
     current_stock_qty: int = Field(default=0)
     upload_timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    content_hash: str = Field(default="")
 
 class OverstockConfig(BaseModel):
     multiplier: float = 3.0
@@ -81,58 +103,939 @@ class DemandRecommendation(BaseModel):
     recommended_qty: int
     urgency_level: str
 
-# Helper functions
-def parse_excel_data(file_content: bytes) -> List[Dict[str, Any]]:
-    """Parse Excel file and return structured data - supports both tabular and list formats"""
-    try:
-        # Try to read as Excel with headers first (tabular format)
+# Read-side records: the fields each endpoint reads, fetched with a matching projection.
+# They are plain dicts off the cursor, with no per-document validation.
+class AnalyticsRecord(TypedDict):
+    _id: Any  # breaks ties in the top-selling and overstock rankings
+    brand_name: str
+    daily_sales: Dict[str, int]
+    monthly_sale_value: float
+    stock_value_today: float
+    stock_ratio: float
+
+class ChartRecord(TypedDict, total=False):
+    brand_name: str
+    current_stock_qty: int
+    monthly_sale_value: float
+    stock_value_today: float
+    stock_available_days: float
+    stock_ratio: float
+
+class DemandRecord(TypedDict, total=False):
+    brand_name: str
+    index_number: int
+    rate: float
+    selling_rate: float
+    wholesale_rate: float
+    current_stock_qty: int
+    stock_available_days: float
+    monthly_sale_qty: int
+
+class CalculationRecord(TypedDict, total=False):
+    index_number: int
+    product_id: str
+    brand_name: str
+    wholesale_rate: float
+    selling_rate: float
+    rate: float
+    stock_value_today: float
+    monthly_sale_value: float
+    D1_date: str
+    D1_stock: float
+    DL_date: str
+    DL_stock: float
+    total_sales_qty: float
+    avg_daily_sales_qty: float
+    days_analyzed: int
+    stock_available_days: float
+
+class DatasetRecord(AnalyticsRecord, ChartRecord, DemandRecord, CalculationRecord, total=False):
+    """Every field the read endpoints use, as loaded into a ColumnarDataset"""
+
+def record_projection(record_type: Optional[type] = None) -> Dict[str, int]:
+    """Projection fetching exactly a record type's fields, or whole documents minus bookkeeping"""
+    if record_type is None:
+        return {'_id': 0, 'dataset_versions': 0}
+    return {'_id': 0, **dict.fromkeys(record_type.__annotations__, 1)}
+
+# Parse tracing
+PARSE_TRACE_MAX_EVENTS = int(os.environ.get('PARSE_TRACE_MAX_EVENTS', '10000'))
+PARSE_TRACE_HISTORY = int(os.environ.get('PARSE_TRACE_HISTORY', '20'))
+PARSE_TRACE_FILE = os.environ.get('PARSE_TRACE_FILE')
+
+class ParseTrace:
+    """Structured parse diagnostics kept in a bounded buffer and optionally appended to a JSONL file.
+
+    Call sites check `trace.enabled` before building an event, so a disabled trace costs nothing.
+    """
+    def __init__(self, enabled: bool = True, max_events: int = PARSE_TRACE_MAX_EVENTS, path: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+        self.dropped = 0
+        self._file = open(path, 'a') if enabled and path else None
+    
+    def event(self, kind: str, **fields: Any) -> None:
+        record = {'event': kind, **fields}
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(record)
+        if self._file:
+            self._file.write(json.dumps({'trace_id': self.id, **record}, default=str) + '\n')
+    
+    def merge(self, events: Iterable[Dict[str, Any]], dropped: int = 0) -> None:
+        """Append events recorded by a trace in another process"""
+        self.dropped += dropped
+        for record in events:
+            fields = dict(record)
+            self.event(fields.pop('event'), **fields)
+    
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    def summary(self) -> Dict[str, Any]:
+        return {'trace_id': self.id, 'events': list(self.events), 'dropped_events': self.dropped}
+
+NULL_TRACE = ParseTrace(enabled=False)
+
+# Most recent request traces, served by /api/parse-traces/{trace_id}
+recent_parse_traces: "OrderedDict[str, ParseTrace]" = OrderedDict()
+
+def remember_parse_trace(trace: ParseTrace) -> None:
+    trace.close()
+    recent_parse_traces[trace.id] = trace
+    while len(recent_parse_traces) > PARSE_TRACE_HISTORY:
+        recent_parse_traces.popitem(last=False)
+
+class UploadProgress:
+    """Counters a background upload advances as it parses and writes, reported by its job"""
+    def __init__(self):
+        self.rows_parsed = 0
+        self.brands_computed = 0
+        self.documents_written = 0
+    
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            'rows_parsed': self.rows_parsed,
+            'brands_computed': self.brands_computed,
+            'documents_written': self.documents_written,
+        }
+
+# Parse cache
+# Parsed uploads and decoded stock columns are kept on local disk, shared by every parse
+# worker process. PARSE_CACHE_BYTES=0 turns the cache off.
+PARSE_CACHE_DIR = Path(os.environ.get('PARSE_CACHE_DIR', str(Path(tempfile.gettempdir()) / 'liquor-parse-cache')))
+PARSE_CACHE_BYTES = int(os.environ.get('PARSE_CACHE_BYTES', str(256 * 1024 * 1024)))
+# Bump when the parser's output changes, so entries written by older code are never read
+PARSE_CACHE_FORMAT = 1
+
+class ParseCache:
+    """Files named by the SHA-256 of what they were computed from, evicted least recently used
+    first once the directory holds more than `max_bytes`.
+
+    Entries are written to a temporary file and renamed into place, so readers in other
+    processes never see a partial entry.
+    """
+    def __init__(self, directory: Path = PARSE_CACHE_DIR, max_bytes: int = PARSE_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key(self, *parts: bytes) -> str:
+        """Entry key of content parsed with the current parser settings"""
+        digest = hashlib.sha256(json.dumps([PARSE_CACHE_FORMAT, DATE_HEADER_FORMATS, DATE_HEADER_YEAR]).encode())
+        for part in parts:
+            digest.update(part)
+        return digest.hexdigest()
+
+    def open(self, name: str) -> Optional[Any]:
+        """The entry's file opened for reading, marked as recently used; None if there is no entry"""
+        path = self.directory / name
         try:
-            df = pd.read_excel(io.BytesIO(file_content))
-            
-            # Check if it looks like a tabular format (has typical column names)
-            if len(df.columns) >= 3 and any(col.lower().strip() in ['brand name', 'brand_name', 'product', 'name'] for col in df.columns):
-                return parse_tabular_format(df)
-            else:
-                # Try headerless format
-                df_headerless = pd.read_excel(io.BytesIO(file_content), header=None)
-                return parse_list_format(df_headerless)
-                
-        except Exception:
-            # If Excel fails, try CSV
+            entry = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with suppress(FileNotFoundError):
+            os.utime(path)
+        return entry
+
+    @contextmanager
+    def create(self, name: str) -> Iterator[Any]:
+        """A file to write the entry into; it replaces the entry only if the block completes"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False)
+        try:
+            with entry:
+                yield entry
+            os.replace(entry.name, self.directory / name)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.unlink(entry.name)
+            raise
+        self.evict()
+
+    def entries(self) -> List[Tuple[str, os.stat_result]]:
+        """(path, stat) of the complete entries, least recently used first"""
+        entries = []
+        with suppress(FileNotFoundError), os.scandir(self.directory) as scan:
+            for item in scan:
+                if not item.name.endswith('.tmp'):
+                    with suppress(FileNotFoundError):
+                        entries.append((item.path, item.stat()))
+        return sorted(entries, key=lambda entry: entry[1].st_mtime)
+
+    def evict(self) -> None:
+        entries = self.entries()
+        size = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if size <= self.max_bytes:
+                break
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+            size -= stat.st_size
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self.entries()
+        return {'entries': len(entries), 'bytes': sum(stat.st_size for _, stat in entries), 'max_bytes': self.max_bytes}
+
+    def documents(self, key: Optional[str], build: Callable[[], Iterable[List[Dict[str, Any]]]]) -> Iterator[List[Dict[str, Any]]]:
+        """Liquor document batches of an upload: the cached ones with new ids and upload time,
+        else those from `build()`, cached as they are produced.
+
+        A parse that fails or is abandoned part way caches nothing; a None key bypasses the cache.
+        """
+        if key is None or not self.enabled:
+            yield from build()
+            return
+        name = f'upload-{key}.pickle'
+        entry = self.open(name)
+        if entry is not None:
+            with entry:
+                logging.info(f"Upload {key[:12]} was parsed before, reusing its cached documents")
+                while (batch := pickle.load(entry)) is not None:
+                    yield restamp_liquor_batch(batch)
+            return
+        with self.create(name) as entry:
+            for batch in build():
+                # Written before the batch is handed on, as inserting documents adds _id to them
+                pickle.dump(batch, entry, protocol=pickle.HIGHEST_PROTOCOL)
+                yield batch
+            pickle.dump(None, entry)
+
+    @contextmanager
+    def decoded_columns(self, df: pd.DataFrame, brand_col: str) -> Iterator[Optional['DecodedColumns']]:
+        """Decoded columns of a sheet's brand rows, including those kept from the last parse of
+        the same rows, saved back once the block completes"""
+        if not self.enabled:
+            yield None
+            return
+        name = f"columns-{self.key(pd.util.hash_pandas_object(df[brand_col], index=True).to_numpy().tobytes())}.npz"
+        entry = self.open(name)
+        previous = None
+        if entry is not None:
             try:
-                df = pd.read_csv(io.BytesIO(file_content))
-                if len(df.columns) >= 3 and any(col.lower().strip() in ['brand name', 'brand_name', 'product', 'name'] for col in df.columns):
-                    return parse_tabular_format(df)
-                else:
-                    df_headerless = pd.read_csv(io.BytesIO(file_content), header=None)
-                    return parse_list_format(df_headerless)
-            except Exception as csv_error:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Unable to parse file. Please ensure it's a valid Excel or CSV file. Error: {str(csv_error)}"
-                )
-        
+                # np.load reads each array only when it is used
+                previous = np.load(entry)
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable parse cache entry {name}: {e}")
+        try:
+            decoded = DecodedColumns(previous)
+            yield decoded
+        finally:
+            if entry is not None:
+                entry.close()
+        if decoded.decoded:
+            with self.create(name) as entry:
+                np.savez(entry, **decoded.arrays)
+
+parse_cache = ParseCache()
+
+class DecodedColumns:
+    """Text date columns decoded for the stock matrix and the D1 scan.
+
+    Text cells are decoded in a Python loop, so each decoded column is kept under a hash of its
+    cells and row labels: parsing the same rows again, usually the same sheet with a day's
+    column appended, decodes only the columns whose cells changed. Numeric columns convert in
+    one vectorized step and are not kept.
+    """
+    def __init__(self, previous: Optional[Any] = None):
+        self.previous = previous if previous is not None else {}
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.digests: Dict[Any, str] = {}
+        self.reused = 0
+        self.decoded = 0
+
+    def column(
+        self, kind: str, column: pd.Series, decode: Callable[[pd.Series], Tuple[np.ndarray, np.ndarray]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """decode(column), from the previous parse when its cells are unchanged"""
+        if pd.api.types.is_numeric_dtype(column):
+            return decode(column)
+        digest = self.digests.get(column.name)
+        if digest is None:
+            digest = self.digests[column.name] = hashlib.sha256(
+                pd.util.hash_pandas_object(column, index=True).to_numpy().tobytes()
+            ).hexdigest()
+        values_key, present_key = f'{kind}-{digest}-values', f'{kind}-{digest}-present'
+        if values_key in self.previous and present_key in self.previous:
+            values, present = self.previous[values_key], self.previous[present_key]
+            self.reused += 1
+        else:
+            values, present = decode(column)
+            self.decoded += 1
+        self.arrays[values_key], self.arrays[present_key] = values, present
+        return values, present
+
+# Analytics cache
+ANALYTICS_CACHE_ENTRIES = int(os.environ.get('ANALYTICS_CACHE_ENTRIES', '256'))
+ANALYTICS_CACHE_BYTES = int(os.environ.get('ANALYTICS_CACHE_BYTES', str(64 * 1024 * 1024)))
+DATASET_POINTER_TTL = float(os.environ.get('DATASET_POINTER_TTL', '2'))
+
+class AnalyticsCache:
+    """LRU cache of computed endpoint results, bounded by entry count and estimated JSON size.
+
+    Keys include the dataset version, so an entry can never outlive the data it was computed from.
+    """
+    def __init__(self, max_entries: int = ANALYTICS_CACHE_ENTRIES, max_bytes: int = ANALYTICS_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple, Tuple[Any, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: Tuple) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+    
+    def put(self, key: Tuple, value: Any) -> None:
+        size = len(json.dumps(jsonable_encoder(value), default=str))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self.bytes -= self.entries.popitem(last=False)[1][1]
+            self.evictions += 1
+    
+    def invalidate(self) -> None:
+        self.entries.clear()
+        self.bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self.entries), 'bytes': self.bytes, 'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+        }
+
+analytics_cache = AnalyticsCache()
+
+# Dataset pointer as last read by this process, so cached reads need no database round trip
+dataset_state_cache: Dict[str, Any] = {'state': None, 'expires': 0.0}
+
+# Executors
+# Parsing is CPU bound and would stall every request if it ran on the event loop. Whole-file
+# parses go to a process pool (PARSE_EXECUTOR=thread keeps them in threads); file reads and
+# streamed chunk parsing go to a thread pool. Streamed uploads stay in this process because
+# their batches are written while the rest of the file is still being read, so they keep the
+# event loop free but still share the GIL with request handling.
+PARSE_EXECUTOR = os.environ.get('PARSE_EXECUTOR', 'process')
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+PARSE_CONCURRENCY = int(os.environ.get('PARSE_CONCURRENCY', str(PARSE_WORKERS)))
+IO_WORKERS = int(os.environ.get('IO_WORKERS', '8'))
+# Processes computing the brand metrics of one large sheet in row blocks; 0 or 1 computes them
+# in the parsing process. Each parse worker gets its own, so budget PARSE_WORKERS x this many cores.
+BRAND_WORKERS = int(os.environ.get('BRAND_WORKERS', '0'))
+# Sheets with fewer brand rows are not worth the worker round trip
+PARALLEL_BRAND_ROWS = int(os.environ.get('PARALLEL_BRAND_ROWS', '20000'))
+
+# Pools and the concurrency limit are created on first use and dropped at shutdown
+executors: Dict[str, Any] = {}
+
+def io_executor() -> Executor:
+    if 'io' not in executors:
+        executors['io'] = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+    return executors['io']
+
+def parse_executor() -> Executor:
+    """Pool for whole-file parses; process workers are spawned, not forked from the server"""
+    if 'parse' not in executors:
+        if PARSE_EXECUTOR == 'thread':
+            executors['parse'] = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='parse')
+        else:
+            executors['parse'] = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return executors['parse']
+
+def brand_executor() -> Executor:
+    if 'brands' not in executors:
+        executors['brands'] = ProcessPoolExecutor(max_workers=BRAND_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return executors['brands']
+
+def parse_slots() -> asyncio.Semaphore:
+    """Uploads beyond PARSE_CONCURRENCY wait for a slot instead of piling work onto the pools"""
+    if 'slots' not in executors:
+        executors['slots'] = asyncio.Semaphore(PARSE_CONCURRENCY)
+    return executors['slots']
+
+def shutdown_executors() -> None:
+    for name in ('io', 'parse', 'brands'):
+        pool = executors.pop(name, None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    executors.pop('slots', None)
+
+async def run_io(function: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(io_executor(), function, *args)
+
+async def run_parse(function: Callable[..., Any], *args: Any) -> Any:
+    async with parse_slots():
+        return await asyncio.get_running_loop().run_in_executor(parse_executor(), function, *args)
+
+async def iterate_in_thread(iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """Advance a blocking iterator on the I/O pool, one item at a time"""
+    done = object()
+    while (item := await run_io(next, iterator, done)) is not done:
+        yield item
+
+# Helper functions
+XLSX_MAGIC = b'PK\x03\x04'
+XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+EXCEL_ENGINES = {'xlsx': 'openpyxl', 'xls': 'xlrd'}
+TABULAR_HEADER_NAMES = ['brand name', 'brand_name', 'product', 'name']
+
+def detect_upload_format(file_content: bytes) -> str:
+    """Identify an upload as 'xlsx', 'xls' or 'csv' from its leading bytes"""
+    if file_content.startswith(XLSX_MAGIC):
+        return 'xlsx'
+    if file_content.startswith(XLS_MAGIC):
+        return 'xls'
+    return 'csv'
+
+def is_tabular_header(header: List[Any]) -> bool:
+    """Check if a header row looks like the tabular format (has typical column names)"""
+    return len(header) >= 3 and any(
+        isinstance(col, str) and col.lower().strip() in TABULAR_HEADER_NAMES for col in header
+    )
+
+def header_names(header: List[Any]) -> List[Any]:
+    """Column names for a header row, as pandas builds them for header=0"""
+    names = [f"Unnamed: {position}" if pd.isna(value) else value for position, value in enumerate(header)]
+    # Rename duplicate columns the pandas way: "Rate", "Rate.1", ...
+    counts: Dict[Any, int] = {}
+    for position, name in enumerate(names):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        names[position] = name
+        counts[name] = count + 1
+    return names
+
+def promote_header_row(df: pd.DataFrame) -> pd.DataFrame:
+    """Turn the first row of a header=None frame into column names, as pandas does for header=0"""
+    body = df.iloc[1:].reset_index(drop=True)
+    body.columns = header_names(df.iloc[0].tolist())
+    return body.infer_objects()
+
+def _csv_header_row(file_content: bytes) -> List[str]:
+    """Read only the first CSV record"""
+    text = file_content[:65536].decode('utf-8-sig', errors='replace')
+    return next(csv.reader(io.StringIO(text)), [])
+
+@contextmanager
+def unparseable_file_errors() -> Iterator[None]:
+    """Report any parser failure other than an HTTPException as a 400 for the uploaded file"""
+    try:
+        yield
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error parsing file: {str(e)}")
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Unable to parse file. Please ensure it's a valid Excel or CSV file. Error: {str(e)}"
+        )
 
-def parse_tabular_format(df: pd.DataFrame) -> List[Dict[str, Any]]:
-    """Parse liquor stock data with proper daily stock analysis"""
-    if df.empty:
-        raise HTTPException(status_code=400, detail="The uploaded file is empty or contains no data")
+def parse_excel_data(
+    file_content: bytes, trace: ParseTrace = NULL_TRACE, progress: Optional[UploadProgress] = None
+) -> List[Dict[str, Any]]:
+    """Parse Excel file and return structured data - supports both tabular and list formats
+
+    The format is sniffed from the file's leading bytes and the file is decoded once; the
+    header row decides between the tabular and list layouts.
+    """
+    with unparseable_file_errors():
+        file_format = detect_upload_format(file_content)
+        if file_format == 'csv':
+            # Peek at the header line so the whole file is parsed once, in the right header mode
+            tabular = is_tabular_header(_csv_header_row(file_content))
+            df = pd.read_csv(io.BytesIO(file_content), header=0 if tabular else None)
+        else:
+            df = pd.read_excel(io.BytesIO(file_content), header=None, engine=EXCEL_ENGINES[file_format])
+            tabular = not df.empty and is_tabular_header(df.iloc[0].tolist())
+            if tabular:
+                df = promote_header_row(df)
+        
+        if trace.enabled:
+            trace.event('format', format=file_format, layout='tabular' if tabular else 'list')
+        if progress:
+            progress.rows_parsed += len(df)
+        return parse_tabular_format(df, trace) if tabular else parse_list_format(df)
+
+def _to_float(value: Any, strip_commas: bool = False) -> float:
+    """float() a single cell, retrying without thousands separators if asked; 0 when unparseable"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        if strip_commas:
+            try:
+                return float(str(value).replace(',', ''))
+            except (ValueError, TypeError):
+                pass
+    return 0.0
+
+def _rate_column(column: pd.Series) -> np.ndarray:
+    """Convert a rate column to floats, treating missing and unparseable cells as 0"""
+    if pd.api.types.is_numeric_dtype(column):
+        values = column.to_numpy(dtype=float, na_value=np.nan)
+        return np.where(np.isnan(values), 0.0, values)
+    return np.array([_to_float(value) if pd.notna(value) else 0.0 for value in column.to_numpy(dtype=object)], dtype=float)
+
+def _stock_column(column: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert one date column to (stock values, present mask) - text columns are parsed cell by cell"""
+    if pd.api.types.is_numeric_dtype(column):
+        values = column.to_numpy(dtype=float, na_value=np.nan)
+        present = ~np.isnan(values)
+        return np.where(present, values, 0.0), present
+
+    raw = column.to_numpy(dtype=object)
+    present = np.array([bool(pd.notna(value)) and str(value).strip() != '' for value in raw], dtype=bool)
+    values = np.array(
+        [_to_float(value, strip_commas=True) if is_present else 0.0 for value, is_present in zip(raw, present)],
+        dtype=float,
+    )
+    return values, present
+
+def build_stock_matrix(
+    df: pd.DataFrame, date_columns: List[str], out: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    decoded: Optional[DecodedColumns] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Build the (brands x dates) stock matrix and its present-cell mask, into `out` if given"""
+    if out is None:
+        out = np.zeros((len(df), len(date_columns)), dtype=float), np.zeros((len(df), len(date_columns)), dtype=bool)
+    stock, present = out
+    for position, date_col in enumerate(date_columns):
+        column = df[date_col]
+        stock[:, position], present[:, position] = (
+            decoded.column('stock', column, _stock_column) if decoded else _stock_column(column)
+        )
+    return stock, present
+
+class BrandRows(NamedTuple):
+    """Per-row inputs of the brand computation, decoded from the sheet's cells"""
+    brand_names: np.ndarray
+    row_labels: np.ndarray
+    index_numbers: np.ndarray
+    wholesale_rates: np.ndarray
+    selling_rates: np.ndarray
     
-    # Clean column names
-    df.columns = df.columns.str.strip()
+    def block(self, start: int, stop: int) -> "BrandRows":
+        return BrandRows(*(column[start:stop] for column in self))
+
+# Header and total rows repeated inside a sheet, recognised by their brand cell
+SKIPPED_BRAND_ROWS = re.compile(r'total|sum|^brand name$|^name$|^brand$', re.IGNORECASE)
+INDEX_DIGITS = re.compile(r'(\d+)')
+
+def normalize_index_numbers(raw_index: pd.Series, fallback: Iterable[int]) -> np.ndarray:
+    """int64 index numbers from index cells: each cell's first run of digits, else its fallback.
+
+    Stored as int64, every later index sort is an integer sort; a number too large for it
+    raises OverflowError.
+    """
+    digits = raw_index.astype(str).str.extract(INDEX_DIGITS, expand=False)
+    found = (raw_index.notna() & digits.notna()).to_numpy()
+    index_numbers = np.array(fallback, dtype=np.int64)
+    index_numbers[found] = np.fromiter(map(int, digits.to_numpy()[found]), dtype=np.int64, count=int(found.sum()))
+    return index_numbers
+
+def decode_brand_rows(
+    df: pd.DataFrame,
+    brand_col: str,
+    index_col: Optional[str],
+    wholesale_rate_col: Optional[str],
+    selling_rate_col: Optional[str],
+) -> BrandRows:
+    """Brand names, row labels, index numbers and rates of the brand rows"""
+    brand_names = df[brand_col].astype(str).str.strip().to_numpy(dtype=object)
+    row_labels = df.index.to_numpy()
     
-    # Find key columns
+    # Index: first run of digits in the index cell, else the row position in the file
+    row_numbers = row_labels.astype(np.int64) + 1
+    index_numbers = normalize_index_numbers(df[index_col], row_numbers) if index_col else row_numbers
+    
+    # Rates - if one is missing derive it from the other (wholesale = 90% of selling)
+    wholesale_rates = _rate_column(df[wholesale_rate_col]) if wholesale_rate_col else np.zeros(len(df))
+    selling_rates = _rate_column(df[selling_rate_col]) if selling_rate_col else np.zeros(len(df))
+    derive_wholesale = (wholesale_rates == 0) & (selling_rates > 0)
+    derive_selling = (selling_rates == 0) & (wholesale_rates > 0)
+    wholesale_rates = np.where(derive_wholesale, selling_rates * 0.9, wholesale_rates)
+    selling_rates = np.where(derive_selling, wholesale_rates / 0.9, selling_rates)
+    return BrandRows(brand_names, row_labels, index_numbers, wholesale_rates, selling_rates)
+
+def build_brand_records(
+    df: pd.DataFrame,
+    brand_col: str,
+    index_col: Optional[str],
+    wholesale_rate_col: Optional[str],
+    selling_rate_col: Optional[str],
+    date_columns: List[str],
+    global_D1_date: str,
+    trace: ParseTrace = NULL_TRACE,
+    date_days: Optional[np.ndarray] = None,
+    decoded: Optional[DecodedColumns] = None,
+) -> List[Dict[str, Any]]:
+    """Compute D1/DL stock and sales metrics for all brand rows at once over the stock matrix"""
+    brand_rows = decode_brand_rows(df, brand_col, index_col, wholesale_rate_col, selling_rate_col)
+    stock, present = build_stock_matrix(df, date_columns, decoded=decoded)
+    return compute_brand_records(brand_rows, stock, present, date_columns, global_D1_date, trace, date_days)
+
+class StockMetrics(NamedTuple):
+    """Per-brand sales and stock cover derived from the D1 and DL stock"""
+    total_sales_qty: np.ndarray
+    avg_daily_sales_qty: np.ndarray
+    monthly_sales_qty: np.ndarray
+    monthly_sales_value: np.ndarray
+    monthly_sale_qty: np.ndarray
+    current_stock_value: np.ndarray
+    current_stock_qty: np.ndarray
+    stock_ratio: np.ndarray
+    stock_available_days: np.ndarray
+
+def stock_metrics(
+    D1_stock: np.ndarray, DL_stock: np.ndarray, days_between: np.ndarray, selling_rates: np.ndarray
+) -> StockMetrics:
+    """Sales between D1 and DL and what they say about the stock on hand, for all brands at once"""
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Stock reduction between D1 and DL = sales
+        stock_drop = D1_stock - DL_stock
+        total_sales_qty = np.where(stock_drop > 0, stock_drop, 0.0)
+        avg_daily_sales_qty = total_sales_qty / days_between
+        
+        # Monthly sales (24 days as requested)
+        monthly_sales_qty = avg_daily_sales_qty * 24
+        monthly_sales_value = monthly_sales_qty * selling_rates
+        current_stock_value = DL_stock * selling_rates
+        
+        # Stock ratio (stock value / monthly sales value) and stock availability in days
+        stock_ratio = np.where(
+            monthly_sales_value > 0,
+            current_stock_value / np.where(monthly_sales_value > 1, monthly_sales_value, 1),
+            0.0,
+        )
+        stock_available_days = np.where(
+            avg_daily_sales_qty > 0,
+            DL_stock / np.where(avg_daily_sales_qty > 0.1, avg_daily_sales_qty, 0.1),
+            999.0,
+        )
+        stock_available_days = np.where(stock_available_days > 0, stock_available_days, 0.0)
+        stock_available_days = np.where(stock_available_days < 999, stock_available_days, 999.0)
+        current_stock_qty = np.where(DL_stock > 0, DL_stock, 0.0)
+        monthly_sale_qty = np.where(monthly_sales_qty > 0, monthly_sales_qty, 0.0)
+    return StockMetrics(
+        total_sales_qty, avg_daily_sales_qty, monthly_sales_qty, monthly_sales_value, monthly_sale_qty,
+        current_stock_value, current_stock_qty, stock_ratio, stock_available_days,
+    )
+
+def compute_brand_records(
+    brand_rows: BrandRows,
+    stock: np.ndarray,
+    present: np.ndarray,
+    date_columns: List[str],
+    global_D1_date: str,
+    trace: ParseTrace = NULL_TRACE,
+    date_days: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    """Brand records for decoded rows and their stock matrix.
+
+    `date_days` are the ordinal days of the chronologically ordered date columns; without
+    them the columns are taken to be consecutive days.
+    """
+    brand_names, row_labels, index_numbers, wholesale_rates, selling_rates = brand_rows
+    if date_days is None:
+        date_days = np.arange(len(date_columns))
+    named = ~pd.Series(brand_names, dtype=object).str.lower().isin(['nan', 'none', '']).to_numpy()
+    valid = present & (stock >= 0)  # Include zero values too
+    rows = np.arange(len(stock))
+    
+    # Position of the last valid stock value on or before each date
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(date_columns)), -1), axis=1)
+    
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # D1: stock on the global D1 date, else the closest previous valid value
+        d1_pos = date_columns.index(global_D1_date)
+        D1_stock = stock[:, d1_pos]
+        d1_fallback = last_valid[:, d1_pos]
+        D1_stock = np.where((D1_stock == 0) & (d1_fallback >= 0), stock[rows, np.maximum(d1_fallback, 0)], D1_stock)
+        
+        # DL: stock on the last date, else the brand's last valid value
+        dl_fallback = stock[:, -1] == 0
+        dl_pos = np.where(dl_fallback, last_valid[:, -1], len(date_columns) - 1)
+        DL_stock = stock[rows, np.maximum(dl_pos, 0)]
+        
+        # Days from D1 to DL inclusive, counted on the calendar rather than in columns
+        days_between = np.maximum(1, date_days[np.maximum(dl_pos, 0)] - date_days[d1_pos] + 1)
+    
+    (total_sales_qty, avg_daily_sales_qty, monthly_sales_qty, monthly_sales_value, monthly_sale_qty,
+     current_stock_value, current_stock_qty, stock_ratio, stock_available_days) = stock_metrics(
+        D1_stock, DL_stock, days_between, selling_rates
+    )
+    
+    # Skip rows without a brand name or without any valid stock data
+    keep = named & valid.any(axis=1)
+    # Quantities that cannot be represented as whole numbers cannot be stored
+    unrepresentable = keep & ~(np.isfinite(current_stock_qty) & np.isfinite(monthly_sale_qty))
+    for position in np.flatnonzero(unrepresentable):
+        logging.error(f"Error parsing row {row_labels[position]} ({brand_names[position]}): non-finite stock quantity")
+    keep &= ~unrepresentable
+    
+    if trace.enabled:
+        labels = row_labels.tolist()
+        for position in np.flatnonzero(named & ~keep).tolist():
+            trace.event('brand_skipped', row=labels[position], brand=brand_names[position],
+                        reason='no valid stock data' if not unrepresentable[position] else 'non-finite stock quantity')
+        for position in np.flatnonzero(keep).tolist():
+            trace.event(
+                'brand', row=labels[position], brand=brand_names[position],
+                D1_date=global_D1_date, D1_stock=float(D1_stock[position]),
+                D1_from_previous_date=bool(stock[position, d1_pos] == 0 and d1_fallback[position] not in (-1, d1_pos)),
+                DL_date=date_columns[dl_pos[position]], DL_stock=float(DL_stock[position]),
+                total_sales_qty=float(total_sales_qty[position]), days=int(days_between[position]),
+                avg_daily_sales_qty=float(avg_daily_sales_qty[position]),
+                monthly_sale_value=float(monthly_sales_value[position]), stock_ratio=float(stock_ratio[position]),
+                invalid_stock_dates=[date_columns[col] for col in np.flatnonzero(present[position] & ~valid[position]).tolist()],
+            )
+    
+    kept = np.flatnonzero(keep)
+    names = brand_names[kept].tolist()
+    indexes = index_numbers[kept].tolist()
+    dl_dates = np.asarray(date_columns, dtype=object)[dl_pos[kept]].tolist()
+    columns = [
+        array[kept].tolist()
+        for array in (
+            wholesale_rates, selling_rates, D1_stock, DL_stock, current_stock_qty, total_sales_qty,
+            avg_daily_sales_qty, monthly_sales_qty, monthly_sales_value, monthly_sale_qty,
+            current_stock_value, stock_ratio, stock_available_days, days_between,
+        )
+    ]
+    
+    liquor_data = []
+    for (brand_name, index_num, DL_date, stock_row, wholesale_rate, selling_rate, D1_value, DL_value, stock_qty,
+         total_sales, avg_daily_sales, monthly_qty, monthly_value, monthly_qty_floor, stock_value, ratio,
+         available_days, days) in zip(names, indexes, dl_dates, stock[kept].tolist(), *columns):
+        liquor_data.append({
+            'brand_name': brand_name,
+            'product_id': f"ID_{index_num}",
+            'index_number': int(index_num),
+            'wholesale_rate': wholesale_rate,
+            'selling_rate': selling_rate,
+            'rate': selling_rate,  # For compatibility
+            'D1_date': str(global_D1_date),
+            'D1_stock': D1_value,
+            'DL_date': str(DL_date),
+            'DL_stock': DL_value,
+            'current_stock_qty': int(stock_qty),
+            'total_sales_qty': total_sales,
+            'avg_daily_sales_qty': avg_daily_sales,
+            'monthly_sales_qty': monthly_qty,
+            'monthly_sale_value': monthly_value,
+            'monthly_sale_qty': int(monthly_qty_floor),  # For compatibility
+            'stock_value_today': stock_value,
+            'stock_ratio': ratio,
+            'stock_available_days': available_days,
+            'avg_daily_sale': monthly_value / 30,  # For compatibility
+            'stock_value_before': D1_value * selling_rate,
+            'daily_sales': dict(zip(date_columns, stock_row)),
+            'days_analyzed': int(days),
+        })
+    
+    return liquor_data
+
+def shared_array(shape: Tuple[int, ...], dtype: Any) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """A new array backed by shared memory that worker processes can attach to by name"""
+    memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+def read_shared_rows(name: str, shape: Tuple[int, ...], dtype: Any, start: int, stop: int) -> np.ndarray:
+    """Copy rows start:stop out of an array shared by another process"""
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=dtype, buffer=memory.buf)[start:stop].copy()
+    finally:
+        memory.close()
+
+def compute_brand_records_block(
+    matrices: Tuple[str, str],
+    shape: Tuple[int, int],
+    start: int,
+    stop: int,
+    brand_rows: BrandRows,
+    date_columns: List[str],
+    global_D1_date: str,
+    trace_max_events: Optional[int] = None,
+    date_days: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
+    """Brand records for rows start:stop of a shared stock matrix, computed in a brand worker.
+
+    Events are traced into a buffer of `trace_max_events` when given.
+    """
+    stock = read_shared_rows(matrices[0], shape, float, start, stop)
+    present = read_shared_rows(matrices[1], shape, bool, start, stop)
+    trace = ParseTrace(max_events=trace_max_events) if trace_max_events else NULL_TRACE
+    records = compute_brand_records(brand_rows, stock, present, date_columns, global_D1_date, trace, date_days)
+    return {'records': records, 'events': list(trace.events), 'dropped': trace.dropped}
+
+def build_brand_records_parallel(
+    df: pd.DataFrame,
+    brand_col: str,
+    index_col: Optional[str],
+    wholesale_rate_col: Optional[str],
+    selling_rate_col: Optional[str],
+    date_columns: List[str],
+    global_D1_date: str,
+    trace: ParseTrace = NULL_TRACE,
+    date_days: Optional[np.ndarray] = None,
+    decoded: Optional[DecodedColumns] = None,
+) -> List[Dict[str, Any]]:
+    """build_brand_records with the metrics computed by BRAND_WORKERS processes, one row block each.
+
+    The cells are decoded here, into a stock matrix in shared memory, so workers receive only
+    block bounds and the per-row columns. Blocks are merged back in row order.
+    """
+    brand_rows = decode_brand_rows(df, brand_col, index_col, wholesale_rate_col, selling_rate_col)
+    shape = (len(df), len(date_columns))
+    stock_memory, stock = shared_array(shape, float)
+    present_memory, present = shared_array(shape, bool)
+    try:
+        build_stock_matrix(df, date_columns, out=(stock, present), decoded=decoded)
+        del stock, present
+        bounds = np.linspace(0, len(df), BRAND_WORKERS + 1).astype(int).tolist()
+        futures = [
+            brand_executor().submit(
+                compute_brand_records_block, (stock_memory.name, present_memory.name), shape, start, stop,
+                brand_rows.block(start, stop), date_columns, global_D1_date,
+                trace.events.maxlen if trace.enabled else None, date_days,
+            )
+            for start, stop in zip(bounds, bounds[1:]) if stop > start
+        ]
+        liquor_data = []
+        for future in futures:
+            result = future.result()
+            if trace.enabled:
+                trace.merge(result['events'], result['dropped'])
+            liquor_data.extend(result['records'])
+        return liquor_data
+    finally:
+        for memory in (stock_memory, present_memory):
+            memory.unlink()
+            # A traceback still referencing the arrays keeps the mapping open until it is freed
+            with suppress(BufferError):
+                memory.close()
+
+# Date headers
+# Stock columns are the headers that parse as a date in one of these '|'-separated formats.
+# Formats without a year get one inferred (see parse_date_headers), or DATE_HEADER_YEAR.
+DATE_HEADER_FORMATS = os.environ.get(
+    'DATE_HEADER_FORMATS', '%d-%b|%d-%b-%Y|%d-%b-%y|%d %b|%d %b %Y|%b %d|%d-%B|%d %B|%Y-%m-%d|%d/%m/%Y'
+).split('|')
+DATE_HEADER_YEAR = int(os.environ['DATE_HEADER_YEAR']) if os.environ.get('DATE_HEADER_YEAR') else None
+MONTH_NAMES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+def parse_date_headers(
+    headers: Iterable[Any], formats: Optional[List[str]] = None, year: Optional[int] = None, today: Optional[date] = None
+) -> Dict[str, date]:
+    """Real dates of the headers that are dates, in header order.
+
+    Yearless headers are taken to span less than a year, starting after the longest gap
+    between their days of the year, so "29-Dec", "02-Jan" crosses into a new year. They start
+    in `year` (DATE_HEADER_YEAR by default), else in the latest year that keeps them all on
+    or before today. Header order does not matter, so stored date labels sort the same way.
+    """
+    formats = DATE_HEADER_FORMATS if formats is None else formats
+    year = DATE_HEADER_YEAR if year is None else year
+    today = today or datetime.now(timezone.utc).date()
+    dated: Dict[str, date] = {}
+    yearless: Dict[str, Tuple[int, int]] = {}
+    for header in headers:
+        if not isinstance(header, str):
+            continue
+        for date_format in formats:
+            if '%Y' in date_format or '%y' in date_format:
+                with suppress(ValueError):
+                    dated[header] = datetime.strptime(header, date_format).date()
+                    break
+            else:
+                # Parsed in a leap year so that 29-Feb is accepted
+                with suppress(ValueError):
+                    parsed = datetime.strptime(f'{header} 2000', f'{date_format} %Y')
+                    yearless[header] = (parsed.month, parsed.day)
+                    break
+    
+    if yearless:
+        month_days = sorted(set(yearless.values()))
+        days = [date(2000, *month_day).toordinal() for month_day in month_days]
+        gaps = [later - earlier for earlier, later in zip(days, days[1:])]
+        # Days before the longest gap fall in the following year, unless the gap across the year end is longer
+        start = 0
+        if gaps and max(gaps) > days[0] + 366 - days[-1]:
+            start = gaps.index(max(gaps)) + 1
+        next_year = set(month_days[:start])
+        first_year = year if year is not None else today.year
+        last = (first_year + bool(next_year), *month_days[start - 1])
+        if year is None and last > (today.year, today.month, today.day):
+            first_year -= 1
+        for header, month_day in yearless.items():
+            header_year = first_year + (month_day in next_year)
+            try:
+                dated[header] = date(header_year, *month_day)
+            except ValueError:
+                logging.warning(f"Ignoring date column '{header}': not a date in {header_year}")
+    return {header: dated[header] for header in headers if header in dated}
+
+def chronological_dates(labels: Iterable[str]) -> List[str]:
+    """Date labels sorted by their real dates, then labels that are not dates sorted as strings"""
+    labels = list(labels)
+    dates = parse_date_headers(labels)
+    return sorted(dates, key=lambda label: (dates[label], label)) + sorted(
+        label for label in labels if label not in dates
+    )
+
+def detect_tabular_columns(
+    columns: List[str], trace: ParseTrace = NULL_TRACE
+) -> Tuple[str, Optional[str], Optional[str], Optional[str], List[str], np.ndarray]:
+    """Find the brand, index, wholesale rate, selling rate and date columns of the tabular format.
+
+    Date columns come back in chronological order, with their dates as ordinal day numbers.
+    """
     brand_col = None
     wholesale_rate_col = None
     selling_rate_col = None
     index_col = None
-    date_columns = []
+    other_columns = []
     
-    for col in df.columns:
+    for col in columns:
         col_lower = col.lower().strip()
         if 'brand' in col_lower and 'name' in col_lower:
             brand_col = col
@@ -145,16 +1048,20 @@ def parse_tabular_format(df: pd.DataFrame) -> List[Dict[str, Any]]:
         elif any(term in col_lower for term in ['index', 'sl', 'sr', 'no', 'id']) and len(col) <= 10:
             index_col = col
         else:
-            # Check if column represents a date (contains date patterns)
-            if any(date_part in col_lower for date_part in ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']):
-                # Sort dates chronologically
-                date_columns.append(col)
+            other_columns.append(col)
     
-    # Sort date columns chronologically
-    date_columns.sort()
+    # Check which columns represent a date and sort them chronologically
+    dates = parse_date_headers(other_columns)
+    date_columns = sorted(dates, key=dates.get)
+    date_days = np.array([dates[col].toordinal() for col in date_columns], dtype=np.int64)
+    for col in other_columns:
+        if col not in dates and any(month in col.lower() for month in MONTH_NAMES):
+            logging.warning(f"Ignoring column '{col}': it names a month but matches no DATE_HEADER_FORMATS format")
     
-    print(f"Detected columns - Brand: {brand_col}, Index: {index_col}, Wholesale: {wholesale_rate_col}, Selling: {selling_rate_col}")
-    print(f"Date columns found: {date_columns}")
+    if trace.enabled:
+        trace.event('columns', brand=brand_col, index=index_col, wholesale_rate=wholesale_rate_col,
+                    selling_rate=selling_rate_col, dates=date_columns,
+                    date_values=[dates[col].isoformat() for col in date_columns])
     
     if not brand_col:
         raise HTTPException(status_code=400, detail="Could not find 'Brand Name' column in the file")
@@ -162,266 +1069,336 @@ def parse_tabular_format(df: pd.DataFrame) -> List[Dict[str, Any]]:
     if not date_columns:
         raise HTTPException(status_code=400, detail="Could not find date columns for daily stock data")
     
-    # Filter out only obvious header rows, be more lenient
+    return brand_col, index_col, wholesale_rate_col, selling_rate_col, date_columns, date_days
+
+def filter_brand_rows(df: pd.DataFrame, brand_col: str) -> pd.DataFrame:
+    """Filter out only obvious header and total rows, be more lenient"""
     df = df[df[brand_col].notna()]
-    df = df[~df[brand_col].astype(str).str.contains('total|sum|^brand name$|^name$|^brand$', na=False, case=False)]
+    return df[~df[brand_col].astype(str).str.contains(SKIPPED_BRAND_ROWS, na=False)]
+
+def find_global_d1(
+    df: pd.DataFrame, brand_col: str, date_columns: List[str], trace: ParseTrace = NULL_TRACE,
+    decoded: Optional[DecodedColumns] = None,
+) -> str:
+    """Find the EARLIEST date when ANY brand shows a stock increase (restocking), else the first date"""
+    brand_names = df[brand_col].astype(str).str.strip()
+    stock, present = build_scan_matrix(df, date_columns, decoded)
     
-    print(f"After filtering, found {len(df)} potential brand rows")  # Debug info
+    # Brands are keyed by name: a later row with stock data replaces an earlier one
+    has_data = ~brand_names.str.lower().isin(['nan', 'none', '']).to_numpy() & present.any(axis=1)
+    scanned = has_data.copy()
+    scanned[has_data] = ~brand_names[has_data].duplicated(keep='last').to_numpy()
+    stock, present = stock[scanned], present[scanned]
     
+    # Stock increase on a date over the previous date indicates restocking (any increase > 0)
+    compared = present[:, 1:] & present[:, :-1]
+    increases = compared & (stock[:, 1:] > stock[:, :-1])
+    restock_dates = increases.any(axis=0)
+    
+    if not restock_dates.any():
+        if trace.enabled:
+            trace.event('d1_fallback', date=date_columns[0], reason='no restocking found')
+        return date_columns[0]
+    
+    position = int(restock_dates.argmax()) + 1
+    if trace.enabled:
+        for pair in range(position):
+            trace.event('d1_check', date=date_columns[pair + 1], brands_compared=int(compared[:, pair].sum()),
+                        brands_increased=int(increases[:, pair].sum()))
+        # Report the restocking brand that appears first in the file
+        first_seen = {name: order for order, name in enumerate(dict.fromkeys(brand_names[has_data].tolist()))}
+        names = brand_names[scanned].tolist()
+        row = min(np.flatnonzero(increases[:, position - 1]).tolist(), key=lambda row: first_seen[names[row]])
+        prev_stock, curr_stock = float(stock[row, position - 1]), float(stock[row, position])
+        trace.event('d1_found', date=date_columns[position], brand=names[row], prev_stock=prev_stock,
+                    curr_stock=curr_stock, increase=curr_stock - prev_stock)
+    return date_columns[position]
+
+def parse_tabular_format(df: pd.DataFrame, trace: ParseTrace = NULL_TRACE) -> List[Dict[str, Any]]:
+    """Parse liquor stock data with proper daily stock analysis"""
     if df.empty:
-        raise HTTPException(status_code=400, detail="No valid brand data found after filtering")
+        raise HTTPException(status_code=400, detail="The uploaded file is empty or contains no data")
+    
+    # Clean column names
+    df.columns = df.columns.str.strip()
     
-    # STEP 1: Find global D1 date (when stock increased for ANY brand)
-    global_D1_date = None
-    print(f"Finding global D1 date across all brands...")
+    # Find key columns
+    brand_col, index_col, wholesale_rate_col, selling_rate_col, date_columns, date_days = detect_tabular_columns(df.columns, trace)
     
-    # Collect all stock data across all brands first
-    all_brand_stock_data = {}
-    for idx, row in df.iterrows():
-        brand_name = str(row[brand_col]).strip()
-        if not brand_name or brand_name.lower() in ['nan', 'none', '']:
-            continue
-            
-        brand_stock_data = {}
-        for date_col in date_columns:
-            if pd.notna(row[date_col]):
-                try:
-                    stock_qty = float(row[date_col])
-                    brand_stock_data[date_col] = stock_qty
-                except:
-                    brand_stock_data[date_col] = 0
-        
-        if brand_stock_data:
-            all_brand_stock_data[brand_name] = brand_stock_data
-    
-    # Find D1: Look for the EARLIEST date when ANY brand shows stock increase
-    sorted_dates = sorted(date_columns)
-    print(f"Scanning dates in order: {sorted_dates}")
-    
-    for i in range(1, len(sorted_dates)):
-        prev_date = sorted_dates[i-1] 
-        curr_date = sorted_dates[i]
-        
-        print(f"Checking date {curr_date} for stock increases...")
-        
-        # Check if ANY brand shows stock increase on curr_date
-        found_increase = False
-        for brand_name, stock_data in all_brand_stock_data.items():
-            if prev_date in stock_data and curr_date in stock_data:
-                prev_stock = stock_data[prev_date]
-                curr_stock = stock_data[curr_date]
-                
-                print(f"  {brand_name}: {prev_stock} -> {curr_stock}")
-                
-                # Stock increase indicates restocking (any increase > 0)
-                if curr_stock > prev_stock:
-                    global_D1_date = curr_date
-                    print(f"*** FOUND GLOBAL D1: {curr_date} ***")
-                    print(f"    Restocking detected in: {brand_name}")
-                    print(f"    Stock change: {prev_stock} -> {curr_stock} (+{curr_stock - prev_stock})")
-                    found_increase = True
-                    break
+    df = filter_brand_rows(df, brand_col)
+    
+    if trace.enabled:
+        trace.event('rows_filtered', potential_brands=len(df))
+    
+    if df.empty:
+        raise HTTPException(status_code=400, detail="No valid brand data found after filtering")
+    
+    # Text date columns unchanged since the last parse of these rows are not decoded again
+    with parse_cache.decoded_columns(df, brand_col) as decoded:
+        # STEP 1: Find global D1 date (when stock increased for ANY brand)
+        global_D1_date = find_global_d1(df, brand_col, date_columns, trace, decoded)
         
-        if found_increase:
-            break
+        # STEP 2: Process every brand with the global D1 in one pass over the stock matrix
+        parallel = BRAND_WORKERS > 1 and len(df) >= PARALLEL_BRAND_ROWS
+        liquor_data = (build_brand_records_parallel if parallel else build_brand_records)(
+            df, brand_col, index_col, wholesale_rate_col, selling_rate_col, date_columns, global_D1_date, trace,
+            date_days, decoded,
+        )
+    
+    if not liquor_data:
+        raise HTTPException(status_code=400, detail="No valid liquor data could be extracted from the file")
     
-    # If no stock increase found anywhere, use first date as fallback
-    if not global_D1_date:
-        global_D1_date = sorted_dates[0]
-        print(f"*** NO RESTOCKING FOUND - Using first date as D1: {global_D1_date} ***")
+    if trace.enabled:
+        trace.event('parsed', brands=len(liquor_data), potential_brands=len(df), D1_date=global_D1_date)
+    logging.info(f"Successfully parsed {len(liquor_data)} liquor brands with proper stock analysis")
+    return liquor_data
+
+# Streaming ingest
+STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS', '5000'))
+STREAMING_UPLOAD_BYTES = int(os.environ.get('STREAMING_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+
+def _scan_column(column: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert one date column for the D1 scan - any non-missing cell counts, unparseable cells are 0"""
+    if pd.api.types.is_numeric_dtype(column):
+        return _stock_column(column)
+    raw = column.to_numpy(dtype=object)
+    present = np.array([bool(pd.notna(value)) for value in raw], dtype=bool)
+    values = np.array([_to_float(value) if is_present else 0.0 for value, is_present in zip(raw, present)], dtype=float)
+    return values, present
+
+def build_scan_matrix(
+    df: pd.DataFrame, date_columns: List[str], decoded: Optional[DecodedColumns] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Build the (brands x dates) stock matrix the D1 scan compares"""
+    stock = np.zeros((len(df), len(date_columns)), dtype=float)
+    present = np.zeros((len(df), len(date_columns)), dtype=bool)
+    for position, date_col in enumerate(date_columns):
+        column = df[date_col]
+        stock[:, position], present[:, position] = (
+            decoded.column('scan', column, _scan_column) if decoded else _scan_column(column)
+        )
+    return stock, present
+
+def first_increase_positions(stock: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Position of the first date where each row's stock rises over the previous date, -1 if it never does"""
+    increases = present[:, 1:] & present[:, :-1] & (stock[:, 1:] > stock[:, :-1])
+    if not increases.shape[1]:
+        return np.full(len(stock), -1)
+    return np.where(increases.any(axis=1), increases.argmax(axis=1) + 1, -1)
+
+def update_restock_positions(
+    df: pd.DataFrame, brand_col: str, date_columns: List[str], restock_positions: Dict[str, int]
+) -> None:
+    """Track the first restock position of brands that restock.
+
+    A later row for the same brand replaces an earlier one, so only restocking brands are
+    kept and the scan state stays small however many rows are streamed through it.
+    """
+    brand_names = df[brand_col].astype(str).str.strip()
+    stock, present = build_scan_matrix(df, date_columns)
+    rows = pd.DataFrame({'brand': brand_names.to_numpy(), 'position': first_increase_positions(stock, present)})
+    rows = rows[~brand_names.str.lower().isin(['nan', 'none', '']).to_numpy() & present.any(axis=1)]
+    rows = rows.drop_duplicates('brand', keep='last')
+    restocked = rows['position'] > 0
+    for brand in rows.loc[~restocked, 'brand'].tolist():
+        restock_positions.pop(brand, None)
+    restock_positions.update(zip(rows.loc[restocked, 'brand'].tolist(), rows.loc[restocked, 'position'].tolist()))
+
+def iter_csv_chunks(source: Any, chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """Read a CSV file object in chunks of rows, labelled with their position in the file"""
+    source.seek(0)
+    with pd.read_csv(source, chunksize=chunk_rows or STREAM_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip()
+            yield chunk
+
+class XlsxRowStream:
+    """Row iteration over the first worksheet of an xlsx file in openpyxl read-only mode.
+
+    Rows are handed out as DataFrame chunks of at most `chunk_rows` rows, labelled with their
+    position in the sheet, so memory stays bounded by the chunk size rather than the sheet size.
+    """
+    def __init__(self, source: Any, chunk_rows: Optional[int] = None):
+        from openpyxl import load_workbook
+        self.workbook = load_workbook(source, read_only=True, data_only=True)
+        self.sheet = self.workbook.worksheets[0]
+        self.chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
     
-    print(f"Global D1 determined: {global_D1_date}")
+    def header(self) -> List[Any]:
+        for row in self.sheet.iter_rows(min_row=1, max_row=1, values_only=True):
+            return list(row)
+        return []
     
-    # STEP 2: Process each brand with the global D1
-    liquor_data = []
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        rows = self.sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        names = [name.strip() if isinstance(name, str) else name for name in header_names(list(header))]
+        width = len(names)
+        batch = []
+        offset = 0
+        for row in rows:
+            batch.append(row[:width] + (None,) * (width - len(row)))
+            if len(batch) == self.chunk_rows:
+                yield self._frame(batch, names, offset)
+                offset += len(batch)
+                batch = []
+        if batch:
+            yield self._frame(batch, names, offset)
     
-    for idx, row in df.iterrows():
-        try:
-            brand_name = str(row[brand_col]).strip()
-            if not brand_name or brand_name.lower() in ['nan', 'none', '']:
-                continue
-            
-            # Get index - preserve original index from Excel file
-            index_num = idx + 1
-            if index_col and pd.notna(row[index_col]):
-                try:
-                    # Try to extract integer from the index value
-                    index_val = str(row[index_col]).strip()
-                    # Handle cases where index might have extra characters
-                    import re
-                    numeric_match = re.search(r'\d+', index_val)
-                    if numeric_match:
-                        index_num = int(numeric_match.group())
-                    else:
-                        index_num = int(float(row[index_col]))
-                except:
-                    index_num = idx + 1
-            
-            # Get rates
-            wholesale_rate = 0.0
-            selling_rate = 0.0
-            
-            if wholesale_rate_col and pd.notna(row[wholesale_rate_col]):
-                try:
-                    wholesale_rate = float(row[wholesale_rate_col])
-                except:
-                    pass
-            
-            if selling_rate_col and pd.notna(row[selling_rate_col]):
-                try:
-                    selling_rate = float(row[selling_rate_col])
-                except:
-                    pass
-            
-            # If wholesale rate not provided, calculate as 90% of selling rate
-            if wholesale_rate == 0 and selling_rate > 0:
-                wholesale_rate = selling_rate * 0.9
-            elif selling_rate == 0 and wholesale_rate > 0:
-                selling_rate = wholesale_rate / 0.9
-            
-            # Get daily stock data with enhanced debugging
-            daily_stock_data = {}
-            valid_stock_values = []
-            
-            print(f"Processing {brand_name} - Available date columns: {date_columns}")
-            
-            for date_col in date_columns:
-                try:
-                    raw_value = row[date_col]
-                    print(f"  {date_col}: raw_value = {raw_value}, type = {type(raw_value)}, notna = {pd.notna(raw_value)}")
-                    
-                    if pd.notna(raw_value) and str(raw_value).strip() != '':
-                        # Try multiple conversion methods
-                        stock_qty = 0
-                        try:
-                            stock_qty = float(raw_value)
-                        except (ValueError, TypeError):
-                            try:
-                                # Handle string numbers
-                                stock_qty = float(str(raw_value).replace(',', ''))
-                            except:
-                                stock_qty = 0
-                        
-                        daily_stock_data[date_col] = stock_qty
-                        print(f"    Converted to: {stock_qty}")
-                        
-                        if stock_qty >= 0:  # Include zero values too
-                            valid_stock_values.append((date_col, stock_qty))
-                    else:
-                        daily_stock_data[date_col] = 0
-                        print(f"    Skipped (empty/NaN)")
-                        
-                except Exception as e:
-                    daily_stock_data[date_col] = 0
-                    print(f"    Error processing {date_col}: {e}")
-            
-            print(f"  Final valid_stock_values: {valid_stock_values}")
-            
-            if not valid_stock_values:
-                print(f"  WARNING: No valid stock data found for {brand_name}")
-                continue  # Skip if no valid stock data
-            
-            # Use GLOBAL D1 and individual DL
-            # D1: Use the global D1 date we found earlier
-            # DL: Last date with stock data for this specific brand
-            
-            # Sort by date order (chronologically)
-            sorted_stock_values = sorted(valid_stock_values, key=lambda x: x[0])
-            
-            # Find D1 stock for this brand on the global D1 date
-            D1_date = global_D1_date
-            D1_stock = daily_stock_data.get(global_D1_date, 0)
-            
-            # If brand has no data on global D1 date, find closest previous date
-            if D1_stock == 0:
-                for date_col, stock_val in sorted_stock_values:
-                    if date_col <= global_D1_date:
-                        D1_stock = stock_val
-                    else:
-                        break
-            
-            # DL: Use the last date in the entire dataset (should be 29-Sep for your data)
-            global_DL_date = sorted_dates[-1]  # Last date across all data
-            DL_date = global_DL_date
-            DL_stock = daily_stock_data.get(global_DL_date, 0)
-            
-            # If brand has no data on the global last date, use their last available data
-            if DL_stock == 0:
-                DL_date, DL_stock = sorted_stock_values[-1]
-            
-            print(f"  Using Global D1: {D1_date} = {D1_stock}, Individual DL: {DL_date} = {DL_stock}")
-            
-            # Calculate total sales between global D1 and individual DL
-            total_sales_qty = max(0, D1_stock - DL_stock)  # Stock reduction = sales
-            
-            # Calculate number of days between global D1 and individual DL  
-            try:
-                from datetime import datetime
-                # Try to parse dates to calculate actual days
-                d1_idx = date_columns.index(D1_date) if D1_date in date_columns else 0
-                dl_idx = date_columns.index(DL_date) if DL_date in date_columns else len(date_columns) - 1
-                days_between = max(1, dl_idx - d1_idx + 1)
-            except:
-                days_between = max(1, len(sorted_stock_values) - 1)
-            
-            # Calculate average daily sales
-            avg_daily_sales_qty = total_sales_qty / days_between if days_between > 0 else 0
-            
-            # Calculate monthly sales (24 days as requested)
-            monthly_sales_qty = avg_daily_sales_qty * 24
-            monthly_sales_value = monthly_sales_qty * selling_rate
-            
-            # Current stock value (on DL date)
-            current_stock_value = DL_stock * selling_rate
-            
-            # Calculate stock ratio (stock value / monthly sales value)
-            stock_ratio = current_stock_value / max(1, monthly_sales_value) if monthly_sales_value > 0 else 0
-            
-            # Stock availability in days
-            stock_available_days = (DL_stock / max(0.1, avg_daily_sales_qty)) if avg_daily_sales_qty > 0 else 999
-            
-            print(f"  Calculations: Total sales={total_sales_qty}, Days={days_between}, Avg daily={avg_daily_sales_qty:.2f}")
-            print(f"  Monthly sales value={monthly_sales_value:.2f}, Stock ratio={stock_ratio:.2f}")
-            
-            brand_data = {
-                'brand_name': brand_name,
-                'product_id': f"ID_{index_num}",
-                'index_number': int(index_num),
-                'wholesale_rate': float(wholesale_rate),
-                'selling_rate': float(selling_rate),
-                'rate': float(selling_rate),  # For compatibility
-                'D1_date': str(D1_date),
-                'D1_stock': float(D1_stock),
-                'DL_date': str(DL_date),
-                'DL_stock': float(DL_stock),
-                'current_stock_qty': int(max(0, DL_stock)),
-                'total_sales_qty': float(total_sales_qty),
-                'avg_daily_sales_qty': float(avg_daily_sales_qty),
-                'monthly_sales_qty': float(monthly_sales_qty),
-                'monthly_sale_value': float(monthly_sales_value),
-                'monthly_sale_qty': int(max(0, monthly_sales_qty)),  # For compatibility
-                'stock_value_today': float(current_stock_value),
-                'stock_ratio': float(stock_ratio),
-                'stock_available_days': float(min(999, max(0, stock_available_days))),
-                'avg_daily_sale': float(monthly_sales_value / 30),  # For compatibility
-                'stock_value_before': float(D1_stock * selling_rate),
-                'daily_sales': daily_stock_data,
-                'days_analyzed': int(max(1, days_between)),
-            }
-            
-            liquor_data.append(brand_data)
-            
-        except Exception as e:
-            logging.error(f"Error parsing row {idx} ({brand_name}): {e}")
-            print(f"Failed to parse brand: {brand_name}, Error: {e}")  # Debug info
+    @staticmethod
+    def _frame(batch: List[tuple], names: List[Any], offset: int) -> pd.DataFrame:
+        return pd.DataFrame.from_records(batch, columns=names, index=pd.RangeIndex(offset, offset + len(batch)))
+    
+    def close(self) -> None:
+        self.workbook.close()
+
+def parse_tabular_stream(
+    read_chunks: Callable[[], Iterator[pd.DataFrame]], trace: ParseTrace = NULL_TRACE,
+    progress: Optional[UploadProgress] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Parse the tabular format from chunks of rows, yielding brand records chunk by chunk.
+
+    The rows are read twice: the first pass finds the global D1 date, the second computes
+    every brand's metrics against it.
+    """
+    columns = None
+    restock_positions: Dict[str, int] = {}
+    data_rows = 0
+    potential_brands = 0
+    for chunk in read_chunks():
+        if columns is None:
+            columns = detect_tabular_columns(list(chunk.columns), trace)
+        brand_col, date_columns = columns[0], columns[4]
+        data_rows += len(chunk)
+        chunk = filter_brand_rows(chunk, brand_col)
+        potential_brands += len(chunk)
+        update_restock_positions(chunk, brand_col, date_columns, restock_positions)
+    
+    if not data_rows:
+        raise HTTPException(status_code=400, detail="The uploaded file is empty or contains no data")
+    if trace.enabled:
+        trace.event('rows_filtered', potential_brands=potential_brands)
+    if not potential_brands:
+        raise HTTPException(status_code=400, detail="No valid brand data found after filtering")
+    
+    brand_col, index_col, wholesale_rate_col, selling_rate_col, date_columns, date_days = columns
+    if restock_positions:
+        brand, position = min(restock_positions.items(), key=lambda restock: restock[1])
+        global_D1_date = date_columns[position]
+        if trace.enabled:
+            trace.event('d1_found', date=global_D1_date, brand=brand)
+    else:
+        global_D1_date = date_columns[0]
+        if trace.enabled:
+            trace.event('d1_fallback', date=global_D1_date, reason='no restocking found')
+    
+    parsed = 0
+    for chunk in read_chunks():
+        if progress:
+            progress.rows_parsed += len(chunk)
+        chunk = filter_brand_rows(chunk, brand_col)
+        if chunk.empty:
             continue
+        records = build_brand_records(
+            chunk, brand_col, index_col, wholesale_rate_col, selling_rate_col, date_columns, global_D1_date, trace,
+            date_days,
+        )
+        if records:
+            parsed += len(records)
+            yield records
     
-    if not liquor_data:
+    if not parsed:
         raise HTTPException(status_code=400, detail="No valid liquor data could be extracted from the file")
+    if trace.enabled:
+        trace.event('parsed', brands=parsed, potential_brands=potential_brands, D1_date=global_D1_date)
+    logging.info(f"Successfully parsed {parsed} liquor brands from a streamed upload")
+
+def parse_upload_stream(
+    source: Any, trace: ParseTrace = NULL_TRACE, progress: Optional[UploadProgress] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """Parse an upload from a file object in bounded chunks where the format allows it"""
+    file_format = detect_upload_format(source.read(8))
+    source.seek(0)
+    if file_format == 'xlsx':
+        with unparseable_file_errors():
+            stream = XlsxRowStream(source)
+            try:
+                if is_tabular_header(stream.header()):
+                    if trace.enabled:
+                        trace.event('format', format=file_format, layout='tabular', streaming=True)
+                    yield from parse_tabular_stream(stream.chunks, trace, progress)
+                    return
+            finally:
+                stream.close()
+        source.seek(0)
+    elif file_format == 'csv':
+        tabular = is_tabular_header(_csv_header_row(source.read(65536)))
+        source.seek(0)
+        if tabular:
+            if trace.enabled:
+                trace.event('format', format=file_format, layout='tabular', streaming=True)
+            with unparseable_file_errors():
+                yield from parse_tabular_stream(lambda: iter_csv_chunks(source), trace, progress)
+            return
+    # xls files and the list layout are parsed in memory
+    yield parse_excel_data(source.read(), trace, progress)
+
+def upload_cache_key(source: Any, trace: ParseTrace = NULL_TRACE) -> Optional[str]:
+    """Parse cache key of an upload's bytes or file object; None when tracing, so traces show the parser's decisions"""
+    if trace.enabled or not parse_cache.enabled:
+        return None
+    if isinstance(source, bytes):
+        return parse_cache.key(source)
+    source.seek(0)
+    key = parse_cache.key(*iter(lambda: source.read(1024 * 1024), b''))
+    source.seek(0)
+    return key
+
+def parse_upload_content(content: bytes, trace_enabled: bool = False) -> Dict[str, Any]:
+    """Parse a whole upload into liquor documents in an executor worker.
+
+    HTTPException does not survive pickling, so parse errors come back as data, together
+    with the worker's trace events. An upload parsed before is served from the parse cache.
+    """
+    trace = ParseTrace() if trace_enabled else NULL_TRACE
+    result: Dict[str, Any] = {}
+    try:
+        batches = parse_cache.documents(
+            upload_cache_key(content, trace), lambda: [build_liquor_batch(parse_excel_data(content, trace))]
+        )
+        result['documents'] = [document for batch in batches for document in batch]
+    except HTTPException as e:
+        result['error'] = (e.status_code, e.detail)
+    result['events'] = list(trace.events)
+    result['dropped'] = trace.dropped
+    return result
+
+async def parse_upload(content: bytes, trace: ParseTrace = NULL_TRACE) -> List[Dict[str, Any]]:
+    """Parse and validate a whole upload on the parse executor, merging its trace into `trace`"""
+    result = await run_parse(parse_upload_content, content, trace.enabled)
+    if trace.enabled:
+        trace.merge(result['events'], result['dropped'])
+    if 'error' in result:
+        raise HTTPException(status_code=result['error'][0], detail=result['error'][1])
+    return result['documents']
+
+async def parse_upload_batches(
+    source: Any, trace: ParseTrace = NULL_TRACE, progress: Optional[UploadProgress] = None
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Liquor document batches from parse_upload_stream, built on the I/O pool under the parse concurrency limit.
+
+    An upload parsed before is served from the parse cache.
+    """
+    def documents() -> Iterator[List[Dict[str, Any]]]:
+        yield from parse_cache.documents(
+            upload_cache_key(source, trace), lambda: build_liquor_documents(parse_upload_stream(source, trace, progress))
+        )
     
-    print(f"Successfully parsed {len(liquor_data)} out of {len(df)} potential brands")
-    logging.info(f"Successfully parsed {len(liquor_data)} liquor brands with proper stock analysis")
-    return liquor_data
+    async with parse_slots():
+        async for batch in iterate_in_thread(documents()):
+            yield batch
 
 def parse_list_format(df: pd.DataFrame) -> List[Dict[str, Any]]:
     """Parse simple list format (brand names followed by numerical data)"""
@@ -485,30 +1462,37 @@ def parse_list_format(df: pd.DataFrame) -> List[Dict[str, Any]]:
             logging.warning(f"Error parsing data for {brand_names[i] if i < len(brand_names) else 'Unknown'}: {e}")
             continue
     
+    # Index numbers come from the product ids, as the tabular format's come from its Index column
+    product_ids = pd.Series([brand_data['product_id'] for brand_data in liquor_data], dtype=object)
+    index_numbers = normalize_index_numbers(product_ids, np.arange(1, len(liquor_data) + 1))
+    for brand_data, index_number in zip(liquor_data, index_numbers.tolist()):
+        brand_data['index_number'] = index_number
+    
     return liquor_data
 
-def calculate_overstocking(data: List[Dict], multiplier: float = 3.0) -> List[Dict]:
-    """Calculate overstocking based on configurable multiplier"""
-    overstocked_items = []
+def overstock_entry(item: Dict, multiplier: float = 3.0) -> Optional[Dict]:
+    """Overstock details for one brand, or None when its stock is within the threshold"""
+    monthly_avg_sale = item.get('monthly_sale_value', 0)
+    current_stock_value = item.get('stock_value_today', 0)
     
-    for item in data:
-        monthly_avg_sale = item.get('monthly_sale_value', 0)
-        current_stock_value = item.get('stock_value_today', 0)
-        
-        # Calculate threshold (multiplier * monthly average)
-        threshold = monthly_avg_sale * multiplier
-        
-        if current_stock_value > threshold and monthly_avg_sale > 0:
-            overstock_value = current_stock_value - threshold
-            overstocked_items.append({
-                'brand_name': item['brand_name'],
-                'current_stock_value': current_stock_value,
-                'monthly_avg_sale': monthly_avg_sale,
-                'threshold': threshold,
-                'overstock_value': overstock_value,
-                'stock_ratio': item.get('stock_ratio', 0)
-            })
+    # Calculate threshold (multiplier * monthly average)
+    threshold = monthly_avg_sale * multiplier
     
+    if current_stock_value > threshold and monthly_avg_sale > 0:
+        overstock_value = current_stock_value - threshold
+        return {
+            'brand_name': item['brand_name'],
+            'current_stock_value': current_stock_value,
+            'monthly_avg_sale': monthly_avg_sale,
+            'threshold': threshold,
+            'overstock_value': overstock_value,
+            'stock_ratio': item.get('stock_ratio', 0)
+        }
+    return None
+
+def calculate_overstocking(data: Iterable[Dict], multiplier: float = 3.0) -> List[Dict]:
+    """Calculate overstocking based on configurable multiplier"""
+    overstocked_items = [entry for entry in (overstock_entry(item, multiplier) for item in data) if entry]
     return sorted(overstocked_items, key=lambda x: x['overstock_value'], reverse=True)
 
 # API Endpoints
@@ -516,10 +1500,513 @@ def calculate_overstocking(data: List[Dict], multiplier: float = 3.0) -> List[Di
 async def root():
     return {"message": "Liquor Sales Analysis Dashboard API"}
 
+UPLOAD_MODES = ('replace', 'incremental')
+BULK_WRITE_BATCH = int(os.environ.get('BULK_WRITE_BATCH', '1000'))
+
+# Dataset versions
+# Every upload stages its documents under a new version tag in `dataset_versions`; the
+# `dataset_state` pointer document is only flipped to that version once the write completes.
+DATASET_STATE_ID = 'liquor_data'
+DATASET_HISTORY = int(os.environ.get('DATASET_HISTORY', '2'))
+READ_BATCH_SIZE = int(os.environ.get('READ_BATCH_SIZE', '1000'))
+
+# Every read is pinned to a dataset version, so each index leads with it. The pipeline
+# analytics backend's top-selling sort ends in _id so ties come back in insertion order.
+LIQUOR_DATA_INDEXES = [
+    IndexModel(
+        [('dataset_versions', ASCENDING), ('brand_name', ASCENDING)], name='version_brand_name', unique=True,
+        partialFilterExpression={'dataset_versions': {'$exists': True}},
+    ),
+    IndexModel([('id', ASCENDING)], name='id', unique=True),
+    IndexModel([('dataset_versions', ASCENDING), ('monthly_sale_value', DESCENDING), ('_id', ASCENDING)], name='version_monthly_sale_value'),
+]
+
+def new_dataset_version() -> str:
+    """Sortable, unique dataset version id"""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+def dataset_filter(version: Optional[str]) -> Dict[str, Any]:
+    """Query selecting the documents of a dataset version; unversioned data predates the pointer"""
+    return {'dataset_versions': version} if version else {}
+
+async def get_dataset_state() -> Optional[Dict[str, Any]]:
+    return await db.dataset_state.find_one({'_id': DATASET_STATE_ID})
+
+async def cached_dataset_state() -> Optional[Dict[str, Any]]:
+    """Dataset pointer, re-read at most every DATASET_POINTER_TTL seconds unless this process flipped it"""
+    if time.monotonic() >= dataset_state_cache['expires']:
+        remember_dataset_state(await get_dataset_state())
+    return dataset_state_cache['state']
+
+def remember_dataset_state(state: Optional[Dict[str, Any]]) -> None:
+    dataset_state_cache['state'] = state
+    dataset_state_cache['expires'] = time.monotonic() + DATASET_POINTER_TTL
+
+async def current_dataset_version() -> Optional[str]:
+    state = await get_dataset_state()
+    return state['version'] if state else None
+
+async def resolve_dataset_version(dataset_version: Optional[str] = None) -> Optional[str]:
+    """Pin a read to the requested dataset version, or to the current one"""
+    state = await cached_dataset_state()
+    if dataset_version is None:
+        return state['version'] if state else None
+    if not state or dataset_version not in [state['version'], *state.get('previous_versions', [])]:
+        raise HTTPException(status_code=404, detail=f"Dataset version '{dataset_version}' not found")
+    return dataset_version
+
+def iter_liquor_records(version: Optional[str], record_type: Optional[type] = None):
+    """Async cursor over a dataset version's brand documents, fetched READ_BATCH_SIZE at a time
+    and projected to `record_type`'s fields"""
+    return db.liquor_data.find(dataset_filter(version), record_projection(record_type)).batch_size(READ_BATCH_SIZE)
+
+# Columnar datasets
+# Analytics, charts, demand recommendations and calculation details read a dataset version
+# through one ColumnarDataset, loaded on first use and shared by every later request.
+COLUMNAR_DATASETS = int(os.environ.get('COLUMNAR_DATASETS', '2'))
+
+class ColumnarDataset:
+    """A dataset version's brand records as NumPy columns.
+
+    Rows are kept in _id order, so stable sorts break ties on _id as the aggregation pipelines
+    do. Brand names and dates are interned strings, and `daily_sales` is an integer
+    (brands x dates) matrix over every date any brand has, 0 where a brand has no entry.
+    """
+    FLOAT_COLUMNS = (
+        'selling_rate', 'wholesale_rate', 'monthly_sale_value', 'stock_value_today', 'stock_ratio',
+        'stock_available_days', 'D1_stock', 'DL_stock', 'total_sales_qty', 'avg_daily_sales_qty',
+    )
+    INT_COLUMNS = ('index_number', 'current_stock_qty', 'monthly_sale_qty', 'days_analyzed')
+    TEXT_COLUMNS = ('brand_name', 'D1_date', 'DL_date')
+    # Older documents without a selling rate fall back to their rate
+    FALLBACKS = {'selling_rate': 'rate'}
+    
+    def __init__(self, columns: Dict[str, np.ndarray], dates: List[str], daily_sales: np.ndarray):
+        self.columns = columns
+        self.dates = dates
+        self.daily_sales = daily_sales
+    
+    def __len__(self) -> int:
+        return len(self.daily_sales)
+    
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+    
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the numeric arrays; interned strings are shared and not counted"""
+        return self.daily_sales.nbytes + sum(column.nbytes for column in self.columns.values())
+    
+    @classmethod
+    def from_records(cls, records: Iterable[DatasetRecord]) -> 'ColumnarDataset':
+        """Build the columns from DatasetRecords; missing fields read as 0 or 'N/A' as the endpoints always did"""
+        records = sorted(records, key=lambda record: record['_id'])
+        count = len(records)
+        columns = {}
+        for names, dtype in ((cls.FLOAT_COLUMNS, np.float64), (cls.INT_COLUMNS, np.int64)):
+            for name in names:
+                fallback = cls.FALLBACKS.get(name)
+                values = (record.get(name, record.get(fallback, 0)) for record in records) if fallback else (
+                    record.get(name, 0) for record in records
+                )
+                columns[name] = np.fromiter(values, dtype=dtype, count=count)
+        for name in cls.TEXT_COLUMNS:
+            columns[name] = np.array([sys.intern(record.get(name, 'N/A')) for record in records], dtype=object)
+        
+        # Brands uploaded together share the same dates, so rows are scattered into the matrix
+        # one date layout at a time
+        date_positions: Dict[str, int] = {}
+        layouts: Dict[Tuple[str, ...], Tuple[List[int], List[int], List[List[int]]]] = {}
+        for row, record in enumerate(records):
+            sales = record.get('daily_sales') or {}
+            dates = tuple(sales)
+            layout = layouts.get(dates)
+            if layout is None:
+                positions = [date_positions.setdefault(sys.intern(date), len(date_positions)) for date in dates]
+                layout = layouts[dates] = (positions, [], [])
+            layout[1].append(row)
+            layout[2].append(list(sales.values()))
+        # Columns are laid out in date order, so trends and date ranges need no sorting later
+        dates = chronological_dates(date_positions)
+        order = np.empty(len(dates), dtype=np.intp)
+        order[[date_positions[date] for date in dates]] = np.arange(len(dates))
+        daily_sales = np.zeros((count, len(dates)), dtype=np.int64)
+        for positions, rows, values in layouts.values():
+            if positions:
+                daily_sales[np.ix_(rows, order[positions])] = values
+        return cls(columns, dates, daily_sales)
+    
+    def ranked(self, name: str, descending: bool = False, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Row numbers sorted by a column, ties in _id order; only `rows` when given"""
+        rows = np.arange(len(self)) if rows is None else rows
+        values = self.columns[name][rows]
+        return rows[np.argsort(-values if descending else values, kind='stable')]
+    
+    def records(self, rows: np.ndarray, record_type: type) -> List[Dict[str, Any]]:
+        """Rows as dicts of a record type's columnar fields, holding Python scalars"""
+        names = [name for name in record_type.__annotations__ if name in self.columns]
+        values = [self.columns[name][rows].tolist() for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+# Loads in flight or finished, most recently used last; futures are shared so concurrent
+# requests for the same version wait on a single load
+columnar_datasets: "OrderedDict[Optional[str], asyncio.Future]" = OrderedDict()
+
+async def load_columnar_dataset(version: Optional[str]) -> ColumnarDataset:
+    """Fetch a dataset version's DatasetRecords and build its columns in a worker thread"""
+    records = [record async for record in iter_liquor_records(version, DatasetRecord)]
+    return await run_io(ColumnarDataset.from_records, records)
+
+async def get_columnar_dataset(version: Optional[str]) -> ColumnarDataset:
+    """The ColumnarDataset of a dataset version, loaded once and shared across requests"""
+    future = columnar_datasets.get(version)
+    # A load left pending by a stopped event loop can never finish
+    if future is None or (not future.done() and future.get_loop() is not asyncio.get_running_loop()):
+        future = columnar_datasets[version] = asyncio.ensure_future(load_columnar_dataset(version))
+        
+        def forget_failed(done: asyncio.Future) -> None:
+            if (done.cancelled() or done.exception()) and columnar_datasets.get(version) is done:
+                del columnar_datasets[version]
+        future.add_done_callback(forget_failed)
+        while len(columnar_datasets) > COLUMNAR_DATASETS:
+            columnar_datasets.popitem(last=False)
+    else:
+        columnar_datasets.move_to_end(version)
+    # One cancelled request must not cancel the load the others are waiting on
+    return await asyncio.shield(future)
+
+async def swap_dataset_state(build_state: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Compare-and-swap the dataset pointer, retrying if another upload flipped it first"""
+    while True:
+        state = await get_dataset_state()
+        new_state = {**build_state(state), '_id': DATASET_STATE_ID, 'updated_at': datetime.now(timezone.utc)}
+        if state is None:
+            try:
+                await db.dataset_state.insert_one(new_state)
+            except DuplicateKeyError:
+                continue
+        else:
+            result = await db.dataset_state.replace_one({'_id': DATASET_STATE_ID, 'version': state['version']}, new_state)
+            if not result.matched_count:
+                continue
+        remember_dataset_state(new_state)
+        analytics_cache.invalidate()
+        columnar_datasets.clear()
+        return state, new_state
+
+async def prune_dataset_versions(expired: List[str]) -> None:
+    """Delete documents only expired versions reference, untag the shared ones, and drop unversioned data"""
+    if expired:
+        # Deleting before untagging never leaves untagged documents behind to collide in the version/brand index
+        await db.liquor_data.delete_many({'dataset_versions': {'$exists': True, '$not': {'$elemMatch': {'$nin': expired}}}})
+        await db.liquor_data.update_many(
+            {'dataset_versions': {'$in': expired}}, {'$pull': {'dataset_versions': {'$in': expired}}}
+        )
+    await db.liquor_data.delete_many({'dataset_versions': {'$exists': False}})
+
+async def publish_dataset_version(version: str) -> None:
+    """Flip the pointer to a fully written version, keeping DATASET_HISTORY versions for rollback"""
+    def build_state(state):
+        history = [state['version'], *state.get('previous_versions', [])] if state else []
+        return {'version': version, 'previous_versions': history[:DATASET_HISTORY]}
+    state, new_state = await swap_dataset_state(build_state)
+    history = [state['version'], *state.get('previous_versions', [])] if state else []
+    await prune_dataset_versions(history[DATASET_HISTORY:])
+
+async def discard_dataset_version(version: str) -> None:
+    """Remove the staged documents of a version whose write did not complete"""
+    await db.liquor_data.delete_many({'dataset_versions': [version]})
+    await db.liquor_data.update_many({'dataset_versions': version}, {'$pull': {'dataset_versions': version}})
+
+def record_content_hash(document: Dict[str, Any]) -> str:
+    """Hash of a brand document's parsed content, ignoring its id and upload bookkeeping"""
+    content = {key: value for key, value in document.items() if key not in ('id', 'upload_timestamp', 'content_hash')}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+# Parsed records are validated a whole batch at a time by a compiled validator generated from
+# LiquorData's fields. It applies the model's coercions and rejections without constructing
+# a LiquorData for every brand.
+LiquorDocument = TypedDict('LiquorDocument', {name: field.annotation for name, field in LiquorData.model_fields.items()})
+# The validator copies every value, so records can share these defaults
+LIQUOR_DOCUMENT_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in LiquorData.model_fields.items() if name not in ('id', 'upload_timestamp') and not field.is_required()
+}
+liquor_documents_validator = TypeAdapter(List[LiquorDocument])
+
+def build_liquor_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Validate a batch of parsed records and stamp ids, the upload time and content hashes.
+
+    The documents equal LiquorData(**record).model_dump() apart from the new ids, and the
+    whole batch shares one upload timestamp.
+    """
+    upload_timestamp = datetime.now(timezone.utc)
+    documents = liquor_documents_validator.validate_python([
+        {**LIQUOR_DOCUMENT_DEFAULTS, 'id': str(uuid.uuid4()), 'upload_timestamp': upload_timestamp, **item_data}
+        for item_data in batch
+    ])
+    for document in documents:
+        document['content_hash'] = record_content_hash(document)
+    return documents
+
+def restamp_liquor_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Give documents built by an earlier upload new ids and this upload's timestamp"""
+    upload_timestamp = datetime.now(timezone.utc)
+    for document in batch:
+        document['id'] = str(uuid.uuid4())
+        document['upload_timestamp'] = upload_timestamp
+    return batch
+
+def build_liquor_documents(batches: Iterable[List[Dict[str, Any]]]) -> Iterator[List[Dict[str, Any]]]:
+    for batch in batches:
+        yield build_liquor_batch(batch)
+
+async def replace_liquor_data(batches: AsyncIterator[List[Dict[str, Any]]], base_version: Optional[str], version: str) -> Dict[str, int]:
+    """Stage batches of built liquor documents as a complete new dataset version"""
+    # Parse up to the first batch before staging anything
+    first_batch = await anext(batches, None)
+    if not first_batch:
+        raise HTTPException(status_code=400, detail="No valid data found in the file")
+    
+    # Counted before staging, since without a base version the filter matches every document
+    removed = await db.liquor_data.count_documents(dataset_filter(base_version))
+    total_records = 0
+    uploaded_brands = set()
+    async for batch in prepend(first_batch, batches):
+        operations = []
+        for document in batch:
+            document['dataset_versions'] = [version]
+            if document['brand_name'] in uploaded_brands:
+                # A repeated brand row replaces the earlier one, keeping brand names unique per version
+                operations.append(DeleteOne({'dataset_versions': version, 'brand_name': document['brand_name']}))
+            uploaded_brands.add(document['brand_name'])
+            operations.append(InsertOne(document))
+        for start in range(0, len(operations), BULK_WRITE_BATCH):
+            await db.liquor_data.bulk_write(operations[start:start + BULK_WRITE_BATCH], ordered=True)
+        total_records += len(batch)
+    return {'total_records': total_records, 'inserted': len(uploaded_brands), 'removed': removed}
+
+async def upsert_liquor_data(batches: AsyncIterator[List[Dict[str, Any]]], base_version: Optional[str], version: str) -> Dict[str, int]:
+    """Stage a new dataset version that shares unchanged brand documents with the base version.
+
+    Unchanged brands are only tagged with the new version; new and changed brands get new
+    documents, and brands missing from the upload are simply left out of the new version.
+    """
+    first_batch = await anext(batches, None)
+    if not first_batch:
+        raise HTTPException(status_code=400, detail="No valid data found in the file")
+    
+    stored_records = {
+        record['brand_name']: record
+        async for record in db.liquor_data.find(
+            dataset_filter(base_version), {'_id': 0, 'id': 1, 'brand_name': 1, 'content_hash': 1}
+        )
+    }
+    counts = {'total_records': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+    # Brand name -> (id of the document staged for it, whether that document is shared with the base version)
+    staged_documents: Dict[str, Tuple[str, bool]] = {}
+    
+    async for batch in prepend(first_batch, batches):
+        operations = []
+        for document in batch:
+            document['dataset_versions'] = [version]
+            brand_name = document['brand_name']
+            stored = stored_records.get(brand_name)
+            unchanged = stored is not None and stored.get('content_hash') == document['content_hash']
+            counts['total_records'] += 1
+            if brand_name in staged_documents:
+                # A repeated brand row replaces the earlier one without being counted again
+                staged_id, shared = staged_documents[brand_name]
+                operations.append(
+                    UpdateOne({'id': staged_id}, {'$pull': {'dataset_versions': version}}) if shared
+                    else DeleteOne({'id': staged_id})
+                )
+            else:
+                counts['inserted' if stored is None else 'unchanged' if unchanged else 'updated'] += 1
+            
+            if unchanged:
+                operations.append(UpdateOne({'id': stored['id']}, {'$addToSet': {'dataset_versions': version}}))
+                staged_documents[brand_name] = (stored['id'], True)
+            else:
+                operations.append(InsertOne(document))
+                staged_documents[brand_name] = (document['id'], False)
+        for start in range(0, len(operations), BULK_WRITE_BATCH):
+            await db.liquor_data.bulk_write(operations[start:start + BULK_WRITE_BATCH], ordered=True)
+    
+    counts['removed'] = sum(1 for brand_name in stored_records if brand_name not in staged_documents)
+    return counts
+
+async def prepend(first: Any, rest: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    yield first
+    async for item in rest:
+        yield item
+
+async def single_batch(records: List[Dict[str, Any]]) -> AsyncIterator[List[Dict[str, Any]]]:
+    yield records
+
+async def write_dataset_version(
+    write_liquor_data: Callable[..., Any], batches: AsyncIterator[List[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Write an upload as a new dataset version and publish it only once the write succeeded"""
+    base_version = await current_dataset_version()
+    version = new_dataset_version()
+    try:
+        write_summary = await write_liquor_data(batches, base_version, version)
+    except BaseException:
+        # Cancelled background uploads are discarded as well
+        await discard_dataset_version(version)
+        raise
+    await publish_dataset_version(version)
+    return {**write_summary, 'dataset_version': version}
+
+# Background upload jobs
+# With background=true an upload is spooled to a temporary file and parsed and written by a
+# task of this process; its status document in `upload_jobs` reports progress until it finishes.
+# Jobs go from queued and running to completed, failed or cancelled
+UPLOAD_JOB_ACTIVE = ('queued', 'running')
+# Active jobs not updated for this long are taken to have died with their server
+UPLOAD_JOB_STALE_SECONDS = int(os.environ.get('UPLOAD_JOB_STALE_SECONDS', '600'))
+# Finished job documents expire after this long
+UPLOAD_JOB_RETENTION_SECONDS = int(os.environ.get('UPLOAD_JOB_RETENTION_SECONDS', str(7 * 24 * 3600)))
+
+UPLOAD_JOB_INDEXES = [
+    IndexModel([('finished_at', ASCENDING)], name='finished_at_ttl', expireAfterSeconds=UPLOAD_JOB_RETENTION_SECONDS),
+]
+
+# Tasks of the jobs running in this process, by job id
+upload_tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+class UploadCancelled(Exception):
+    """Raised inside a job whose cancellation was requested through another process"""
+
+async def update_upload_job(job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+    """Set fields on a job's status document and return the updated document"""
+    return await db.upload_jobs.find_one_and_update(
+        {'_id': job_id}, {'$set': {**fields, 'updated_at': datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def track_upload_progress(
+    job_id: str, batches: AsyncIterator[List[Dict[str, Any]]], progress: UploadProgress
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Pass batches through to the writer, saving the job's progress after each one is written"""
+    async for batch in batches:
+        progress.brands_computed += len(batch)
+        yield batch
+        # The writer asks for the next batch only once this one is written
+        progress.documents_written += len(batch)
+        job = await update_upload_job(job_id, progress=progress.as_dict())
+        if job and job.get('cancel_requested'):
+            raise UploadCancelled()
+
+async def run_upload_job(
+    job_id: str, source: Any, write_liquor_data: Callable[..., Any], parse_trace: ParseTrace
+) -> None:
+    """Parse, validate and write a spooled upload as a new dataset version, recording the outcome on its job"""
+    progress = UploadProgress()
+    outcome: Dict[str, Any] = {}
+    try:
+        await update_upload_job(job_id, status='running', started_at=datetime.now(timezone.utc))
+        async with aclosing(parse_upload_batches(source, parse_trace, progress)) as batches:
+            write_summary = await write_dataset_version(write_liquor_data, track_upload_progress(job_id, batches, progress))
+        outcome = {'status': 'completed', 'summary': write_summary}
+    except UploadCancelled:
+        outcome = {'status': 'cancelled'}
+    except asyncio.CancelledError as e:
+        # Cancelled with a reason when the server shuts down, without one by the cancel endpoint
+        outcome = {'status': 'failed', 'error': e.args[0]} if e.args else {'status': 'cancelled'}
+    except HTTPException as e:
+        outcome = {'status': 'failed', 'error': e.detail}
+    except Exception as e:
+        logging.error(f"Error in upload job {job_id}: {e}")
+        outcome = {'status': 'failed', 'error': f"Error processing file: {str(e)}"}
+    finally:
+        if parse_trace.enabled:
+            remember_parse_trace(parse_trace)
+        if outcome:
+            try:
+                await update_upload_job(job_id, **outcome, progress=progress.as_dict(), finished_at=datetime.now(timezone.utc))
+            except Exception as e:
+                logging.error(f"Error recording the outcome of upload job {job_id}: {e}")
+
+async def start_upload_job(
+    file: UploadFile, mode: str, write_liquor_data: Callable[..., Any], parse_trace: ParseTrace
+) -> Dict[str, Any]:
+    """Spool an upload to a temporary file and start its job; the request's own file is closed with the request"""
+    spool = tempfile.TemporaryFile()
+    try:
+        await file.seek(0)
+        await run_io(shutil.copyfileobj, file.file, spool)
+        spool.seek(0)
+        now = datetime.now(timezone.utc)
+        job = {
+            '_id': str(uuid.uuid4()),
+            'status': 'queued',
+            'filename': file.filename,
+            'mode': mode,
+            'progress': UploadProgress().as_dict(),
+            'summary': None,
+            'error': None,
+            'trace_id': parse_trace.id if parse_trace.enabled else None,
+            'cancel_requested': False,
+            'created_at': now,
+            'updated_at': now,
+        }
+        await db.upload_jobs.insert_one(job)
+    except BaseException:
+        spool.close()
+        raise
+    task = asyncio.create_task(run_upload_job(job['_id'], spool, write_liquor_data, parse_trace))
+    upload_tasks[job['_id']] = task
+    
+    def forget_task(task: "asyncio.Task[None]") -> None:
+        upload_tasks.pop(job['_id'], None)
+        spool.close()
+    task.add_done_callback(forget_task)
+    return upload_job_status(job)
+
+def upload_job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    """A job's status document as served by /api/upload-jobs/{job_id}"""
+    status = {key: value for key, value in job.items() if key not in ('_id', 'cancel_requested')}
+    return {'job_id': job['_id'], **jsonable_encoder(status)}
+
+async def cancel_upload_tasks(reason: str) -> None:
+    """Cancel the jobs running in this process and wait for them to record why"""
+    tasks = list(upload_tasks.values())
+    for task in tasks:
+        task.cancel(reason)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def fail_stale_upload_jobs() -> int:
+    """Mark active jobs whose server stopped updating them as failed"""
+    now = datetime.now(timezone.utc)
+    result = await db.upload_jobs.update_many(
+        {'status': {'$in': list(UPLOAD_JOB_ACTIVE)}, 'updated_at': {'$lt': now - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS)}},
+        {'$set': {'status': 'failed', 'error': 'Interrupted by a server restart', 'updated_at': now, 'finished_at': now}},
+    )
+    return result.modified_count
+
 @api_router.post("/upload-data")
-async def upload_liquor_data(file: UploadFile = File(...)):
-    """Upload and process Excel/CSV file with liquor data"""
+async def upload_liquor_data(
+    file: UploadFile = File(...), trace: bool = False, streaming: bool = False, mode: str = 'replace',
+    background: bool = False,
+):
+    """Upload and process Excel/CSV file with liquor data
+
+    With `trace=true` the parser records its column detection and D1/DL decisions; the
+    response carries a `trace_id` for /api/parse-traces/{trace_id}. With `streaming=true`,
+    or for files over STREAMING_UPLOAD_BYTES, xlsx and CSV files are read and written in chunks.
+    `mode=incremental` rewrites only changed brands instead of the whole dataset. Either way the
+    upload becomes a new dataset version that readers see only once it is fully written.
+    With `background=true` the response is a 202 carrying a `job_id` for /api/upload-jobs/{job_id},
+    and the file is parsed in chunks and written after the request has returned.
+    """
+    parse_trace = ParseTrace(path=PARSE_TRACE_FILE) if trace else NULL_TRACE
     try:
+        if mode not in UPLOAD_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid upload mode '{mode}'. Use one of: {', '.join(UPLOAD_MODES)}")
+        write_liquor_data = upsert_liquor_data if mode == 'incremental' else replace_liquor_data
+        
         # Validate file type first
         if not file.filename or not file.filename.endswith(('.xlsx', '.xls', '.csv')):
             raise HTTPException(
@@ -531,37 +2018,40 @@ async def upload_liquor_data(file: UploadFile = File(...)):
                 }
             )
         
-        # Read file content
-        content = await file.read()
-        
-        if len(content) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        # Parse the data
-        parsed_data = parse_excel_data(content)
-        
-        if not parsed_data:
-            raise HTTPException(status_code=400, detail="No valid data found in the file")
+        if background:
+            if not await file.read(1):
+                raise HTTPException(status_code=400, detail="Empty file uploaded")
+            job = await start_upload_job(file, mode, write_liquor_data, parse_trace)
+            # The job keeps the trace and records it once it finishes
+            parse_trace = NULL_TRACE
+            return JSONResponse(status_code=202, content=job)
         
-        # Clear existing data and insert new data
-        await db.liquor_data.delete_many({})
-        
-        # Convert to LiquorData models and insert
-        liquor_objects = []
-        for item_data in parsed_data:
-            liquor_obj = LiquorData(**item_data)
-            liquor_objects.append(liquor_obj.dict())
-        
-        if liquor_objects:
-            await db.liquor_data.insert_many(liquor_objects)
+        if streaming or (file.size or 0) > STREAMING_UPLOAD_BYTES:
+            if not await file.read(1):
+                raise HTTPException(status_code=400, detail="Empty file uploaded")
+            await file.seek(0)
+            # Closing the batches releases their parse slot even if the write stops early
+            async with aclosing(parse_upload_batches(file.file, parse_trace)) as batches:
+                write_summary = await write_dataset_version(write_liquor_data, batches)
+        else:
+            # Read file content
+            content = await file.read()
+            
+            if len(content) == 0:
+                raise HTTPException(status_code=400, detail="Empty file uploaded")
+            
+            # Parse the data off the event loop
+            parsed_data = await parse_upload(content, parse_trace)
+            write_summary = await write_dataset_version(write_liquor_data, single_batch(parsed_data))
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "message": f"Successfully uploaded {len(liquor_objects)} liquor records",
-                "total_records": len(liquor_objects)
-            }
-        )
+        content = {
+            "message": f"Successfully uploaded {write_summary['total_records']} liquor records",
+            "mode": mode,
+            **write_summary
+        }
+        if parse_trace.enabled:
+            content["trace_id"] = parse_trace.id
+        return JSONResponse(status_code=200, content=content)
         
     except HTTPException:
         # Re-raise HTTPExceptions (400 errors) as-is
@@ -569,115 +2059,473 @@ async def upload_liquor_data(file: UploadFile = File(...)):
     except Exception as e:
         logging.error(f"Error uploading data: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        if parse_trace.enabled:
+            remember_parse_trace(parse_trace)
+            logging.info(f"Parse trace {parse_trace.id} recorded {len(parse_trace.events)} events")
 
-@api_router.get("/analytics", response_model=AnalyticsResponse)
-async def get_analytics(overstock_multiplier: float = 3.0):
-    """Get comprehensive analytics including overstocking analysis"""
+@api_router.get("/upload-jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    """Get the status, progress and, once finished, the summary or error of a background upload"""
+    job = await db.upload_jobs.find_one({'_id': job_id})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return upload_job_status(job)
+
+@api_router.post("/upload-jobs/{job_id}/cancel")
+async def cancel_upload_job(job_id: str):
+    """Cancel a background upload; its staged dataset version is discarded and the current one kept"""
+    job = await db.upload_jobs.find_one_and_update(
+        {'_id': job_id, 'status': {'$in': list(UPLOAD_JOB_ACTIVE)}},
+        {'$set': {'cancel_requested': True, 'updated_at': datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        job = await db.upload_jobs.find_one({'_id': job_id})
+        if job is None:
+            raise HTTPException(status_code=404, detail="Upload job not found")
+        raise HTTPException(status_code=400, detail=f"Upload job is already {job['status']}")
+    task = upload_tasks.get(job_id)
+    if task is None:
+        # Running in another process, which stops after writing its current batch
+        return upload_job_status(job)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    job = await db.upload_jobs.find_one({'_id': job_id})
+    if job['status'] in UPLOAD_JOB_ACTIVE:
+        # Cancelled before it started running
+        job = await update_upload_job(job_id, status='cancelled', finished_at=datetime.now(timezone.utc))
+    return upload_job_status(job)
+
+@api_router.get("/parse-traces/{trace_id}")
+async def get_parse_trace(trace_id: str):
+    """Get the structured parse trace recorded by an upload with trace=true"""
+    parse_trace = recent_parse_traces.get(trace_id)
+    if parse_trace is None:
+        raise HTTPException(status_code=404, detail="Parse trace not found. Only the most recent traces are kept.")
+    return parse_trace.summary()
+
+# Daily stock append
+# A day's stock snapshot extends every brand's stored series by one date. Metrics are updated
+# from each brand's stored D1 and DL stock; a brand's series is scanned again only when the
+# day moves the global D1 (no restock had been seen yet) or its DL falls back to an earlier date.
+APPEND_KEYS = ('brand_name', 'index_number')
+
+class StockSnapshot(BaseModel):
+    date: str
+    stock: Dict[str, int]
+    key: str = 'brand_name'
+
+def snapshot_rows(records: List[Dict[str, Any]], snapshot: StockSnapshot) -> Tuple[Dict[int, int], List[str]]:
+    """Stock of the snapshot by row position in `records`, and the keys that match no brand"""
+    rows: Dict[Any, List[int]] = {}
+    for row, record in enumerate(records):
+        rows.setdefault(record.get(snapshot.key), []).append(row)
+
+    def lookup(key: str) -> Any:
+        if snapshot.key == 'brand_name':
+            return key.strip()
+        # Index keys are read like the sheet's index cells: their first run of digits
+        match = INDEX_DIGITS.search(key)
+        return int(match.group(1)) if match else None
+
+    stock: Dict[int, int] = {}
+    unmatched = []
+    for key, value in snapshot.stock.items():
+        matched = rows.get(lookup(key))
+        if not matched:
+            unmatched.append(key)
+        for row in matched or ():
+            stock[row] = value
+    return stock, unmatched
+
+def append_stock_column(
+    records: List[Dict[str, Any]], date_label: str, stock: Dict[int, int]
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Brand records with one more date of stock, given by row position, and how many were rescanned.
+
+    The result equals parsing the sheet the records came from with the new column added, except
+    that stored series do not remember empty cells: a stored 0 counts as a stock of 0.
+    """
+    series = [record.get('daily_sales') or {} for record in records]
+    # Brands uploaded together share their dates, so dates are looked at once per layout
+    layouts = [tuple(sales) for sales in series]
+    labels = list(dict.fromkeys(label for layout in dict.fromkeys(layouts) for label in layout))
+    if date_label in labels:
+        raise HTTPException(status_code=400, detail=f"Stock for {date_label} has already been uploaded")
+    dates = parse_date_headers([*labels, date_label])
+    if date_label not in dates:
+        raise HTTPException(status_code=400, detail=f"'{date_label}' is not a date")
+    undated = [label for label in labels if label not in dates] + [
+        record[field] for record in records for field in ('D1_date', 'DL_date') if record.get(field) not in dates
+    ]
+    if undated or not labels:
+        raise HTTPException(
+            status_code=400, detail="Stock can only be appended to data uploaded in the tabular format with dated columns"
+        )
+    latest = max(labels, key=dates.get)
+    if dates[date_label] <= dates[latest]:
+        raise HTTPException(status_code=400, detail=f"Appended stock must be for a date after {latest}")
+    date_columns = sorted(dates, key=dates.get)
+    days = {label: value.toordinal() for label, value in dates.items()}
+
+    count = len(records)
+    present = np.zeros(count, dtype=bool)
+    values = np.zeros(count)
+    rows = np.fromiter(stock, dtype=np.intp, count=len(stock))
+    present[rows] = True
+    values[rows] = list(stock.values())
+    D1_stock, DL_stock, selling_rates = (
+        np.fromiter((record.get(field, 0.0) for record in records), dtype=float, count=count)
+        for field in ('D1_stock', 'DL_stock', 'selling_rate')
+    )
+
+    # Each brand's last stored date, and whether its D1 is still the first date because no
+    # restock has been seen
+    bounds = {layout: (min(layout, key=days.get), max(layout, key=days.get)) for layout in dict.fromkeys(layouts) if layout}
+    last_stock = np.full(count, np.nan)
+    on_first_date = np.zeros(count, dtype=bool)
+    for row, (record, sales, layout) in enumerate(zip(records, series, layouts)):
+        if sales:
+            first, last = bounds[layout]
+            last_stock[row] = sales[last]
+            on_first_date[row] = record['D1_date'] == first
+    restocked = present & (values > last_stock)
+    d1_moves = on_first_date & restocked.any()
+    # A brand missing from the snapshot keeps its DL, unless that stock was negative and so
+    # not the last valid value
+    rescan = d1_moves | (~present & (DL_stock < 0))
+
+    DL_dates = [date_label if is_present else record['DL_date'] for record, is_present in zip(records, present.tolist())]
+    DL_stock = np.where(present, values, DL_stock)
+    days_between = np.fromiter(
+        (max(1, days[DL_date] - days[record['D1_date']] + 1) for record, DL_date in zip(records, DL_dates)),
+        dtype=np.int64, count=count,
+    )
+    metrics = stock_metrics(D1_stock, DL_stock, days_between, selling_rates)
+    columns = zip(
+        DL_dates, DL_stock.tolist(), days_between.tolist(), present.tolist(), values.tolist(),
+        *(getattr(metrics, name).tolist() for name in (
+            'current_stock_qty', 'total_sales_qty', 'avg_daily_sales_qty', 'monthly_sales_value', 'monthly_sale_qty',
+            'current_stock_value', 'stock_ratio', 'stock_available_days',
+        )),
+    )
+    appended = []
+    for (record, sales, (DL_date, DL_value, days_analyzed, is_present, value, stock_qty, total_sales, avg_daily_sales,
+                         monthly_value, monthly_qty, stock_value, ratio, available_days)) in zip(records, series, columns):
+        appended.append({
+            **record,
+            'DL_date': DL_date,
+            'DL_stock': DL_value,
+            'current_stock_qty': int(stock_qty),
+            'total_sales_qty': total_sales,
+            'avg_daily_sales_qty': avg_daily_sales,
+            'monthly_sale_value': monthly_value,
+            'monthly_sale_qty': int(monthly_qty),
+            'stock_value_today': stock_value,
+            'stock_ratio': ratio,
+            'stock_available_days': available_days,
+            'avg_daily_sale': monthly_value / 30,
+            'daily_sales': {**sales, date_label: value},
+            'days_analyzed': days_analyzed,
+        })
+
+    rescanned = np.flatnonzero(rescan)
+    if len(rescanned):
+        # Rescanned brands are computed as a sheet of their stored series would be
+        positions = {label: position for position, label in enumerate(date_columns)}
+        stock_matrix = np.zeros((len(rescanned), len(date_columns)))
+        present_matrix = np.zeros((len(rescanned), len(date_columns)), dtype=bool)
+        for block_row, row in enumerate(rescanned.tolist()):
+            stored_columns = [positions[label] for label in series[row]]
+            stock_matrix[block_row, stored_columns] = list(series[row].values())
+            present_matrix[block_row, stored_columns] = True
+        stock_matrix[:, -1], present_matrix[:, -1] = values[rescanned], present[rescanned]
+        brand_rows = BrandRows(
+            np.array([records[row]['brand_name'] for row in rescanned.tolist()], dtype=object), rescanned,
+            np.fromiter((records[row].get('index_number', 0) for row in rescanned.tolist()), dtype=np.int64),
+            np.fromiter((records[row].get('wholesale_rate', 0.0) for row in rescanned.tolist()), dtype=float),
+            selling_rates[rescanned],
+        )
+        D1_dates = np.array([date_label if d1_moves[row] else records[row]['D1_date'] for row in rescanned.tolist()], dtype=object)
+        date_days = np.array([days[label] for label in date_columns], dtype=np.int64)
+        for D1_date in dict.fromkeys(D1_dates.tolist()):
+            block = D1_dates == D1_date
+            computed = compute_brand_records(
+                BrandRows(*(column[block] for column in brand_rows)), stock_matrix[block], present_matrix[block],
+                date_columns, D1_date, date_days=date_days,
+            )
+            # Brand names are unique within a dataset version
+            block_rows = {records[row]['brand_name']: row for row in rescanned[block].tolist()}
+            for record in computed:
+                row = block_rows[record['brand_name']]
+                appended[row] = {**records[row], **record}
+    return appended, len(rescanned)
+
+def build_appended_documents(records: List[Dict[str, Any]], snapshot: StockSnapshot) -> Dict[str, Any]:
+    """Liquor documents of stored brand records with the snapshot's day appended"""
+    stock, unmatched = snapshot_rows(records, snapshot)
+    if not stock:
+        raise HTTPException(status_code=400, detail="No brand in the snapshot matches the current dataset")
+    appended, rescanned = append_stock_column(records, snapshot.date.strip(), stock)
+    return {
+        'documents': build_liquor_batch(appended),
+        'matched_brands': len(stock),
+        'unmatched_keys': unmatched,
+        'rescanned_brands': rescanned,
+    }
+
+@api_router.post("/append-stock")
+async def append_stock(snapshot: StockSnapshot):
+    """Append one day's stock to every brand of the current dataset, as a new dataset version
+
+    `stock` maps brand names, or index numbers with `key=index_number`, to the day's stock.
+    Brands missing from it get an empty cell for the day, as in an uploaded sheet.
+    """
     try:
-        # Fetch all liquor data
-        liquor_records = await db.liquor_data.find().to_list(1000)
-        
-        if not liquor_records:
+        if snapshot.key not in APPEND_KEYS:
+            raise HTTPException(status_code=400, detail=f"Invalid key '{snapshot.key}'. Use one of: {', '.join(APPEND_KEYS)}")
+        base_version = await current_dataset_version()
+        records = await db.liquor_data.find(
+            dataset_filter(base_version),
+            {'_id': 0, 'id': 0, 'upload_timestamp': 0, 'content_hash': 0, 'dataset_versions': 0},
+        ).sort('_id', ASCENDING).batch_size(READ_BATCH_SIZE).to_list(None)
+        if not records:
             raise HTTPException(status_code=404, detail="No data found. Please upload liquor data first.")
-        
-        # Convert to dict format for calculations
-        data_dicts = [
+
+        result = await run_io(build_appended_documents, records, snapshot)
+        write_summary = await write_dataset_version(replace_liquor_data, single_batch(result.pop('documents')))
+        return {
+            "message": f"Appended stock for {snapshot.date.strip()} to {result['matched_brands']} brands",
+            **result,
+            **write_summary,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error appending stock: {e}")
+        raise HTTPException(status_code=500, detail=f"Error appending stock: {str(e)}")
+
+@api_router.get("/dataset")
+async def get_dataset_info():
+    """Get the current dataset version and the versions kept for rollback"""
+    state = await get_dataset_state()
+    version = state['version'] if state else None
+    return {
+        "dataset_version": version,
+        "previous_versions": state.get('previous_versions', []) if state else [],
+        "updated_at": state['updated_at'].isoformat() if state else None,
+        "total_records": await db.liquor_data.count_documents(dataset_filter(version)),
+    }
+
+@api_router.post("/dataset/rollback")
+async def rollback_dataset():
+    """Point reads back at the previous dataset version and discard the current one"""
+    def build_state(state):
+        if not state or not state.get('previous_versions'):
+            raise HTTPException(status_code=400, detail="No previous dataset version to roll back to")
+        return {'version': state['previous_versions'][0], 'previous_versions': state['previous_versions'][1:]}
+    state, new_state = await swap_dataset_state(build_state)
+    await prune_dataset_versions([state['version']])
+    return {
+        "message": f"Rolled back to dataset version {new_state['version']}",
+        "dataset_version": new_state['version'],
+        "discarded_version": state['version'],
+    }
+
+@api_router.get("/analytics-cache")
+async def get_analytics_cache_stats():
+    """Get hit/miss counters and memory use of the computed analytics cache and the loaded columnar
+    datasets, and the disk use of the parse cache"""
+    loaded = {version: future.result() for version, future in columnar_datasets.items() if future.done() and not future.cancelled() and not future.exception()}
+    return {
+        **analytics_cache.stats(),
+        'columnar_datasets': {'entries': len(loaded), 'bytes': sum(dataset.nbytes for dataset in loaded.values())},
+        'parse_cache': await run_io(parse_cache.stats),
+    }
+
+ANALYTICS_BACKENDS = ('python', 'pipeline')
+ANALYTICS_BACKEND = os.environ.get('ANALYTICS_BACKEND', 'python')
+
+def columnar_analytics(dataset: ColumnarDataset, overstock_multiplier: float) -> AnalyticsResponse:
+    """Compute analytics over a dataset version's columns"""
+    brand_names = dataset['brand_name']
+    monthly_sale_value = dataset['monthly_sale_value']
+    stock_value_today = dataset['stock_value_today']
+    stock_ratio = dataset['stock_ratio']
+    
+    # Calculate overstocked items, ranked by overstock value with ties broken on _id
+    threshold = monthly_sale_value * overstock_multiplier
+    overstock_value = stock_value_today - threshold
+    overstocked = np.flatnonzero((stock_value_today > threshold) & (monthly_sale_value > 0))
+    overstocked = overstocked[np.argsort(-overstock_value[overstocked], kind='stable')]
+    overstocked_items = [
+        {
+            'brand_name': brand_names[row],
+            'current_stock_value': float(stock_value_today[row]),
+            'monthly_avg_sale': float(monthly_sale_value[row]),
+            'threshold': float(threshold[row]),
+            'overstock_value': float(overstock_value[row]),
+            'stock_ratio': float(stock_ratio[row])
+        }
+        for row in overstocked.tolist()
+    ]
+    
+    # Dataset columns are already in date order
+    sorted_trends = dict(zip(dataset.dates, dataset.daily_sales.sum(axis=0).tolist()))
+    
+    return AnalyticsResponse(
+        total_brands=len(dataset),
+        total_stock_value=float(stock_value_today.sum()),
+        total_overstocked_value=sum(item['overstock_value'] for item in overstocked_items),
+        overstocked_brands=len(overstocked_items),
+        top_selling_brands=[
             {
-                'brand_name': record['brand_name'],
-                'rate': record['rate'],
-                'daily_sales': record['daily_sales'],
-                'monthly_sale_qty': record['monthly_sale_qty'],
-                'monthly_sale_value': record['monthly_sale_value'],
-                'avg_daily_sale': record['avg_daily_sale'],
-                'stock_available_days': record['stock_available_days'],
-                'stock_value_before': record['stock_value_before'],
-                'stock_value_today': record['stock_value_today'],
-                'stock_ratio': record['stock_ratio']
+                'brand_name': brand_names[row],
+                'monthly_sale_value': float(monthly_sale_value[row]),
+                'stock_value_today': float(stock_value_today[row]),
+                'stock_ratio': float(stock_ratio[row])
             }
-            for record in liquor_records
-        ]
-        
-        # Calculate overstocked items
-        overstocked_items = calculate_overstocking(data_dicts, overstock_multiplier)
-        
-        # Calculate top selling brands
-        top_selling = sorted(data_dicts, key=lambda x: x['monthly_sale_value'], reverse=True)[:10]
-        
-        # Calculate totals
-        total_stock_value = sum(item['stock_value_today'] for item in data_dicts)
-        total_overstocked_value = sum(item['overstock_value'] for item in overstocked_items)
-        
-        # Prepare sales trends data
-        sales_trends = {}
-        for record in data_dicts:
-            for date, sales in record['daily_sales'].items():
-                if date not in sales_trends:
-                    sales_trends[date] = 0
-                sales_trends[date] += sales
-        
-        # Sort sales trends by date
-        sorted_trends = dict(sorted(sales_trends.items()))
-        
-        return AnalyticsResponse(
-            total_brands=len(data_dicts),
-            total_stock_value=total_stock_value,
-            total_overstocked_value=total_overstocked_value,
-            overstocked_brands=len(overstocked_items),
-            top_selling_brands=[
-                {
-                    'brand_name': item['brand_name'],
-                    'monthly_sale_value': item['monthly_sale_value'],
-                    'stock_value_today': item['stock_value_today'],
-                    'stock_ratio': item['stock_ratio']
-                }
-                for item in top_selling
-            ],
-            overstocked_items=overstocked_items,
-            sales_trends=sorted_trends
-        )
+            for row in dataset.ranked('monthly_sale_value', descending=True)[:10].tolist()
+        ],
+        overstocked_items=overstocked_items,
+        sales_trends=sorted_trends
+    )
+
+async def reduce_analytics(version: Optional[str], overstock_multiplier: float) -> AnalyticsResponse:
+    """Compute analytics in Python over the version's shared ColumnarDataset"""
+    dataset = await get_columnar_dataset(version)
+    if not len(dataset):
+        raise HTTPException(status_code=404, detail="No data found. Please upload liquor data first.")
+    return columnar_analytics(dataset, overstock_multiplier)
+
+def analytics_pipelines(version: Optional[str], overstock_multiplier: float) -> Dict[str, List[Dict[str, Any]]]:
+    """Aggregation pipelines computing the analytics reductions inside MongoDB"""
+    match = {'$match': dataset_filter(version)}
+    threshold = {'$multiply': ['$monthly_sale_value', overstock_multiplier]}
+    return {
+        'totals': [
+            match,
+            {'$group': {'_id': None, 'total_brands': {'$sum': 1}, 'total_stock_value': {'$sum': '$stock_value_today'}}},
+        ],
+        # Ties are broken on _id, as the Python reduction does
+        'top_selling': [
+            match,
+            {'$sort': {'monthly_sale_value': -1, '_id': 1}},
+            {'$limit': 10},
+            {'$project': {'_id': 0, 'brand_name': 1, 'monthly_sale_value': 1, 'stock_value_today': 1, 'stock_ratio': 1}},
+        ],
+        'overstocked': [
+            match,
+            {'$match': {'monthly_sale_value': {'$gt': 0}, '$expr': {'$gt': ['$stock_value_today', threshold]}}},
+            {'$addFields': {'overstock_value': {'$subtract': ['$stock_value_today', threshold]}}},
+            {'$sort': {'overstock_value': -1, '_id': 1}},
+            {'$project': {
+                '_id': 0,
+                'brand_name': 1,
+                'current_stock_value': '$stock_value_today',
+                'monthly_avg_sale': '$monthly_sale_value',
+                'threshold': threshold,
+                'overstock_value': 1,
+                'stock_ratio': {'$ifNull': ['$stock_ratio', 0]},
+            }},
+        ],
+        'sales_trends': [
+            match,
+            {'$project': {'_id': 0, 'daily_sales': {'$objectToArray': '$daily_sales'}}},
+            {'$unwind': '$daily_sales'},
+            {'$group': {'_id': '$daily_sales.k', 'sales': {'$sum': '$daily_sales.v'}}},
+        ],
+    }
+
+async def aggregate_analytics(version: Optional[str], overstock_multiplier: float) -> AnalyticsResponse:
+    """Compute analytics with MongoDB aggregation pipelines, transferring only the results"""
+    pipelines = analytics_pipelines(version, overstock_multiplier)
+    totals, top_selling, overstocked_items, sales_trends = await asyncio.gather(*(
+        db.liquor_data.aggregate(pipeline).to_list(None) for pipeline in pipelines.values()
+    ))
+    if not totals:
+        raise HTTPException(status_code=404, detail="No data found. Please upload liquor data first.")
+    
+    # Date labels only sort as strings in MongoDB, so trends are put in date order here
+    sales = {trend['_id']: trend['sales'] for trend in sales_trends}
+    
+    return AnalyticsResponse(
+        total_brands=totals[0]['total_brands'],
+        total_stock_value=totals[0]['total_stock_value'],
+        total_overstocked_value=sum(item['overstock_value'] for item in overstocked_items),
+        overstocked_brands=len(overstocked_items),
+        top_selling_brands=top_selling,
+        overstocked_items=overstocked_items,
+        sales_trends={date: sales[date] for date in chronological_dates(sales)}
+    )
+
+@api_router.get("/analytics", response_model=AnalyticsResponse)
+async def get_analytics(
+    overstock_multiplier: float = 3.0, dataset_version: Optional[str] = None, backend: Optional[str] = None
+):
+    """Get comprehensive analytics including overstocking analysis
+
+    `backend=pipeline` computes the reductions in MongoDB instead of Python; the default
+    comes from ANALYTICS_BACKEND.
+    """
+    backend = backend or ANALYTICS_BACKEND
+    if backend not in ANALYTICS_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Invalid analytics backend '{backend}'. Use one of: {', '.join(ANALYTICS_BACKENDS)}")
+    version = await resolve_dataset_version(dataset_version)
+    cache_key = ('analytics', version, overstock_multiplier, backend)
+    cached = analytics_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        if backend == 'pipeline':
+            analytics = await aggregate_analytics(version, overstock_multiplier)
+        else:
+            analytics = await reduce_analytics(version, overstock_multiplier)
+        analytics_cache.put(cache_key, analytics)
+        return analytics
         
     except Exception as e:
         logging.error(f"Error getting analytics: {e}")
         raise HTTPException(status_code=500, detail=f"Error calculating analytics: {str(e)}")
 
 @api_router.get("/brands")
-async def get_all_brands():
+async def get_all_brands(dataset_version: Optional[str] = None):
     """Get all brand data"""
+    version = await resolve_dataset_version(dataset_version)
     try:
-        liquor_records = await db.liquor_data.find().to_list(1000)
-        return [LiquorData(**record) for record in liquor_records]
+        return [LiquorData(**record) async for record in iter_liquor_records(version)]
     except Exception as e:
         logging.error(f"Error fetching brands: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching brands: {str(e)}")
 
 @api_router.get("/charts", response_model=ChartsResponse)
-async def get_charts_data():
+async def get_charts_data(dataset_version: Optional[str] = None):
     """Get data for performance charts and visualizations"""
+    version = await resolve_dataset_version(dataset_version)
+    cache_key = ('charts', version)
+    cached = analytics_cache.get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        liquor_records = await db.liquor_data.find().to_list(1000)
+        dataset = await get_columnar_dataset(version)
         
-        if not liquor_records:
+        if not len(dataset):
             raise HTTPException(status_code=404, detail="No data found")
         
-        # Convert to dict format for calculations
-        data_dicts = [
-            {
-                'brand_name': record['brand_name'],
-                'rate': record['rate'],
-                'current_stock_qty': record.get('current_stock_qty', 0),
-                'monthly_sale_value': record['monthly_sale_value'],
-                'stock_value_today': record['stock_value_today'],
-                'stock_available_days': record['stock_available_days'],
-                'stock_ratio': record['stock_ratio']
-            }
-            for record in liquor_records
-        ]
-        
         # Calculate total sales for proportion
-        total_sales = sum(item['monthly_sale_value'] for item in data_dicts)
+        total_sales = float(dataset['monthly_sale_value'].sum())
+        stock_available_days = dataset['stock_available_days']
+        volume_leaders, velocity_leaders, revenue_leaders = (
+            dataset.records(rows[:10], ChartRecord)
+            for rows in (
+                dataset.ranked('current_stock_qty', descending=True),
+                dataset.ranked('stock_available_days', rows=np.flatnonzero(stock_available_days > 0)),
+                dataset.ranked('monthly_sale_value', descending=True),
+            )
+        )
         
         # Volume Leaders (by current stock quantity)
-        volume_leaders = sorted(data_dicts, key=lambda x: x.get('current_stock_qty', 0), reverse=True)[:10]
         volume_chart = [
             {
                 'name': item['brand_name'][:20],  # Truncate long names
@@ -688,8 +2536,6 @@ async def get_charts_data():
         ]
         
         # Velocity Leaders (by stock turnover rate)
-        velocity_leaders = [item for item in data_dicts if item['stock_available_days'] > 0]
-        velocity_leaders = sorted(velocity_leaders, key=lambda x: x['stock_available_days'])[:10]
         velocity_chart = [
             {
                 'name': item['brand_name'],
@@ -701,7 +2547,6 @@ async def get_charts_data():
         ]
         
         # Revenue Leaders (by estimated sales value)
-        revenue_leaders = sorted(data_dicts, key=lambda x: x['monthly_sale_value'], reverse=True)[:10]
         revenue_chart = [
             {
                 'name': item['brand_name'],
@@ -723,265 +2568,437 @@ async def get_charts_data():
             for item in revenue_leaders if item['monthly_sale_value'] > 0
         ]
         
-        return ChartsResponse(
+        charts = ChartsResponse(
             volume_leaders=volume_chart,
             velocity_leaders=velocity_chart,
             revenue_leaders=revenue_chart,
             revenue_proportion=revenue_proportion
         )
+        analytics_cache.put(cache_key, charts)
+        return charts
         
     except Exception as e:
         logging.error(f"Error getting charts data: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting charts data: {str(e)}")
 
+async def build_demand_plan(version: Optional[str]) -> List[Tuple[DemandRecommendation, DemandRecord]]:
+    """Demand recommendations for a dataset version, each paired with the brand record it came from.
+
+    The version's ColumnarDataset serves both /api/demand-recommendations and the export's index
+    and monthly quantity columns; the plan is cached per dataset version.
+    """
+    cache_key = ('demand-plan', version)
+    cached = analytics_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    dataset = await get_columnar_dataset(version)
+    if not len(dataset):
+        raise HTTPException(status_code=404, detail="No data found")
+    
+    # Calculate recommended quantity based on monthly sales pattern for next 30 days:
+    # how much to order = Monthly requirement - Current stock
+    recommended = dataset['monthly_sale_qty'] - dataset['current_stock_qty']
+    # Only include items that sell and need restocking (when recommended_qty > 0)
+    rows = np.flatnonzero((dataset['monthly_sale_qty'] > 0) & (recommended > 0))
+    
+    plan = []
+    for row, record in zip(rows.tolist(), dataset.records(rows, DemandRecord)):
+        stock_days = record['stock_available_days']
+        
+        # Determine urgency level based on days of stock remaining
+        if stock_days < 10:
+            urgency = "HIGH"
+        elif stock_days < 20:
+            urgency = "MEDIUM"
+        elif stock_days < 30:
+            urgency = "LOW"
+        else:
+            urgency = "NONE"
+        
+        plan.append((DemandRecommendation(
+            brand_name=record['brand_name'],
+            selling_rate=record['selling_rate'],
+            wholesale_rate=round(record['wholesale_rate'], 2),
+            current_stock_qty=record['current_stock_qty'],
+            recommended_qty=int(recommended[row]),  # Use the calculated recommendation without artificial cap
+            urgency_level=urgency
+        ), record))
+    
+    # Sort by urgency (HIGH -> MEDIUM -> LOW) and then by recommended quantity
+    urgency_order = {"HIGH": 1, "MEDIUM": 2, "LOW": 3}
+    plan.sort(key=lambda entry: (urgency_order.get(entry[0].urgency_level, 4), -entry[0].recommended_qty))
+    
+    analytics_cache.put(cache_key, plan)
+    return plan
+
 @api_router.get("/demand-recommendations")
-async def get_demand_recommendations():
+async def get_demand_recommendations(dataset_version: Optional[str] = None):
     """Get smart demand recommendations with wholesale rates and quantities"""
+    version = await resolve_dataset_version(dataset_version)
     try:
-        liquor_records = await db.liquor_data.find().to_list(1000)
-        
-        if not liquor_records:
-            raise HTTPException(status_code=404, detail="No data found")
-        
-        recommendations = []
-        
-        for record in liquor_records:
-            brand_name = record['brand_name']
-            selling_rate = record.get('selling_rate', record['rate'])
-            wholesale_rate = record.get('wholesale_rate', selling_rate * 0.9)
-            current_stock_qty = record.get('current_stock_qty', 0)
-            avg_daily_sales_qty = record.get('avg_daily_sales_qty', 0)
-            stock_days = record['stock_available_days']
-            
-            # Calculate recommended quantity based on monthly sales pattern for next 30 days
-            monthly_sales_qty = record.get('monthly_sales_qty', record.get('monthly_sale_qty', 0))
-            
-            if monthly_sales_qty > 0:
-                # For next 30 days, we need monthly_sales_qty amount
-                # Calculate how much to order = Monthly requirement - Current stock
-                recommended_qty = max(0, monthly_sales_qty - current_stock_qty)
-                
-                # Determine urgency level based on days of stock remaining
-                if stock_days < 10:
-                    urgency = "HIGH"
-                elif stock_days < 20:
-                    urgency = "MEDIUM"
-                elif stock_days < 30:
-                    urgency = "LOW"
-                else:
-                    urgency = "NONE"
-                
-                # Only include items that need restocking (when recommended_qty > 0)
-                if recommended_qty > 0:
-                    recommendations.append(DemandRecommendation(
-                        brand_name=brand_name,
-                        selling_rate=selling_rate,
-                        wholesale_rate=round(wholesale_rate, 2),
-                        current_stock_qty=current_stock_qty,
-                        recommended_qty=recommended_qty,  # Use the calculated recommendation without artificial cap
-                        urgency_level=urgency
-                    ))
-        
-        # Sort by urgency (HIGH -> MEDIUM -> LOW) and then by recommended quantity
-        urgency_order = {"HIGH": 1, "MEDIUM": 2, "LOW": 3}
-        recommendations.sort(key=lambda x: (urgency_order.get(x.urgency_level, 4), -x.recommended_qty))
-        
-        return recommendations
+        return [recommendation for recommendation, _ in await build_demand_plan(version)]
         
     except Exception as e:
         logging.error(f"Error generating demand recommendations: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating recommendations: {str(e)}")
 
+def calculation_detail(record: CalculationRecord) -> Dict[str, Any]:
+    """Verification row for one brand, as served by /api/calculation-details"""
+    # Calculate multiplier value (current stock value / monthly sales value)
+    current_stock_value = record.get('stock_value_today', 0)
+    monthly_sales_value = record.get('monthly_sale_value', 0)
+    multiplier_value = current_stock_value / max(1, monthly_sales_value) if monthly_sales_value > 0 else 0
+    
+    return {
+        'index': record.get('index_number', record.get('product_id', 'N/A')),
+        'brand_name': record['brand_name'],
+        'calculated_wholesale_rate': record.get('wholesale_rate', 0),
+        'selling_rate': record.get('selling_rate', record.get('rate', 0)),
+        'calculated_avg_monthly_sale': record.get('monthly_sale_value', 0),
+        'calculated_current_stock_value': current_stock_value,
+        'calculated_multiplier_value': round(multiplier_value, 3),
+        # Additional useful fields for verification - use actual stored values
+        'D1_date': record.get('D1_date', 'N/A'),
+        'D1_stock': record.get('D1_stock', 0),
+        'DL_date': record.get('DL_date', 'N/A'), 
+        'DL_stock': record.get('DL_stock', 0),
+        'total_sales_qty': record.get('total_sales_qty', 0),
+        'avg_daily_sales_qty': record.get('avg_daily_sales_qty', 0),
+        'days_analyzed': record.get('days_analyzed', 0),
+        'stock_available_days': record.get('stock_available_days', 0)
+    }
+
+def calculation_records(dataset: ColumnarDataset) -> List[CalculationRecord]:
+    """A dataset version's CalculationRecords sorted by their integer index number"""
+    return dataset.records(dataset.ranked('index_number'), CalculationRecord)
+
 @api_router.get("/calculation-details")
-async def get_calculation_details():
+async def get_calculation_details(dataset_version: Optional[str] = None):
     """Get detailed calculations for all brands for verification"""
+    version = await resolve_dataset_version(dataset_version)
+    cache_key = ('calculation-details', version)
+    cached = analytics_cache.get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        liquor_records = await db.liquor_data.find().to_list(1000)
+        dataset = await get_columnar_dataset(version)
         
-        if not liquor_records:
+        if not len(dataset):
             raise HTTPException(status_code=404, detail="No data found")
         
-        calculation_details = []
-        
-        for record in liquor_records:
-            # Calculate multiplier value (current stock value / monthly sales value)
-            current_stock_value = record.get('stock_value_today', 0)
-            monthly_sales_value = record.get('monthly_sale_value', 0)
-            multiplier_value = current_stock_value / max(1, monthly_sales_value) if monthly_sales_value > 0 else 0
-            
-            detail = {
-                'index': record.get('index_number', record.get('product_id', 'N/A')),
-                'brand_name': record['brand_name'],
-                'calculated_wholesale_rate': record.get('wholesale_rate', 0),
-                'selling_rate': record.get('selling_rate', record.get('rate', 0)),
-                'calculated_avg_monthly_sale': record.get('monthly_sale_value', 0),
-                'calculated_current_stock_value': current_stock_value,
-                'calculated_multiplier_value': round(multiplier_value, 3),
-                # Additional useful fields for verification - use actual stored values
-                'D1_date': record.get('D1_date', 'N/A'),
-                'D1_stock': record.get('D1_stock', 0),
-                'DL_date': record.get('DL_date', 'N/A'), 
-                'DL_stock': record.get('DL_stock', 0),
-                'total_sales_qty': record.get('total_sales_qty', 0),
-                'avg_daily_sales_qty': record.get('avg_daily_sales_qty', 0),
-                'days_analyzed': record.get('days_analyzed', 0),
-                'stock_available_days': record.get('stock_available_days', 0)
-            }
-            
-            calculation_details.append(detail)
-        
-        # Sort by index number
-        # Sort by index number, handling various formats
-        def sort_key(x):
-            idx_str = str(x['index'])
-            try:
-                # Try to extract number from index
-                import re
-                match = re.search(r'\d+', idx_str)
-                return int(match.group()) if match else 999
-            except:
-                return 999
-        
-        calculation_details.sort(key=sort_key)
-        
+        calculation_details = [calculation_detail(record) for record in calculation_records(dataset)]
+        analytics_cache.put(cache_key, calculation_details)
         return calculation_details
         
     except Exception as e:
         logging.error(f"Error getting calculation details: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting calculation details: {str(e)}")
 
-@api_router.get("/export-demand-list")
-async def export_demand_list():
-    """Export demand recommendations with updated format: Index, Brand Name, Wholesale Rate, Projected Monthly Sale, Quantity in Stock, Quantity to be Demanded, Number of Cases to be Demanded"""
-    try:
-        # Get recommendations
-        recommendations_data = await get_demand_recommendations()
-        
-        if not recommendations_data:
-            raise HTTPException(status_code=404, detail="No recommendations to export")
-        
-        # Get all liquor records to match with recommendations for correct index and monthly sale data
-        liquor_records = await db.liquor_data.find().to_list(1000)
+DEMAND_EXPORT_COLUMNS = {
+    'Index': 10,
+    'Brand Name': 30,
+    'Wholesale Rate': 16,
+    'Projected Monthly Sale (Qty)': 18,
+    'Quantity held in Stock': 18,
+    'Quantity to be Demanded': 20,
+    'Number of Cases to be Demanded': 22,
+}
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def demand_export_rows(
+    demand_plan: List[Tuple[DemandRecommendation, DemandRecord]], total_row: bool = True
+) -> Iterator[Dict[str, Any]]:
+    """Demand export rows with correct indexes and monthly sales, followed by the TOTAL row unless `total_row` is off"""
+    total_wholesale_cost = 0
+    total_quantity_in_stock = 0
+    total_quantity_demanded = 0
+    total_projected_monthly_sale = 0
+    total_cases_demanded = 0
+    
+    for rec, brand_record in demand_plan:
+        # Use the original index and monthly sales from the brand record
+        original_index = brand_record.get('index_number', 'N/A')
+        projected_monthly_sale_qty = brand_record.get('monthly_sales_qty', brand_record.get('monthly_sale_qty', 0))
         
-        # Create a lookup dictionary for brand data by brand name
-        brand_lookup = {record['brand_name']: record for record in liquor_records}
+        # Calculate number of cases needed (1 case = 12 units, round up to get whole cases)
+        cases_demanded = math.ceil(rec.recommended_qty / 12) if rec.recommended_qty > 0 else 0
         
-        # Convert to updated DataFrame format with correct indexes and monthly sales
-        df_data = []
-        total_wholesale_cost = 0
-        total_quantity_in_stock = 0
-        total_quantity_demanded = 0
-        total_projected_monthly_sale = 0
-        total_cases_demanded = 0
+        # Calculate totals for the summary row
+        wholesale_cost_for_demand = rec.wholesale_rate * rec.recommended_qty
+        total_wholesale_cost += wholesale_cost_for_demand
+        total_quantity_in_stock += rec.current_stock_qty
+        total_quantity_demanded += rec.recommended_qty
+        total_projected_monthly_sale += projected_monthly_sale_qty
+        total_cases_demanded += cases_demanded
         
-        for rec in recommendations_data:
-            # Get the original brand record to find the correct index and monthly sales
-            brand_record = brand_lookup.get(rec.brand_name)
-            
-            if brand_record:
-                # Use the original index from the brand record
-                original_index = brand_record.get('index_number', 'N/A')
-                projected_monthly_sale_qty = brand_record.get('monthly_sales_qty', brand_record.get('monthly_sale_qty', 0))
-            else:
-                original_index = 'N/A'
-                projected_monthly_sale_qty = 0
-            
-            # Calculate number of cases needed (1 case = 12 units, round up to get whole cases)
-            import math
-            cases_demanded = math.ceil(rec.recommended_qty / 12) if rec.recommended_qty > 0 else 0
-            
-            # Calculate totals for the summary row
-            wholesale_cost_for_demand = rec.wholesale_rate * rec.recommended_qty
-            total_wholesale_cost += wholesale_cost_for_demand
-            total_quantity_in_stock += rec.current_stock_qty
-            total_quantity_demanded += rec.recommended_qty
-            total_projected_monthly_sale += projected_monthly_sale_qty
-            total_cases_demanded += cases_demanded
-            
-            df_data.append({
-                'Index': original_index,
-                'Brand Name': rec.brand_name,
-                'Wholesale Rate': rec.wholesale_rate,
-                'Projected Monthly Sale (Qty)': int(round(projected_monthly_sale_qty, 0)),
-                'Quantity held in Stock': rec.current_stock_qty,
-                'Quantity to be Demanded': rec.recommended_qty,
-                'Number of Cases to be Demanded': cases_demanded
-            })
-        
-        # Add total row
-        df_data.append({
+        yield {
+            'Index': original_index,
+            'Brand Name': rec.brand_name,
+            'Wholesale Rate': rec.wholesale_rate,
+            'Projected Monthly Sale (Qty)': int(round(projected_monthly_sale_qty, 0)),
+            'Quantity held in Stock': rec.current_stock_qty,
+            'Quantity to be Demanded': rec.recommended_qty,
+            'Number of Cases to be Demanded': cases_demanded
+        }
+    
+    # Add total row
+    if total_row:
+        yield {
             'Index': 'TOTAL',
-            'Brand Name': f'({len(recommendations_data)} brands)',
+            'Brand Name': f'({len(demand_plan)} brands)',
             'Wholesale Rate': f'Cost: {round(total_wholesale_cost, 2)}',
             'Projected Monthly Sale (Qty)': int(round(total_projected_monthly_sale, 0)),
             'Quantity held in Stock': total_quantity_in_stock,
             'Quantity to be Demanded': total_quantity_demanded,
             'Number of Cases to be Demanded': total_cases_demanded
-        })
-        
-        df = pd.DataFrame(df_data)
-        
-        # Create Excel file in memory
-        from io import BytesIO
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Demand Forecast', index=False)
-            
-            # Get workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Demand Forecast']
-            
-            # Auto-adjust column widths for the new 7-column format
-            column_widths = {'A': 10, 'B': 30, 'C': 16, 'D': 18, 'E': 18, 'F': 20, 'G': 22}
-            for column_letter, width in column_widths.items():
-                worksheet.column_dimensions[column_letter].width = width
-            
-            # Style headers
-            from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-            header_font = Font(bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            
-            # Style the header row
-            for col in range(1, 8):  # 7 columns now
-                cell = worksheet.cell(row=1, column=col)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Style the total row (last row)
-            total_row = len(df_data)
-            total_font = Font(bold=True)
-            total_fill = PatternFill(start_color="E8F4FD", end_color="E8F4FD", fill_type="solid")
-            border = Border(
-                top=Side(border_style="thick", color="366092"),
-                bottom=Side(border_style="thick", color="366092"),
-                left=Side(border_style="thin", color="366092"),
-                right=Side(border_style="thin", color="366092")
-            )
-            
-            for col in range(1, 8):  # 7 columns now
-                cell = worksheet.cell(row=total_row + 1, column=col)  # +1 because of header
-                cell.font = total_font
-                cell.fill = total_fill
-                cell.border = border
-                cell.alignment = Alignment(horizontal="center")
-        
+        }
+
+def demand_workbook_chunks(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Write the styled demand workbook with openpyxl's write-only mode and yield the file in chunks.
+
+    Rows are written straight to a temporary file, so memory stays flat however long the list is.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
+    
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Demand Forecast')
+    for position, width in enumerate(DEMAND_EXPORT_COLUMNS.values(), start=1):
+        worksheet.column_dimensions[get_column_letter(position)].width = width
+    
+    # Style headers
+    thin = Side(border_style="thin")
+    header_style = {
+        'font': Font(bold=True, color="FFFFFF"),
+        'fill': PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+        'alignment': Alignment(horizontal="center"),
+        'border': Border(top=thin, bottom=thin, left=thin, right=thin),
+    }
+    # Style the total row
+    total_style = {
+        'font': Font(bold=True),
+        'fill': PatternFill(start_color="E8F4FD", end_color="E8F4FD", fill_type="solid"),
+        'alignment': Alignment(horizontal="center"),
+        'border': Border(
+            top=Side(border_style="thick", color="366092"),
+            bottom=Side(border_style="thick", color="366092"),
+            left=Side(border_style="thin", color="366092"),
+            right=Side(border_style="thin", color="366092")
+        ),
+    }
+    
+    def styled(values: Iterable[Any], style: Dict[str, Any]) -> List[WriteOnlyCell]:
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(worksheet, value=value)
+            for attribute, setting in style.items():
+                setattr(cell, attribute, setting)
+            cells.append(cell)
+        return cells
+    
+    worksheet.append(styled(DEMAND_EXPORT_COLUMNS, header_style))
+    for row in rows:
+        values = [row[column] for column in DEMAND_EXPORT_COLUMNS]
+        worksheet.append(styled(values, total_style) if row['Index'] == 'TOTAL' else values)
+    
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
         output.seek(0)
+        while chunk := output.read(EXPORT_CHUNK_BYTES):
+            yield chunk
+
+# Machine-readable exports: rows are encoded batch by batch and streamed, never collected in a DataFrame
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+EXPORT_BATCH_ROWS = int(os.environ.get('EXPORT_BATCH_ROWS', '10000'))
+
+# Column types of the exported rows, used for the Parquet schema
+DEMAND_EXPORT_SCHEMA = {
+    'Index': 'int64',
+    'Brand Name': 'string',
+    'Wholesale Rate': 'float64',
+    'Projected Monthly Sale (Qty)': 'int64',
+    'Quantity held in Stock': 'int64',
+    'Quantity to be Demanded': 'int64',
+    'Number of Cases to be Demanded': 'int64',
+}
+CALCULATION_EXPORT_SCHEMA = {
+    'index': 'int64',
+    'brand_name': 'string',
+    'calculated_wholesale_rate': 'float64',
+    'selling_rate': 'float64',
+    'calculated_avg_monthly_sale': 'float64',
+    'calculated_current_stock_value': 'float64',
+    'calculated_multiplier_value': 'float64',
+    'D1_date': 'string',
+    'D1_stock': 'float64',
+    'DL_date': 'string',
+    'DL_stock': 'float64',
+    'total_sales_qty': 'float64',
+    'avg_daily_sales_qty': 'float64',
+    'days_analyzed': 'int64',
+    'stock_available_days': 'float64',
+}
+
+class CsvEncoder:
+    def __init__(self, schema: Dict[str, str]):
+        self.columns = list(schema)
+    
+    def begin(self) -> bytes:
+        return self.encode([dict(zip(self.columns, self.columns))])
+    
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([row[column] for column in self.columns] for row in rows)
+        return buffer.getvalue().encode()
+    
+    def end(self) -> bytes:
+        return b''
+
+class JsonlEncoder:
+    def __init__(self, schema: Dict[str, str]):
+        self.columns = list(schema)
+    
+    def begin(self) -> bytes:
+        return b''
+    
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        return ''.join(json.dumps({column: row[column] for column in self.columns}) + '\n' for row in rows).encode()
+    
+    def end(self) -> bytes:
+        return b''
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands over what was written since the last drain, keeping the stream offset"""
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ParquetEncoder:
+    """Parquet writer emitting one row group per batch; needs pyarrow"""
+    def __init__(self, schema: Dict[str, str]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([(column, getattr(pa, type_name)()) for column, type_name in schema.items()])
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+    
+    def begin(self) -> bytes:
+        return self.sink.drain()
+    
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+        return self.sink.drain()
+    
+    def end(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+EXPORT_ENCODERS = {'csv': CsvEncoder, 'jsonl': JsonlEncoder, 'parquet': ParquetEncoder}
+
+def export_encoder(export_format: str, schema: Dict[str, str]):
+    """Encoder for a machine-readable export format, raising 400/501 before any response starts"""
+    if export_format not in EXPORT_ENCODERS:
+        raise HTTPException(status_code=400, detail=f"Invalid export format '{export_format}'. Use one of: {', '.join(EXPORT_ENCODERS)}")
+    try:
+        return EXPORT_ENCODERS[export_format](schema)
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"The {export_format} export needs pyarrow installed on the server")
+
+async def encoded_export_chunks(encoder, rows) -> AsyncIterator[bytes]:
+    """Encode an async or plain iterable of rows in EXPORT_BATCH_ROWS batches, off the event loop"""
+    yield encoder.begin()
+    batch = []
+    async def flush():
+        encoded = await asyncio.to_thread(encoder.encode, batch)
+        batch.clear()
+        return encoded
+    if hasattr(rows, '__aiter__'):
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                yield await flush()
+    else:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                yield await flush()
+    if batch:
+        yield await flush()
+    yield await asyncio.to_thread(encoder.end)
+
+def export_response(chunks, export_format: str, filename_stem: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename={filename_stem}_{datetime.now().strftime("%Y%m%d")}.{export_format}'
+        }
+    )
+
+@api_router.get("/export-demand-list")
+async def export_demand_list(dataset_version: Optional[str] = None, export_format: str = Query('xlsx', alias='format')):
+    """Export demand recommendations with updated format: Index, Brand Name, Wholesale Rate, Projected Monthly Sale, Quantity in Stock, Quantity to be Demanded, Number of Cases to be Demanded
+
+    `format=csv|jsonl|parquet` exports the same columns without the styled TOTAL row.
+    """
+    encoder = None if export_format == 'xlsx' else export_encoder(export_format, DEMAND_EXPORT_SCHEMA)
+    version = await resolve_dataset_version(dataset_version)
+    try:
+        # Get recommendations, each with the brand record holding its index and monthly sale data
+        demand_plan = await build_demand_plan(version)
         
-        from fastapi.responses import Response
+        if not demand_plan:
+            raise HTTPException(status_code=404, detail="No recommendations to export")
         
-        return Response(
-            content=output.getvalue(),
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={
-                'Content-Disposition': f'attachment; filename=liquor_demand_forecast_{datetime.now().strftime("%Y%m%d")}.xlsx'
-            }
-        )
+        if encoder:
+            return export_response(
+                encoded_export_chunks(encoder, demand_export_rows(demand_plan, total_row=False)), export_format, 'liquor_demand_forecast'
+            )
+        # The workbook is written in a worker thread as the response streams
+        return export_response(demand_workbook_chunks(demand_export_rows(demand_plan)), 'xlsx', 'liquor_demand_forecast')
         
     except Exception as e:
         logging.error(f"Error exporting demand list: {e}")
         raise HTTPException(status_code=500, detail=f"Error exporting demand list: {str(e)}")
 
+@api_router.get("/export-calculation-details")
+async def export_calculation_details(dataset_version: Optional[str] = None, export_format: str = Query('csv', alias='format')):
+    """Export the calculation-details rows of every brand as csv, jsonl or parquet, encoded as the response streams"""
+    encoder = export_encoder(export_format, CALCULATION_EXPORT_SCHEMA)
+    version = await resolve_dataset_version(dataset_version)
+    dataset = await get_columnar_dataset(version)
+    if not len(dataset):
+        raise HTTPException(status_code=404, detail="No data found")
+    
+    rows = (calculation_detail(record) for record in calculation_records(dataset))
+    return export_response(encoded_export_chunks(encoder, rows), export_format, 'liquor_calculation_details')
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1000,6 +3017,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the liquor_data and upload_jobs indexes; existing ones are left as they are"""
+    try:
+        await db.liquor_data.create_indexes(LIQUOR_DATA_INDEXES)
+        await db.upload_jobs.create_indexes(UPLOAD_JOB_INDEXES)
+    except Exception as e:
+        logging.error(f"Error creating indexes: {e}")
+
+@app.on_event("startup")
+async def recover_upload_jobs():
+    """Fail the background uploads left active by a server that stopped"""
+    try:
+        failed = await fail_stale_upload_jobs()
+        if failed:
+            logging.info(f"Marked {failed} interrupted upload jobs as failed")
+    except Exception as e:
+        logging.error(f"Error recovering upload jobs: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await cancel_upload_tasks('Interrupted by server shutdown')
+    columnar_datasets.clear()
+    client.close()
+    shutdown_executors()
\ No newline at end of file
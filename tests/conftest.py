@@ -0,0 +1,72 @@
+import io
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py connects lazily, so importing it only needs the settings to exist
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'liquor_dashboard_test')
+# Spawning a process pool per TestClient is slow; tests that need one opt in
+os.environ.setdefault('PARSE_EXECUTOR', 'thread')
+# Uploads are parsed every time unless a test opts in to the parse cache
+os.environ.setdefault('PARSE_CACHE_BYTES', '0')
+
+
+@pytest.fixture
+def stock_sheet():
+    """Five brands over seven days with a restock of Royal Rum Deluxe on 28-Aug"""
+    return pd.DataFrame({
+        'Index': [101, 205, 350, 412, 578],
+        'Brand Name': [
+            'Premium Whiskey Gold', 'Classic Vodka Silver', 'Royal Rum Deluxe',
+            'Elite Gin Supreme', 'Heritage Brandy Reserve',
+        ],
+        'Wholesale Rate': [450, 675, 900, 540, 720],
+        'Selling Rate': [500, 750, 1000, 600, 800],
+        '25-Aug': [120, 180, 95, 140, 110],
+        '26-Aug': [115, 175, 92, 135, 106],
+        '27-Aug': [110, 170, 90, 130, 102],
+        '28-Aug': [105, 165, 187, 125, 98],
+        '29-Aug': [100, 160, 185, 120, 95],
+        '30-Aug': [95, 155, 182, 115, 91],
+        '31-Aug': [90, 150, 180, 110, None],
+    })
+
+
+@pytest.fixture
+def api():
+    """TestClient against a clean test database; skipped when no MongoDB server is reachable"""
+    from fastapi.testclient import TestClient
+    from pymongo import MongoClient
+
+    import server
+
+    mongo = MongoClient(os.environ['MONGO_URL'], serverSelectionTimeoutMS=500)
+    try:
+        mongo.admin.command('ping')
+    except Exception:
+        pytest.skip('MongoDB is not reachable at MONGO_URL')
+    mongo.drop_database(os.environ['DB_NAME'])
+    # Forget the dataset pointer and results cached from the previous test's database
+    server.dataset_state_cache['expires'] = 0.0
+    server.analytics_cache.invalidate()
+    with TestClient(server.app) as client:
+        yield client
+    mongo.drop_database(os.environ['DB_NAME'])
+    mongo.close()
+
+
+@pytest.fixture
+def upload(api):
+    """POST a DataFrame to /api/upload-data as an xlsx file"""
+    def upload(df, **params):
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        return api.post('/api/upload-data', params=params, files={'file': ('stock.xlsx', buffer.getvalue())})
+    return upload
@@ -0,0 +1,73 @@
+import asyncio
+from collections import OrderedDict
+
+import numpy as np
+from bson import ObjectId
+
+import server
+from server import ColumnarDataset
+
+
+def test_python_analytics_break_ties_on_id():
+    records = [
+        {'_id': ObjectId(), 'brand_name': f'Tied Brand {n}', 'daily_sales': {'25-Aug': 2},
+         'monthly_sale_value': 100.0, 'stock_value_today': 500.0, 'stock_ratio': 5.0}
+        for n in range(15)
+    ]
+
+    analytics = server.columnar_analytics(ColumnarDataset.from_records(reversed(records)), 3.0)
+
+    names = [record['brand_name'] for record in records]
+    assert [item['brand_name'] for item in analytics.top_selling_brands] == names[:10]
+    assert [item['brand_name'] for item in analytics.overstocked_items] == names
+
+
+def test_columnar_dataset_aligns_daily_sales_across_date_layouts():
+    records = [
+        {'_id': ObjectId(), 'brand_name': 'Old', 'rate': 40.0, 'daily_sales': {'25-Aug': 3, '26-Aug': 4}},
+        {'_id': ObjectId(), 'brand_name': 'New', 'selling_rate': 50.0, 'daily_sales': {'26-Aug': 5, '27-Aug': 6}},
+        {'_id': ObjectId(), 'brand_name': 'Quiet', 'selling_rate': 60.0, 'daily_sales': {}},
+    ]
+
+    dataset = ColumnarDataset.from_records(records)
+
+    assert dataset.dates == ['25-Aug', '26-Aug', '27-Aug']
+    assert dataset.daily_sales.tolist() == [[3, 4, 0], [0, 5, 6], [0, 0, 0]]
+    assert dataset['selling_rate'].tolist() == [40.0, 50.0, 60.0]
+    assert dataset.records(np.arange(3), server.CalculationRecord)[0]['D1_date'] == 'N/A'
+
+
+def test_columnar_dataset_orders_dates_chronologically():
+    records = [
+        {'_id': ObjectId(), 'brand_name': 'Late', 'daily_sales': {'30-Sep': 1, '01-Oct': 2, '02-Oct': 3}},
+        {'_id': ObjectId(), 'brand_name': 'Early', 'daily_sales': {'29-Sep': 4, '30-Sep': 5}},
+    ]
+
+    dataset = ColumnarDataset.from_records(records)
+
+    assert dataset.dates == ['29-Sep', '30-Sep', '01-Oct', '02-Oct']
+    assert dataset.daily_sales.tolist() == [[0, 1, 2, 3], [4, 5, 0, 0]]
+    assert server.columnar_analytics(dataset, 3.0).sales_trends == {'29-Sep': 4, '30-Sep': 6, '01-Oct': 2, '02-Oct': 3}
+
+
+def test_columnar_dataset_loads_once_per_version(monkeypatch):
+    loads = []
+
+    async def records(version, record_type):
+        loads.append(version)
+        await asyncio.sleep(0.01)
+        yield {'_id': ObjectId(), 'brand_name': f'Brand {version}', 'daily_sales': {}}
+
+    async def read_concurrently():
+        first = await asyncio.gather(*(server.get_columnar_dataset('v1') for _ in range(5)))
+        again = await server.get_columnar_dataset('v1')
+        other = await server.get_columnar_dataset('v2')
+        return first, again, other
+
+    monkeypatch.setattr(server, 'iter_liquor_records', records)
+    monkeypatch.setattr(server, 'columnar_datasets', OrderedDict())
+    first, again, other = asyncio.run(read_concurrently())
+
+    assert loads == ['v1', 'v2']
+    assert all(dataset is again for dataset in first)
+    assert other['brand_name'].tolist() == ['Brand v2']
@@ -0,0 +1,340 @@
+import io
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+
+def test_incremental_upload_reports_changes(api, upload, stock_sheet):
+    assert upload(stock_sheet).json()['inserted'] == 5
+
+    changed = stock_sheet.copy()
+    changed.loc[1, '31-Aug'] = 140
+    changed = changed[changed['Brand Name'] != 'Elite Gin Supreme']
+    changed.loc[9] = [900, 'Craft Beer Lager', 90, 100, 40, 38, 36, 34, 32, 30, 28]
+    response = upload(changed, mode='incremental')
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert {key: summary[key] for key in ('inserted', 'updated', 'unchanged', 'removed')} == {
+        'inserted': 1, 'updated': 1, 'unchanged': 3, 'removed': 1,
+    }
+    brands = {brand['brand_name']: brand for brand in api.get('/api/brands').json()}
+    assert sorted(brands) == sorted(changed['Brand Name'])
+    assert brands['Classic Vodka Silver']['DL_stock'] == 140
+
+
+def test_append_stock_publishes_a_day_added_to_every_brand(api, upload, stock_sheet):
+    first = upload(stock_sheet.drop(columns='31-Aug')).json()['dataset_version']
+
+    response = api.post('/api/append-stock', json={'date': '31-Aug', 'key': 'index_number', 'stock': {
+        str(index): int(stock) for index, stock in zip(stock_sheet['Index'], stock_sheet['31-Aug']) if pd.notna(stock)
+    }})
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary['matched_brands'], summary['rescanned_brands']) == (4, 0)
+    assert summary['dataset_version'] != first
+    brands = {brand['brand_name']: brand for brand in api.get('/api/brands').json()}
+    assert brands['Premium Whiskey Gold']['DL_date'] == '31-Aug'
+    assert brands['Premium Whiskey Gold']['daily_sales']['31-Aug'] == 90
+    assert brands['Heritage Brandy Reserve']['DL_date'] == '30-Aug'
+    assert api.post('/api/append-stock', json={'date': '31-Aug', 'stock': {'Premium Whiskey Gold': 1}}).status_code == 400
+    assert api.post('/api/append-stock', json={'date': '01-Sep', 'stock': {'Nobody': 1}}).status_code == 400
+    assert api.post('/api/append-stock', json={'date': '01-Sep', 'stock': {'Premium Whiskey Gold': 1.5}}).status_code == 422
+
+
+def test_upload_rejects_unknown_mode(upload, stock_sheet):
+    assert upload(stock_sheet, mode='merge').status_code == 400
+
+
+def test_upload_publishes_new_dataset_version(api, upload, stock_sheet):
+    response = upload(stock_sheet).json()
+    assert response['removed'] == 0
+    first = response['dataset_version']
+    response = upload(stock_sheet.head(2)).json()
+    assert response['removed'] == 5
+    second = response['dataset_version']
+
+    dataset = api.get('/api/dataset').json()
+    assert dataset['dataset_version'] == second
+    assert dataset['previous_versions'] == [first]
+    assert dataset['total_records'] == 2
+    # Reads can stay pinned to the previous version
+    pinned = api.get('/api/brands', params={'dataset_version': first}).json()
+    assert len(pinned) == 5
+    assert api.get('/api/brands', params={'dataset_version': 'unknown'}).status_code == 404
+
+
+def test_failed_upload_keeps_current_dataset(api, upload, stock_sheet):
+    version = upload(stock_sheet).json()['dataset_version']
+    empty = stock_sheet.assign(**{'Brand Name': ''})
+
+    assert upload(empty).status_code == 400
+    assert api.get('/api/dataset').json()['dataset_version'] == version
+    assert len(api.get('/api/brands').json()) == 5
+
+
+def test_rollback_restores_previous_dataset(api, upload, stock_sheet):
+    first = upload(stock_sheet).json()['dataset_version']
+    changed = stock_sheet.copy()
+    changed.loc[1, '31-Aug'] = 140
+    upload(changed.head(3), mode='incremental')
+
+    response = api.post('/api/dataset/rollback')
+    assert response.status_code == 200
+    assert response.json()['dataset_version'] == first
+    brands = {brand['brand_name']: brand for brand in api.get('/api/brands').json()}
+    assert len(brands) == 5
+    assert brands['Classic Vodka Silver']['DL_stock'] == 150
+    assert api.post('/api/dataset/rollback').status_code == 400
+
+
+def test_analytics_served_from_cache_until_upload(api, upload, stock_sheet):
+    upload(stock_sheet)
+    before = api.get('/api/analytics-cache').json()
+
+    first = api.get('/api/analytics', params={'overstock_multiplier': 2}).json()
+    assert api.get('/api/analytics', params={'overstock_multiplier': 2}).json() == first
+    api.get('/api/analytics', params={'overstock_multiplier': 4})
+    stats = api.get('/api/analytics-cache').json()
+    assert stats['hits'] - before['hits'] == 1
+    assert stats['misses'] - before['misses'] == 2
+
+    upload(stock_sheet.head(2))
+    assert api.get('/api/analytics-cache').json()['entries'] == 0
+    assert api.get('/api/analytics', params={'overstock_multiplier': 2}).json()['total_brands'] == 2
+
+
+def test_analytics_cover_more_than_a_thousand_brands(api, upload, stock_sheet):
+    many = pd.concat([stock_sheet] * 250, ignore_index=True)
+    many['Brand Name'] = [f'Brand {n}' for n in range(len(many))]
+    many['Index'] = range(1, len(many) + 1)
+    assert upload(many).status_code == 200
+
+    assert api.get('/api/analytics').json()['total_brands'] == 1250
+    assert len(api.get('/api/brands').json()) == 1250
+    details = api.get('/api/calculation-details').json()
+    assert [row['index'] for row in details] == list(range(1, 1251))
+
+
+@pytest.mark.parametrize('overstock_multiplier', [0.5, 3.0])
+def test_pipeline_analytics_match_python(api, upload, stock_sheet, overstock_multiplier):
+    upload(stock_sheet)
+    params = {'overstock_multiplier': overstock_multiplier}
+
+    python = api.get('/api/analytics', params={**params, 'backend': 'python'}).json()
+    pipeline = api.get('/api/analytics', params={**params, 'backend': 'pipeline'}).json()
+    assert pipeline.keys() == python.keys()
+    for key in ('total_brands', 'overstocked_brands', 'sales_trends', 'top_selling_brands', 'overstocked_items'):
+        assert pipeline[key] == python[key]
+    for key in ('total_stock_value', 'total_overstocked_value'):
+        assert pipeline[key] == pytest.approx(python[key])
+
+
+def test_pipeline_and_python_analytics_break_ties_on_id(api, upload, stock_sheet):
+    tied = pd.concat([stock_sheet.head(1)] * 15, ignore_index=True)
+    tied['Brand Name'] = [f'Tied Brand {n}' for n in range(15)]
+    tied['Index'] = range(1, 16)
+    upload(tied)
+    # Re-stage the first brand so its document is the newest of the tied ones
+    upload(tied.assign(**{'Selling Rate': [1] + [500] * 14}), mode='incremental')
+    upload(tied.iloc[::-1], mode='incremental')
+    params = {'overstock_multiplier': 0.5}
+
+    python = api.get('/api/analytics', params={**params, 'backend': 'python'}).json()
+    pipeline = api.get('/api/analytics', params={**params, 'backend': 'pipeline'}).json()
+    top_selling = [item['brand_name'] for item in python['top_selling_brands']]
+    assert top_selling == [f'Tied Brand {n}' for n in range(1, 11)]
+    assert pipeline['top_selling_brands'] == python['top_selling_brands']
+    assert [item['brand_name'] for item in python['overstocked_items']][-1] == 'Tied Brand 0'
+    assert pipeline['overstocked_items'] == python['overstocked_items']
+
+
+def test_analytics_rejects_unknown_backend(api):
+    assert api.get('/api/analytics', params={'backend': 'spark'}).status_code == 400
+
+
+def test_hot_queries_use_indexes(api, upload, stock_sheet):
+    from pymongo import MongoClient
+
+    import server
+
+    version = upload(stock_sheet).json()['dataset_version']
+    match = server.dataset_filter(version)
+    queries = [
+        {'filter': match, 'projection': server.record_projection(server.DatasetRecord)},
+        {'filter': {**match, 'brand_name': 'Royal Rum Deluxe'}},
+        {'filter': match, 'sort': [('monthly_sale_value', -1), ('_id', 1)], 'limit': 10},
+        {'filter': {'id': 'some-id'}},
+    ]
+    with MongoClient(os.environ['MONGO_URL']) as mongo:
+        collection = mongo[os.environ['DB_NAME']].liquor_data
+        for query in queries:
+            winning_plan = json.dumps(collection.find(**query).explain()['queryPlanner']['winningPlan'], default=str)
+            assert 'COLLSCAN' not in winning_plan, query
+            assert '"SORT"' not in winning_plan, query
+
+
+@pytest.mark.parametrize('mode', ['replace', 'incremental'])
+def test_repeated_brand_rows_keep_the_last(api, upload, stock_sheet, mode):
+    upload(stock_sheet)
+    repeated = pd.concat([stock_sheet, stock_sheet.iloc[[1]].assign(**{'31-Aug': 120})], ignore_index=True)
+
+    response = upload(repeated, mode=mode)
+    assert response.status_code == 200
+    brands = api.get('/api/brands').json()
+    assert len(brands) == 5
+    assert {brand['brand_name']: brand for brand in brands}['Classic Vodka Silver']['DL_stock'] == 120
+
+
+def test_export_and_recommendations_share_one_cached_plan(api, upload, stock_sheet):
+    stock_sheet['31-Aug'] = [20, 30, 180, 110, None]
+    upload(stock_sheet)
+    before = api.get('/api/analytics-cache').json()
+
+    export = api.get('/api/export-demand-list')
+    assert export.status_code == 200
+    recommendations = api.get('/api/demand-recommendations').json()
+    stats = api.get('/api/analytics-cache').json()
+    assert (stats['misses'] - before['misses'], stats['hits'] - before['hits']) == (1, 1)
+
+    sheet = pd.read_excel(io.BytesIO(export.content))
+    assert list(sheet['Brand Name'][:-1]) == [item['brand_name'] for item in recommendations]
+    assert sheet['Index'][0] == stock_sheet.set_index('Brand Name').loc[recommendations[0]['brand_name'], 'Index']
+
+
+@pytest.mark.parametrize('export_format', ['csv', 'jsonl'])
+def test_calculation_details_export_matches_endpoint(api, upload, stock_sheet, export_format):
+    upload(stock_sheet)
+    details = api.get('/api/calculation-details').json()
+
+    response = api.get('/api/export-calculation-details', params={'format': export_format})
+    assert response.status_code == 200
+    if export_format == 'csv':
+        exported = pd.read_csv(io.BytesIO(response.content)).to_dict('records')
+    else:
+        exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['brand_name'] for row in exported] == [row['brand_name'] for row in details]
+    assert api.get('/api/export-calculation-details', params={'format': 'xml'}).status_code == 400
+
+
+
+def test_traced_upload_in_parse_worker_reports_its_events(api, upload, stock_sheet, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, 'PARSE_EXECUTOR', 'process')
+    response = upload(stock_sheet, trace='true')
+    assert response.status_code == 200
+
+    trace = api.get(f"/api/parse-traces/{response.json()['trace_id']}").json()
+    kinds = [event['event'] for event in trace['events']]
+    assert kinds[0] == 'format' and 'd1_found' in kinds and kinds[-1] == 'parsed'
+    assert trace['dropped_events'] == 0
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_analytics_latency_stays_flat_during_upload(api, upload, stock_sheet, monkeypatch, streaming):
+    import server
+
+    # The slow parser patched in below only reaches thread workers
+    monkeypatch.setattr(server, 'PARSE_EXECUTOR', 'thread')
+    # and a cached re-upload of the same sheet would not reach it at all
+    monkeypatch.setattr(server, 'parse_cache', server.ParseCache(max_bytes=0))
+    upload(stock_sheet)
+
+    def analytics_latency():
+        started = time.perf_counter()
+        assert api.get('/api/analytics').status_code == 200
+        return time.perf_counter() - started
+
+    baseline = sorted(analytics_latency() for _ in range(5))[2]
+
+    # Stand in for a large file with a parser that blocks its thread for a second
+    parse_seconds = 1.0
+    parse_tabular_format = server.parse_tabular_format
+    parse_tabular_stream = server.parse_tabular_stream
+
+    def slow_parse(*args):
+        time.sleep(parse_seconds)
+        return parse_tabular_format(*args)
+
+    def slow_stream(*args):
+        time.sleep(parse_seconds)
+        yield from parse_tabular_stream(*args)
+
+    monkeypatch.setattr(server, 'parse_tabular_format', slow_parse)
+    monkeypatch.setattr(server, 'parse_tabular_stream', slow_stream)
+    buffer = io.BytesIO()
+    stock_sheet.to_excel(buffer, index=False)
+    uploading = threading.Thread(target=lambda: api.post(
+        '/api/upload-data', params={'streaming': streaming}, files={'file': ('stock.xlsx', buffer.getvalue())}
+    ))
+    started = time.perf_counter()
+    uploading.start()
+    latencies = []
+    while uploading.is_alive():
+        latencies.append(analytics_latency())
+        time.sleep(0.02)
+    uploading.join()
+
+    assert time.perf_counter() - started >= parse_seconds
+    assert len(latencies) >= 5
+    assert sorted(latencies)[len(latencies) // 2] < baseline + parse_seconds / 4
+    assert len(api.get('/api/dataset').json()['previous_versions']) == 1
+
+
+def _finished_job(api, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = api.get(f'/api/upload-jobs/{job_id}').json()
+        if job['status'] not in ('queued', 'running') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_background_upload_reports_progress_and_summary(api, upload, stock_sheet):
+    response = upload(stock_sheet, background='true', trace='true')
+    assert response.status_code == 202
+    assert response.json()['status'] == 'queued'
+
+    job = _finished_job(api, response.json()['job_id'])
+    assert job['status'] == 'completed' and job['error'] is None
+    assert job['progress'] == {'rows_parsed': 5, 'brands_computed': 5, 'documents_written': 5}
+    assert job['summary']['total_records'] == 5
+    assert api.get('/api/dataset').json()['dataset_version'] == job['summary']['dataset_version']
+    assert api.get(f"/api/parse-traces/{job['trace_id']}").json()['events'][-1]['event'] == 'parsed'
+
+    failed = _finished_job(api, upload(stock_sheet.assign(**{'Brand Name': ''}), background='true').json()['job_id'])
+    assert failed['status'] == 'failed' and failed['error']
+    assert api.get('/api/upload-jobs/unknown').status_code == 404
+
+
+def test_cancelled_background_upload_keeps_current_dataset(api, upload, stock_sheet, monkeypatch):
+    import server
+
+    version = upload(stock_sheet).json()['dataset_version']
+    parse_tabular_stream = server.parse_tabular_stream
+
+    def slow_stream(*args):
+        for batch in parse_tabular_stream(*args):
+            yield batch
+            time.sleep(0.5)
+
+    monkeypatch.setattr(server, 'parse_tabular_stream', slow_stream)
+    monkeypatch.setattr(server, 'STREAM_CHUNK_ROWS', 1)
+    job_id = upload(stock_sheet.head(4), background='true').json()['job_id']
+    for _ in range(100):
+        if api.get(f'/api/upload-jobs/{job_id}').json()['progress']['documents_written']:
+            break
+        time.sleep(0.05)
+
+    job = api.post(f'/api/upload-jobs/{job_id}/cancel').json()
+    assert job['status'] == 'cancelled'
+    assert 0 < job['progress']['documents_written'] < 4
+    assert api.post(f'/api/upload-jobs/{job_id}/cancel').status_code == 400
+    assert api.get('/api/dataset').json()['dataset_version'] == version
+    assert len(api.get('/api/brands').json()) == 5
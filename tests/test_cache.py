@@ -0,0 +1,112 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import server
+from server import AnalyticsCache, ParseCache
+
+
+def test_analytics_cache_evicts_least_recently_used():
+    cache = AnalyticsCache(max_entries=2)
+    cache.put(('charts', 'v1'), [1])
+    cache.put(('charts', 'v2'), [2])
+    assert cache.get(('charts', 'v1')) == [1]
+    cache.put(('charts', 'v3'), [3])
+
+    assert cache.get(('charts', 'v2')) is None
+    assert cache.get(('charts', 'v1')) == [1]
+    assert cache.stats()['evictions'] == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_analytics_cache_respects_memory_budget():
+    cache = AnalyticsCache(max_bytes=100)
+    cache.put(('big',), ['x' * 200])
+    assert cache.get(('big',)) is None
+
+    for n in range(10):
+        cache.put(('small', n), 'y' * 20)
+    assert cache.stats()['bytes'] <= 100
+    assert cache.get(('small', 9)) == 'y' * 20
+    assert cache.get(('small', 0)) is None
+
+
+@pytest.fixture
+def parse_cache(tmp_path, monkeypatch):
+    cache = ParseCache(tmp_path, max_bytes=64 * 1024 * 1024)
+    monkeypatch.setattr(server, 'parse_cache', cache)
+    return cache
+
+
+def csv_bytes(df):
+    return df.to_csv(index=False).encode()
+
+
+def test_identical_upload_is_served_from_the_parse_cache(stock_sheet, parse_cache, monkeypatch):
+    content = csv_bytes(stock_sheet)
+    first = server.parse_upload_content(content)['documents']
+
+    def parse_again(*args, **kwargs):
+        raise AssertionError('parsed a cached upload again')
+    monkeypatch.setattr(server, 'parse_excel_data', parse_again)
+    second = server.parse_upload_content(content)['documents']
+
+    bookkeeping = ('id', 'upload_timestamp')
+    assert [{k: v for k, v in doc.items() if k not in bookkeeping} for doc in second] == [
+        {k: v for k, v in doc.items() if k not in bookkeeping} for doc in first
+    ]
+    assert [list(doc) for doc in second] == [list(doc) for doc in first]
+    assert {doc['id'] for doc in second}.isdisjoint(doc['id'] for doc in first)
+
+
+def test_streamed_upload_is_served_from_the_parse_cache(stock_sheet, parse_cache, monkeypatch):
+    content = csv_bytes(stock_sheet)
+    key = server.upload_cache_key(io.BytesIO(content))
+    assert key == server.upload_cache_key(content)
+
+    first = [doc for batch in parse_cache.documents(key, lambda: server.build_liquor_documents(
+        server.parse_upload_stream(io.BytesIO(content)))) for doc in batch]
+    second = [doc for batch in parse_cache.documents(key, lambda: pytest.fail('parsed again')) for doc in batch]
+
+    assert [doc['content_hash'] for doc in second] == [doc['content_hash'] for doc in first]
+
+
+def test_failed_or_traced_parses_are_not_cached(parse_cache, stock_sheet):
+    assert server.parse_upload_content(b'Brand Name,Index\n')['error'][0] == 400
+    assert server.upload_cache_key(csv_bytes(stock_sheet), server.ParseTrace()) is None
+    server.parse_upload_content(csv_bytes(stock_sheet), trace_enabled=True)
+
+    assert parse_cache.stats()['entries'] == 0
+
+
+def test_appended_date_column_decodes_only_the_new_column(stock_sheet, parse_cache, monkeypatch):
+    # Text cells are decoded one by one; unchanged columns come from the previous parse
+    sheet = stock_sheet.copy()
+    for column in sheet.columns[4:]:
+        sheet[column] = sheet[column].map(lambda value: None if pd.isna(value) else f'{value:g}')
+    server.parse_tabular_format(sheet.drop(columns='31-Aug'))
+
+    decoded = []
+    stock_column = server._stock_column
+    monkeypatch.setattr(server, '_stock_column', lambda column: decoded.append(column.name) or stock_column(column))
+    records = server.parse_tabular_format(sheet.copy())
+
+    assert decoded == ['31-Aug']
+    monkeypatch.setattr(server, 'parse_cache', ParseCache(max_bytes=0))
+    assert records == server.parse_tabular_format(sheet.copy())
+
+
+def test_parse_cache_evicts_least_recently_used_entries(tmp_path):
+    cache = ParseCache(tmp_path, max_bytes=350)
+    for name in ('a', 'b', 'c'):
+        with cache.create(name) as entry:
+            entry.write(b'x' * 100)
+        os.utime(tmp_path / name, (0, {'a': 1, 'b': 2, 'c': 3}[name]))
+    cache.open('a').close()
+    with cache.create('d') as entry:
+        entry.write(b'x' * 100)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['a', 'c', 'd']
+    assert cache.stats() == {'entries': 3, 'bytes': 300, 'max_bytes': 350}
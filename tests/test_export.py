@@ -0,0 +1,57 @@
+import asyncio
+import io
+import json
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+import server
+from server import DemandRecommendation, demand_export_rows, demand_workbook_chunks, encoded_export_chunks
+
+
+def test_demand_workbook_keeps_header_and_total_styling():
+    plan = [
+        (DemandRecommendation(brand_name=f'Brand {n}', selling_rate=100, wholesale_rate=90,
+                              current_stock_qty=5, recommended_qty=25, urgency_level='HIGH'),
+         {'index_number': n, 'monthly_sale_qty': 30})
+        for n in (3, 1)
+    ]
+    workbook = load_workbook(io.BytesIO(b''.join(demand_workbook_chunks(demand_export_rows(plan)))))
+    sheet = workbook['Demand Forecast']
+
+    rows = [[cell.value for cell in row] for row in sheet.iter_rows()]
+    assert rows[0][:2] == ['Index', 'Brand Name']
+    assert rows[1] == [3, 'Brand 3', 90, 30, 5, 25, 3]
+    assert rows[-1] == ['TOTAL', '(2 brands)', 'Cost: 4500.0', 60, 10, 50, 6]
+    assert sheet['A1'].font.b and sheet['A1'].fill.start_color.rgb.endswith('366092')
+    assert sheet['G4'].font.b and sheet['G4'].border.top.style == 'thick'
+    assert sheet.column_dimensions['B'].width == 30
+
+
+def _export_bytes(encoder, rows):
+    async def collect():
+        return b''.join([chunk async for chunk in encoded_export_chunks(encoder, rows)])
+    return asyncio.run(collect())
+
+
+EXPORT_SCHEMA = {'index': 'int64', 'brand_name': 'string', 'stock': 'float64'}
+EXPORT_ROWS = [{'index': n, 'brand_name': f'Brand, "{n}"', 'stock': n / 4} for n in range(25)]
+
+
+def test_csv_and_jsonl_exports_round_trip(monkeypatch):
+    monkeypatch.setattr(server, 'EXPORT_BATCH_ROWS', 10)
+    csv_rows = pd.read_csv(io.BytesIO(_export_bytes(server.CsvEncoder(EXPORT_SCHEMA), EXPORT_ROWS)))
+    assert csv_rows.to_dict('records') == EXPORT_ROWS
+
+    jsonl = _export_bytes(server.JsonlEncoder(EXPORT_SCHEMA), iter(EXPORT_ROWS)).decode().splitlines()
+    assert [json.loads(line) for line in jsonl] == EXPORT_ROWS
+
+
+def test_parquet_export_writes_a_row_group_per_batch(monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    monkeypatch.setattr(server, 'EXPORT_BATCH_ROWS', 10)
+    parquet = pq.ParquetFile(io.BytesIO(_export_bytes(server.ParquetEncoder(EXPORT_SCHEMA), EXPORT_ROWS)))
+    assert parquet.metadata.num_row_groups == 3
+    assert parquet.read().to_pylist() == EXPORT_ROWS
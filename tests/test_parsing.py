@@ -0,0 +1,302 @@
+import io
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import server
+from benchmarks import make_stock_sheet, model_liquor_document, row_loop_brand_records
+from pydantic import ValidationError
+
+
+def test_parse_tabular_format_uses_global_d1(stock_sheet):
+    records = server.parse_tabular_format(stock_sheet)
+
+    assert [record['index_number'] for record in records] == [101, 205, 350, 412, 578]
+    assert {record['D1_date'] for record in records} == {'28-Aug'}
+
+    whiskey = records[0]
+    assert whiskey['D1_stock'] == 105
+    assert whiskey['DL_date'] == '31-Aug'
+    assert whiskey['DL_stock'] == 90
+    assert whiskey['total_sales_qty'] == 15
+    assert whiskey['days_analyzed'] == 4
+    assert whiskey['avg_daily_sales_qty'] == pytest.approx(3.75)
+    assert whiskey['monthly_sale_value'] == pytest.approx(3.75 * 24 * 500)
+    assert whiskey['current_stock_qty'] == 90
+
+
+def test_parse_tabular_format_falls_back_to_last_valid_dl(stock_sheet):
+    brandy = server.parse_tabular_format(stock_sheet)[-1]
+
+    # No stock on the last date, so DL is the brand's last valid value
+    assert brandy['DL_date'] == '30-Aug'
+    assert brandy['DL_stock'] == 91
+    assert brandy['days_analyzed'] == 3
+
+
+def test_parse_tabular_format_orders_dates_and_counts_calendar_days():
+    sheet = pd.DataFrame({
+        'Brand Name': ['Premium Whiskey Gold'],
+        'Selling Rate': [500],
+        '01-Oct': [96],
+        '03-Oct': [90],
+        '29-Sep': [100],
+    })
+
+    whiskey = server.parse_tabular_format(sheet)[0]
+
+    assert (whiskey['D1_date'], whiskey['DL_date']) == ('29-Sep', '03-Oct')
+    assert list(whiskey['daily_sales']) == ['29-Sep', '01-Oct', '03-Oct']
+    assert whiskey['total_sales_qty'] == 10
+    assert whiskey['days_analyzed'] == 5
+    assert whiskey['avg_daily_sales_qty'] == pytest.approx(2.0)
+
+
+def test_parse_date_headers_infers_years_across_new_year():
+    today = date(2026, 10, 19)
+
+    assert server.parse_date_headers(['02-Jan', 'Brand Name', '29-Dec'], today=today) == {
+        '02-Jan': date(2026, 1, 2), '29-Dec': date(2025, 12, 29),
+    }
+    # Dates after today belong to last year unless the year is configured
+    assert server.parse_date_headers(['01-Nov'], today=today) == {'01-Nov': date(2025, 11, 1)}
+    assert server.parse_date_headers(['01-Nov'], year=2026, today=today) == {'01-Nov': date(2026, 11, 1)}
+    assert server.parse_date_headers(['29-Feb', '2024-02-29', '1 Mar 2024'], today=today) == {
+        '2024-02-29': date(2024, 2, 29), '1 Mar 2024': date(2024, 3, 1),
+    }
+    assert server.parse_date_headers(['Sep 29', '29/09/2026'], formats=['%b %d'], today=today) == {
+        'Sep 29': date(2026, 9, 29),
+    }
+
+
+def test_chronological_dates_sorts_by_date_not_text():
+    assert server.chronological_dates(['01-Oct', 'Total', '29-Sep', '31-Dec', '02-Jan']) == [
+        '29-Sep', '01-Oct', '31-Dec', '02-Jan', 'Total',
+    ]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_build_brand_records_matches_row_loop(seed):
+    df = make_stock_sheet(200, 20, seed=seed)
+    df.loc[df.index[3], 'Brand Name'] = ' '
+    df['Index'] = df['Index'].astype(object)
+    df.loc[df.index[5], 'Index'] = 'A-17'
+    df.loc[df.index[6], 'Index'] = 'n/a'
+    date_columns = sorted(df.columns[4:])
+    arguments = (df, 'Brand Name', 'Index', 'Wholesale Rate', 'Selling Rate', date_columns, date_columns[7])
+
+    assert server.build_brand_records(*arguments) == row_loop_brand_records(*arguments)
+
+
+def test_parallel_brand_records_match_serial_in_row_order(monkeypatch):
+    df = make_stock_sheet(500, 20, seed=3)
+    df.loc[df.index[3], 'Brand Name'] = ' '
+    monkeypatch.setattr(server, 'BRAND_WORKERS', 3)
+    monkeypatch.setattr(server, 'PARALLEL_BRAND_ROWS', 100)
+    serial_trace, parallel_trace = server.ParseTrace(), server.ParseTrace()
+    try:
+        parallel = server.parse_tabular_format(df.copy(), parallel_trace)
+    finally:
+        server.shutdown_executors()
+    monkeypatch.setattr(server, 'BRAND_WORKERS', 0)
+
+    assert parallel == server.parse_tabular_format(df.copy(), serial_trace)
+    brand_events = [event for event in parallel_trace.events if event['event'] == 'brand']
+    assert brand_events == [event for event in serial_trace.events if event['event'] == 'brand']
+
+
+def test_build_liquor_batch_matches_model_validation(stock_sheet):
+    rows = pd.DataFrame([['Whiskey', 1, 500, 20], ['Vodka', 2, 300, 40]])
+    records = [*server.parse_tabular_format(stock_sheet), *server.parse_list_format(rows)]
+
+    documents = server.build_liquor_batch(records)
+
+    strip = lambda document: {key: (value, type(value)) for key, value in document.items() if key not in ('id', 'upload_timestamp')}
+    assert [strip(document) for document in documents] == [strip(model_liquor_document(record)) for record in records]
+    assert [list(document) for document in documents] == [list(model_liquor_document(record)) for record in records]
+    assert len({document['id'] for document in documents}) == len(records)
+    assert len({document['upload_timestamp'] for document in documents}) == 1
+
+
+def test_build_liquor_batch_rejects_what_the_model_rejects(stock_sheet):
+    records = server.parse_tabular_format(stock_sheet.assign(**{'31-Aug': 90.5}))
+
+    with pytest.raises(ValidationError):
+        server.build_liquor_batch(records)
+
+
+def test_parse_trace_records_d1_and_dl_decisions(stock_sheet, tmp_path):
+    trace_file = tmp_path / 'trace.jsonl'
+    trace = server.ParseTrace(path=str(trace_file))
+    server.parse_tabular_format(stock_sheet, trace)
+    trace.close()
+
+    events = {}
+    for event in trace.events:
+        events.setdefault(event['event'], []).append(event)
+    assert events['d1_found'] == [{
+        'event': 'd1_found', 'date': '28-Aug', 'brand': 'Royal Rum Deluxe',
+        'prev_stock': 90.0, 'curr_stock': 187.0, 'increase': 97.0,
+    }]
+    assert [event['DL_date'] for event in events['brand']] == ['31-Aug'] * 4 + ['30-Aug']
+    assert len(trace_file.read_text().splitlines()) == len(trace.events)
+
+
+def test_parse_trace_buffer_is_bounded(stock_sheet):
+    trace = server.ParseTrace(max_events=3)
+    server.parse_tabular_format(stock_sheet, trace)
+
+    assert len(trace.events) == 3
+    assert trace.dropped > 0
+    assert trace.events[-1]['event'] == 'parsed'
+
+
+def test_disabled_trace_records_nothing(stock_sheet):
+    server.parse_tabular_format(stock_sheet)
+
+    assert len(server.NULL_TRACE.events) == 0
+
+
+def _to_bytes(df, file_format, **kwargs):
+    buffer = io.BytesIO()
+    if file_format == 'csv':
+        df.to_csv(buffer, index=False, **kwargs)
+    else:
+        df.to_excel(buffer, index=False, **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('file_format', ['xlsx', 'csv'])
+def test_parse_excel_data_decodes_upload_once(stock_sheet, file_format, monkeypatch):
+    reads = []
+    for reader in ('read_excel', 'read_csv'):
+        original = getattr(pd, reader)
+        monkeypatch.setattr(pd, reader, lambda *args, _original=original, **kwargs: reads.append(1) or _original(*args, **kwargs))
+    content = _to_bytes(stock_sheet, file_format)
+
+    assert server.detect_upload_format(content) == file_format
+    assert server.parse_excel_data(content) == server.parse_tabular_format(stock_sheet.copy())
+    assert len(reads) == 1
+
+
+def test_parse_excel_data_reads_headerless_list_format():
+    rows = pd.DataFrame([['Whiskey', 1, 500, 20], ['Vodka', 2, 300, 40]])
+
+    records = server.parse_excel_data(_to_bytes(rows, 'xlsx', header=False))
+
+    assert [(record['brand_name'], record['rate'], record['current_stock_qty']) for record in records] == [
+        ('Whiskey', 500.0, 20), ('Vodka', 300.0, 40),
+    ]
+    assert [record['index_number'] for record in records] == [1, 2]
+
+
+def test_normalize_index_numbers_falls_back_per_cell():
+    cells = pd.Series([101, 'A-17', 'n/a', None, 2.0, ' 42 '], dtype=object)
+
+    index_numbers = server.normalize_index_numbers(cells, range(1, 7))
+
+    assert index_numbers.dtype == 'int64'
+    assert index_numbers.tolist() == [101, 17, 3, 4, 2, 42]
+    with pytest.raises(OverflowError):
+        server.normalize_index_numbers(pd.Series(['9' * 20]), [1])
+
+
+def test_filter_brand_rows_drops_repeated_headers_and_totals():
+    df = pd.DataFrame({'Brand Name': ['Whiskey', 'BRAND NAME', 'Grand Total', None, 'Brand', 'Brandy']})
+
+    assert server.filter_brand_rows(df, 'Brand Name')['Brand Name'].tolist() == ['Whiskey', 'Brandy']
+
+
+def test_promote_header_row_matches_pandas_header_mode():
+    content = _to_bytes(pd.DataFrame([['a', None, 'Rate', 'Rate'], [1, 2.5, 3, 'x']]), 'xlsx', header=False)
+
+    promoted = server.promote_header_row(pd.read_excel(io.BytesIO(content), header=None))
+
+    pd.testing.assert_frame_equal(promoted, pd.read_excel(io.BytesIO(content)))
+
+
+@pytest.mark.parametrize('file_format', ['xlsx', 'csv'])
+def test_streamed_upload_matches_in_memory_parse(stock_sheet, file_format, monkeypatch):
+    stock_sheet.loc[5] = [600, 'Premium Whiskey Gold', 450, 500, 130, 125, 120, 115, 110, 105, 100]
+    content = _to_bytes(stock_sheet, file_format)
+    monkeypatch.setattr(server, 'STREAM_CHUNK_ROWS', 2)
+
+    batches = list(server.parse_upload_stream(io.BytesIO(content)))
+
+    assert [len(batch) for batch in batches] == [2, 2, 2]
+    assert [record for batch in batches for record in batch] == server.parse_excel_data(content)
+
+
+def test_streamed_upload_parses_list_format_in_memory():
+    content = _to_bytes(pd.DataFrame([['Whiskey', 1, 500, 20], ['Vodka', 2, 300, 40]]), 'csv', header=False)
+
+    assert list(server.parse_upload_stream(io.BytesIO(content))) == [server.parse_excel_data(content)]
+
+
+def test_streamed_upload_reports_unreadable_xlsx_as_bad_request():
+    with pytest.raises(server.HTTPException) as error:
+        list(server.parse_upload_stream(io.BytesIO(server.XLSX_MAGIC + b'not a workbook')))
+
+    assert error.value.status_code == 400
+    assert error.value.detail.startswith('Unable to parse file')
+
+
+def test_streamed_upload_reports_malformed_csv_rows_as_bad_request(stock_sheet, monkeypatch):
+    content = _to_bytes(stock_sheet, 'csv') + b'999,Broken Row,1,2,3,4,5,6,7,8,9,10,11,12\n'
+    monkeypatch.setattr(server, 'STREAM_CHUNK_ROWS', 2)
+
+    with pytest.raises(server.HTTPException) as error:
+        list(server.parse_upload_stream(io.BytesIO(content)))
+
+    assert error.value.status_code == 400
+
+
+def test_find_global_d1_uses_last_row_of_a_duplicated_brand(stock_sheet):
+    date_columns = sorted(stock_sheet.columns[4:])
+    # A later Royal Rum Deluxe row without the restock replaces the one that has it
+    stock_sheet.loc[5] = [351, 'Royal Rum Deluxe', 900, 1000, 95, 92, 90, 88, 85, 82, 80]
+
+    assert server.find_global_d1(stock_sheet, 'Brand Name', date_columns) == '25-Aug'
+    assert server.find_global_d1(stock_sheet.iloc[:5], 'Brand Name', date_columns) == '28-Aug'
+
+
+def appended_documents(sheet, date_label, key='brand_name'):
+    """Documents of `sheet` parsed without its `date_label` column, then with that day appended"""
+    records = server.parse_tabular_format(sheet.drop(columns=date_label))
+    day = sheet.set_index('Brand Name' if key == 'brand_name' else 'Index')[date_label].dropna()
+    snapshot = server.StockSnapshot(date=date_label, stock={str(k): int(v) for k, v in day.items()}, key=key)
+    return server.build_appended_documents(records, snapshot)
+
+
+def comparable(documents):
+    return [{k: v for k, v in document.items() if k not in ('id', 'upload_timestamp')} for document in documents]
+
+
+@pytest.mark.parametrize('key', ['brand_name', 'index_number'])
+def test_appending_a_day_matches_parsing_the_whole_sheet(stock_sheet, key):
+    result = appended_documents(stock_sheet, '31-Aug', key)
+
+    # Heritage Brandy Reserve has no stock for the day and keeps its DL on 30-Aug
+    assert (result['matched_brands'], result['unmatched_keys'], result['rescanned_brands']) == (4, [], 0)
+    assert comparable(result['documents']) == comparable(server.build_liquor_batch(server.parse_tabular_format(stock_sheet)))
+
+
+def test_first_restock_in_an_appended_day_rescans_every_brand(stock_sheet):
+    sheet = stock_sheet.drop(columns=['29-Aug', '30-Aug', '31-Aug'])
+    result = appended_documents(sheet, '28-Aug')
+
+    assert result['rescanned_brands'] == 5
+    assert {document['D1_date'] for document in result['documents']} == {'28-Aug'}
+    assert comparable(result['documents']) == comparable(server.build_liquor_batch(server.parse_tabular_format(sheet)))
+
+
+def test_appended_day_must_be_new_and_later(stock_sheet):
+    records = server.parse_tabular_format(stock_sheet)
+    for date_label, message in (('31-Aug', 'already been uploaded'), ('24-Aug', 'after 31-Aug'), ('Monday', 'not a date')):
+        with pytest.raises(server.HTTPException) as error:
+            server.append_stock_column(records, date_label, {0: 80})
+        assert message in error.value.detail
+
+    snapshot = server.StockSnapshot(date='01-Sep', stock={'Unknown Brand': 5, 'Premium Whiskey Gold': 85})
+    assert server.build_appended_documents(records, snapshot)['unmatched_keys'] == ['Unknown Brand']